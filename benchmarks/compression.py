@@ -0,0 +1,95 @@
+"""
+Report how much page compression saves on the books from `books/` and
+what it costs to read a page. For every book and codec the pages are
+compressed like uploaded books are, then:
+
+- the ratio is the size of the UTF-8 pages divided by the size of the
+  compressed pages together with the dictionary;
+- the table size is what the pages take in Postgres, heap and TOAST,
+  measured in a temporary table, so it shows how many more pages fit
+  into shared buffers. Plain texts longer than about 2 KB are already
+  compressed by TOAST, which is why this number matters more;
+- the decode latency is the time to decompress one page, which is paid
+  on a page cache miss.
+
+    python -m benchmarks.compression --codecs zlib zstd --repeat 20
+"""
+import argparse
+import asyncio
+import glob
+import os
+import statistics
+import time
+
+from database.compression import compress_book, make_codec, zstandard
+from database.database import bot_database as db
+from services.file_handling import prepare_book
+
+plain_table_query = '''
+CREATE TEMP TABLE plain_pages (page_no integer, text text);
+'''
+
+compressed_table_query = '''
+CREATE TEMP TABLE compressed_pages (page_no integer, data bytea);
+ALTER TABLE compressed_pages ALTER COLUMN data SET STORAGE EXTERNAL;
+'''
+
+
+async def table_size(conn, table: str, column: str, records: list[tuple]) -> int:
+    await conn.execute(f"TRUNCATE {table};")
+    await conn.copy_records_to_table(table, records=records, columns=('page_no', column))
+    return await conn.fetchval("SELECT pg_total_relation_size($1::regclass);", table)
+
+
+def decode_latencies(codec_name: str, zdict: bytes | None, pages: list[bytes], repeat: int) -> list[float]:
+    codec = make_codec(codec_name, zdict)
+    latencies = []
+    for _ in range(repeat):
+        for data in pages:
+            started = time.perf_counter()
+            codec.decompress(data)
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def main(codecs: list[str], dict_size: int, repeat: int) -> None:
+    await db.connect()
+    try:
+        async with db.pool.acquire() as conn:
+            await conn.execute(plain_table_query)
+            await conn.execute(compressed_table_query)
+            for path in sorted(glob.glob('books/*.txt')):
+                with open(path, encoding='utf-8') as file:
+                    pages = prepare_book(file.read())
+                raw_size = sum(len(page.encode()) for page in pages)
+                plain_size = await table_size(conn, 'plain_pages', 'text', list(enumerate(pages, start=1)))
+                print(f'{os.path.basename(path)}: {len(pages)} pages, {raw_size / 1024:.0f} KB of text, '
+                      f'{plain_size / 1024:.0f} KB in Postgres as plain text')
+
+                for codec_name in codecs:
+                    started = time.perf_counter()
+                    compressed = compress_book(pages, codec_name, dict_size)
+                    elapsed = time.perf_counter() - started
+                    size = await table_size(
+                        conn, 'compressed_pages', 'data', list(enumerate(compressed.pages, start=1))
+                    )
+                    size += len(compressed.zdict or b'')
+                    latencies = decode_latencies(codec_name, compressed.zdict, compressed.pages, repeat)
+                    quantiles = statistics.quantiles(latencies, n=100)
+                    dictionary = f'{len(compressed.zdict) // 1024} KB dictionary' if compressed.zdict else 'no dictionary'
+                    print(f'  {codec_name} ({dictionary}): ratio {raw_size / compressed.size:.2f}, '
+                          f'{size / 1024:.0f} KB in Postgres ({plain_size / size:.2f}x less), '
+                          f'compressed in {elapsed * 1000:.0f}ms, decode per page: '
+                          f'p50 {quantiles[49] * 1e6:.1f}us, p99 {quantiles[98] * 1e6:.1f}us')
+    finally:
+        await db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--codecs', nargs='+', choices=('zlib', 'zstd'),
+                        default=['zlib', 'zstd'] if zstandard is not None else ['zlib'])
+    parser.add_argument('--dict-size', type=int, default=16384, help='0 disables dictionaries')
+    parser.add_argument('--repeat', type=int, default=20, help='how many times every page is decoded')
+    args = parser.parse_args()
+    asyncio.run(main(args.codecs, args.dict_size, args.repeat))
@@ -0,0 +1,108 @@
+"""
+Report how well the encodings of uploaded books are detected and what
+decoding costs. Every book from `books/` is written in every encoding,
+with Windows line endings, the way Russian .txt files are found on the
+web, and read back like an uploaded file:
+
+- the book is detected if the text read by `read_text` is the text
+  written, normalized. A codec name differing from the written one is
+  fine if it decodes the same, e.g. cp1125 for cp866;
+- the throughput is for `read_text` alone and for `paginate_file`, in
+  megabytes of the file a second;
+- the peak memory of `read_text` is measured with `tracemalloc` on the
+  largest book repeated `--sizes` times, it shouldn't grow with the size.
+
+    python -m benchmarks.encodings --repeat 5
+"""
+import argparse
+import glob
+import os
+import tempfile
+import time
+import tracemalloc
+
+from services.file_handling import BadBookError, TextNormalizer, detect_encoding, paginate_file, read_text
+
+ENCODINGS = ('utf-8', 'utf-8-sig', 'utf-16', 'cp1251', 'koi8-r', 'cp866', 'mac-cyrillic', 'iso8859-5')
+
+
+def write_temp(data: bytes) -> str:
+    with tempfile.NamedTemporaryFile(suffix='.txt', delete=False) as file:
+        file.write(data)
+    return file.name
+
+
+def normalize(text: str) -> str:
+    normalizer = TextNormalizer()
+    return normalizer.feed(text) + normalizer.close()
+
+
+def best_time(call, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - started)
+    return min(durations)
+
+
+def peak_memory(path: str) -> int:
+    tracemalloc.start()
+    try:
+        for _ in read_text(path):
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main(encodings: list[str], repeat: int, sizes: list[int]) -> None:
+    books = {}
+    for path in sorted(glob.glob('books/*.txt')):
+        with open(path, encoding='utf-8-sig') as file:
+            books[os.path.basename(path)] = file.read().replace('\n', '\r\n')
+
+    detected = total = 0
+    for encoding in encodings:
+        read_speeds, paginate_speeds, guesses = [], [], set()
+        for name, text in books.items():
+            data = text.encode(encoding, errors='replace')
+            path = write_temp(data)
+            try:
+                guesses.add(detect_encoding(data[:65536]))
+                try:
+                    ok = ''.join(read_text(path)) == normalize(data.decode(encoding))
+                except BadBookError:
+                    ok = False
+                if not ok:
+                    print(f'  {name}: not detected')
+                detected += ok
+                total += 1
+                size = len(data) / 1e6
+                read_speeds.append(size / best_time(lambda: [None for _ in read_text(path)], repeat))
+                paginate_speeds.append(size / best_time(lambda: paginate_file(path), repeat))
+            finally:
+                os.remove(path)
+        print(f'{encoding}: detected as {", ".join(sorted(guesses))}, '
+              f'read_text {min(read_speeds):.1f}-{max(read_speeds):.1f} MB/s, '
+              f'paginate_file {min(paginate_speeds):.1f}-{max(paginate_speeds):.1f} MB/s')
+    print(f'Detected {detected} of {total}')
+
+    name, text = max(books.items(), key=lambda item: len(item[1]))
+    for times in sizes:
+        data = (text * times).encode('cp1251', errors='replace')
+        path = write_temp(data)
+        try:
+            print(f'{name} x{times} in cp1251, {len(data) / 1e6:.1f} MB: '
+                  f'read_text peak memory {peak_memory(path) / 1024:.0f} KB')
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--encodings', nargs='+', default=list(ENCODINGS))
+    parser.add_argument('--repeat', type=int, default=5, help='the best of this many reads is reported')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+    main(args.encodings, args.repeat, args.sizes)
@@ -0,0 +1,97 @@
+"""
+Measure the latency of library lookups while the number of users and
+books grows. Synthetic users, each with `--books-per-user` books without
+pages, are added in steps up to `--users`, and after every step the
+queries behind `book_exists` and `get_books` are timed for random
+users. The synthetic rows are deleted afterwards.
+
+It writes up to a million rows, so better run it against a scratch
+database migrated by `scripts.migrate`:
+
+    python -m benchmarks.library --users 100000 --books-per-user 10
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from database.database import bot_database as db
+
+# Telegram user ids are positive, so the synthetic users can't be real ones
+FIRST_USER_ID = -1_900_000_000
+BOOK_PREFIX = 'benchmark library'
+
+fill_query = '''
+WITH new_books AS (
+    INSERT INTO books (name, page_count)
+    SELECT $3 || ' ' || user_no || ' ' || book_no, 1
+    FROM generate_series($1::integer, $2::integer - 1) AS user_no,
+         generate_series(1, $4::integer) AS book_no
+    RETURNING id, name
+), new_users AS (
+    INSERT INTO users (user_id, current_page, current_book)
+    SELECT $5 + user_no, 1, 1
+    FROM generate_series($1::integer, $2::integer - 1) AS user_no
+)
+INSERT INTO user_books (user_id, book_id, display_name)
+SELECT $5 + split_part(name, ' ', 3)::integer, id, name
+FROM new_books;
+'''
+
+cleanup_query = "DELETE FROM users WHERE user_id >= $1 AND user_id < $2;"
+
+# the books of real users, uploaded while the benchmark is running, are left alone
+cleanup_books_query = "DELETE FROM books WHERE name LIKE $1 || ' %';"
+
+
+async def measure(users: int, books_per_user: int, lookups: int) -> dict[str, list[float]]:
+    latencies: dict[str, list[float]] = {'book_exists': [], 'get_books': []}
+    for _ in range(lookups):
+        user_no = random.randrange(users)
+        book_name = f'{BOOK_PREFIX} {user_no} {random.randint(1, books_per_user)}'
+        user_id = FIRST_USER_ID + user_no
+
+        started = time.perf_counter()
+        assert await db.user_interface.book_exists(user_id, book_name)
+        latencies['book_exists'].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        assert len(await db.user_interface.get_books(user_id)) == books_per_user
+        latencies['get_books'].append(time.perf_counter() - started)
+    return latencies
+
+
+async def main(users: int, books_per_user: int, steps: int, lookups: int) -> None:
+    await db.connect()
+    try:
+        filled = 0
+        for step in range(1, steps + 1):
+            target = users * step // steps
+            started = time.perf_counter()
+            await db.execute_query_and_commit(
+                fill_query, (filled, target, BOOK_PREFIX, books_per_user, FIRST_USER_ID)
+            )
+            await db.execute_query_and_commit("ANALYZE books, users, user_books;")
+            print(f'{target} users, {target * books_per_user} books '
+                  f'(filled in {time.perf_counter() - started:.1f}s)')
+            filled = target
+
+            for name, values in (await measure(filled, books_per_user, lookups)).items():
+                quantiles = statistics.quantiles(values, n=100)
+                print(f'  {name}: mean {statistics.mean(values) * 1000:.3f}ms, '
+                      f'p50 {quantiles[49] * 1000:.3f}ms, p95 {quantiles[94] * 1000:.3f}ms')
+    finally:
+        await db.execute_query_and_commit(cleanup_query, (FIRST_USER_ID, FIRST_USER_ID + users))
+        await db.execute_query_and_commit(cleanup_books_query, (BOOK_PREFIX,))
+        await db.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--books-per-user', type=int, default=10)
+    parser.add_argument('--steps', type=int, default=4)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.books_per_user, args.steps, args.lookups))
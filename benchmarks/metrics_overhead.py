@@ -0,0 +1,94 @@
+"""
+Measure what the metrics cost per update: the handler middleware and
+the timing wrapper of database methods. A recorded update is fed to a
+dispatcher with a handler which does nothing, with and without the
+middleware, so no database or Telegram is needed.
+
+    python -m benchmarks.metrics_overhead --updates 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Update
+
+from middlewares.metrics import HandlerMetricsMiddleware
+from services.metrics import REGISTRY, timed_methods
+
+UPDATES_PATH = 'benchmarks/data/updates.jsonl'
+
+
+class Interface:
+    async def method(self) -> None:
+        pass
+
+
+@timed_methods
+class TimedInterface:
+    async def method(self) -> None:
+        pass
+
+
+def build_dispatcher(with_metrics: bool) -> Dispatcher:
+    router = Router()
+
+    @router.callback_query()
+    async def process_callback(callback):
+        pass
+
+    dp = Dispatcher()
+    if with_metrics:
+        dp.callback_query.middleware(HandlerMetricsMiddleware())
+    dp.include_router(router)
+    return dp
+
+
+async def time_updates(dp: Dispatcher, bot: Bot, update: Update, count: int) -> float:
+    started = time.perf_counter()
+    for _ in range(count):
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / count
+
+
+async def time_calls(interface: Interface | TimedInterface, count: int) -> float:
+    started = time.perf_counter()
+    for _ in range(count):
+        await interface.method()
+    return (time.perf_counter() - started) / count
+
+
+async def main(count: int) -> None:
+    with open(UPDATES_PATH, encoding='utf-8') as file:
+        raw_updates = [json.loads(line) for line in file]
+    update = Update(**next(raw for raw in raw_updates if 'callback_query' in raw))
+    bot = Bot('123456:benchmark')
+
+    plain, instrumented = build_dispatcher(False), build_dispatcher(True)
+    # warm up both paths before measuring
+    await time_updates(plain, bot, update, 100)
+    await time_updates(instrumented, bot, update, 100)
+    plain_update = await time_updates(plain, bot, update, count)
+    instrumented_update = await time_updates(instrumented, bot, update, count)
+
+    plain_call = await time_calls(Interface(), count)
+    timed_call = await time_calls(TimedInterface(), count)
+
+    started = time.perf_counter()
+    REGISTRY.render()
+    render = time.perf_counter() - started
+    await bot.session.close()
+
+    print(f'update without metrics: {plain_update * 1e6:.1f}us, with the middleware: '
+          f'{instrumented_update * 1e6:.1f}us, overhead {(instrumented_update - plain_update) * 1e6:.1f}us')
+    print(f'database method call: {plain_call * 1e6:.2f}us, timed: {timed_call * 1e6:.2f}us, '
+          f'overhead {(timed_call - plain_call) * 1e6:.2f}us')
+    print(f'rendering /metrics: {render * 1e3:.2f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--updates', type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.updates))
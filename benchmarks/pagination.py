@@ -0,0 +1,90 @@
+"""
+Report where the pages of the books from `books/` end and what
+splitting a book into pages of another size costs:
+
+- the share of the pages ending at an empty line or a line break after
+  a sentence, at a sentence, at a comma, colon or semicolon, between
+  words and in the middle of a word, and how full the pages are on
+  average, for every size of `--sizes`;
+- the time `index_pages` takes to build the break index of a book from
+  its stored pages, once per book and all sizes, the size of the index
+  as it is stored in `book_breaks`, and the time `paginate_index` takes
+  for every size;
+- the pages of a text without punctuation and of one without any
+  whitespace, which used to be rejected as bad books.
+
+    python -m benchmarks.pagination --sizes 500 1050 2000 --repeat 5
+"""
+import argparse
+import glob
+import os
+import time
+import zlib
+
+from database.layouts import pack_positions
+from services.file_handling import (
+    CLAUSE,
+    PAGE_SIZE,
+    PARAGRAPH,
+    SENTENCE,
+    WORD,
+    index_pages,
+    paginate_index,
+    prepare_book
+)
+
+ENDS = {PARAGRAPH: 'paragraph', SENTENCE: 'sentence', CLAUSE: 'clause', WORD: 'word'}
+
+
+def best_time(call, repeat: int) -> float:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - started)
+    return min(durations)
+
+
+def main(sizes: list[int], repeat: int) -> None:
+    books = {}
+    for path in sorted(glob.glob('books/*.txt')):
+        with open(path, encoding='utf-8-sig') as file:
+            books[os.path.basename(path)] = prepare_book(file.read())
+
+    indexes = {}
+    for name, pages in books.items():
+        index = indexes[name] = index_pages(pages)
+        # as it is saved by `save_breaks`
+        stored = [pack_positions(index.positions), zlib.compress(index.kinds), pack_positions(index.page_starts)]
+        print(f'{name}: {len(pages)} pages, index_pages {best_time(lambda: index_pages(pages), repeat) * 1000:.1f} ms, '
+              f'{len(index.positions)} breaks, {sum(map(len, stored)) / 1024:.0f} KB stored')
+
+    for size in sizes:
+        ends = dict.fromkeys([*ENDS.values(), 'cut'], 0)
+        fill = 0.0
+        slowest = 0.0
+        for name, index in indexes.items():
+            starts = paginate_index(index, size)
+            kinds = dict(zip(index.positions, index.kinds))
+            # the last page is as long as the rest of the text
+            for start, end in zip(starts, starts[1:]):
+                ends[ENDS[kinds[end]] if end in kinds else 'cut'] += 1
+                fill += (end - start) / size
+            slowest = max(slowest, best_time(lambda: paginate_index(index, size), repeat))
+        pages = sum(ends.values())
+        shares = ', '.join(f'{end} {count / pages:.1%}' for end, count in ends.items())
+        print(f'{size} characters: {shares}, {fill / pages:.0%} full, '
+              f'paginate_index up to {slowest * 1000:.1f} ms')
+
+    samples = {'no punctuation': ' '.join(f'слово{i}' for i in range(10000)), 'no whitespace': 'слово' * 10000}
+    for name, text in samples.items():
+        pages = prepare_book(text)
+        print(f'{name}: {len(pages)} pages of {min(map(len, pages[:-1]))}-{max(map(len, pages))} characters')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, PAGE_SIZE, 2000, 4000])
+    parser.add_argument('--repeat', type=int, default=5, help='the best of this many runs is reported')
+    args = parser.parse_args()
+    main(args.sizes, args.repeat)
@@ -0,0 +1,468 @@
+"""
+Benchmark the reader hot paths and print the results as JSON, so runs
+on different commits can be compared.
+
+Updates are fed to a dispatcher set up like in `bot.py`, the Bot API
+calls made by the handlers are answered in-process by `FakeSession`, so
+only a local Postgres migrated by `scripts.migrate` is needed. The
+synthetic users and books are deleted afterwards.
+
+Scenarios:
+    prepare_book  paginating every book from `books/`
+    save_book     writing every book from `books/` into the database
+    page_turns    /continue, forward and backward presses of many users
+    bookmarks     building the bookmarks keyboard, alone and by /bookmarks
+    books         /books for libraries of `--library-sizes` books
+    search        /find in the largest book from `books/`, by phrases of different frequency
+    bursts        `--burst` forward presses of every reader at once, with and without adding them up
+    page_sizes    /pagesize and forward presses at every size of `--page-sizes`, in the largest book from `books/`
+
+    python -m benchmarks.suite --users 100 --concurrency 20 --output before.json
+    python -m benchmarks.suite --baseline before.json
+"""
+import argparse
+import asyncio
+import collections
+import glob
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+from benchmarks.library import fill_query
+from callback_factories.pagination import PageTurnCallbackFactory
+from database.database import bot_database as db
+from handlers import other_handlers, user_handlers
+from keyboards.bookmarks_kb import create_bookmarks_keyboard
+from lexicon.lexicon import lexicon_provider
+from middlewares.metrics import HandlerMetricsMiddleware
+from middlewares.throttling import ThrottlingMiddleware
+from services.file_handling import prepare_book
+
+# Telegram user ids are positive, so the synthetic users can't be real ones
+FIRST_USER_ID = -1_800_000_000
+BOOK_PREFIX = 'benchmark suite'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Book bot', 'username': 'book_bot'}
+SCENARIOS = ('prepare_book', 'save_book', 'page_turns', 'bookmarks', 'books', 'search', 'bursts', 'page_sizes')
+# chosen for "Crime and Punishment", the largest sample book
+SEARCH_PHRASES = {
+    'common_word': 'сказал',
+    'rare_word': 'топор',
+    'quoted_phrase': '"старуха процентщица"',
+    'missing_word': 'компьютер',
+}
+
+# aiogram caches the event type of an update by its id, equal ids make the cache compare whole updates
+update_ids = itertools.count(1)
+
+cleanup_users_query = "DELETE FROM users WHERE user_id >= $1 AND user_id < $2;"
+
+# the books of real users, uploaded while the benchmark is running, are left alone
+cleanup_books_query = "DELETE FROM books WHERE name LIKE $1 || ' %';"
+
+
+class FakeSession(BaseSession):
+    """Answers Bot API calls without the network. The request is still
+    built and serialized, so keyboards cost what they cost in production."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self.methods: collections.Counter[str] = collections.Counter()
+        # seconds every call takes, as if Telegram were on the other side of the network
+        self.latency = 0.0
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None) -> Any:
+        request = method.build_request(bot)
+        data = {key: self.prepare_value(value) for key, value in request.data.items() if value is not None}
+        self.calls += 1
+        self.methods[request.method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        content = self.json_dumps({'ok': True, 'result': self._result(request.method, data)})
+        return self.check_response(method=method, status_code=200, content=content).result
+
+    def _result(self, method: str, data: dict[str, Any]) -> Any:
+        if method in ('sendMessage', 'editMessageText'):
+            return {
+                'message_id': int(data.get('message_id') or next(self._message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': int(data['chat_id']), 'type': 'private'},
+                'from': BOT_USER,
+                'text': data.get('text', ''),
+            }
+        return True
+
+    async def stream_content(self, url, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError('files are not served by the fake session')
+        yield b''
+
+    async def close(self) -> None:
+        pass
+
+
+def message_update(user_id: int, text: str) -> Update:
+    command_length = len(text.split()[0]) if text.startswith('/') else 0
+    return Update(update_id=next(update_ids), message={
+        'message_id': 1,
+        'date': 1690000000,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Reader'},
+        'text': text,
+        'entities': [{'type': 'bot_command', 'offset': 0, 'length': command_length}] if command_length else [],
+    })
+
+
+def callback_update(user_id: int, data: str) -> Update:
+    return Update(update_id=next(update_ids), callback_query={
+        'id': str(user_id),
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'Reader'},
+        'chat_instance': '1',
+        'data': data,
+        'message': {
+            'message_id': 2,
+            'date': 1690000000,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': '...',
+        },
+    })
+
+
+def summarize(latencies: list[float]) -> dict[str, float]:
+    """Latency statistics in milliseconds."""
+    if len(latencies) < 2:
+        return {'count': len(latencies), 'mean_ms': sum(latencies) * 1000}
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        'count': len(latencies),
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': quantiles[49] * 1000,
+        'p95_ms': quantiles[94] * 1000,
+        'p99_ms': quantiles[98] * 1000,
+    }
+
+
+async def timed(call: Callable[[], Awaitable[Any]], latencies: list[float]) -> None:
+    started = time.perf_counter()
+    await call()
+    latencies.append(time.perf_counter() - started)
+
+
+def read_books() -> dict[str, str]:
+    books = {}
+    for path in sorted(glob.glob('books/*.txt')):
+        with open(path, encoding='utf-8') as file:
+            books[os.path.basename(path)] = file.read()
+    return books
+
+
+class Suite:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.session = FakeSession()
+        self.bot = Bot('123456:benchmark', parse_mode='HTML', session=self.session)
+        self.dp = Dispatcher()
+        # presses are added up, but the rate isn't limited, scenarios press faster than people
+        self.throttling = ThrottlingMiddleware(rate=0, burst=0)
+        self.set_middlewares(self.throttling, HandlerMetricsMiddleware())
+        self.dp.include_router(user_handlers.router)
+        self.dp.include_router(other_handlers.router)
+        self.texts = read_books()
+        self._user_ids = itertools.count(FIRST_USER_ID)
+
+    def set_middlewares(self, *middlewares) -> None:
+        for observer in (self.dp.message, self.dp.callback_query):
+            for middleware in list(observer.middleware):
+                observer.middleware.unregister(middleware)
+            for middleware in middlewares:
+                observer.middleware(middleware)
+
+    async def feed(self, update: Update) -> None:
+        await self.dp.feed_update(self.bot, update)
+
+    async def new_reader(self) -> int:
+        user_id = next(self._user_ids)
+        await self.feed(message_update(user_id, '/start'))
+        return user_id
+
+    async def prepare_book(self) -> dict[str, Any]:
+        results = {}
+        for name, text in self.texts.items():
+            durations = []
+            for _ in range(self.args.repeat):
+                started = time.perf_counter()
+                pages = prepare_book(text)
+                durations.append(time.perf_counter() - started)
+            results[name] = {
+                'pages': len(pages),
+                'best_ms': min(durations) * 1000,
+                'mean_ms': statistics.mean(durations) * 1000,
+                'mb_per_s': len(text.encode()) / min(durations) / 1e6,
+            }
+        return results
+
+    async def save_book(self) -> dict[str, Any]:
+        user_id = await self.new_reader()
+        results = {}
+        for name, text in self.texts.items():
+            pages = prepare_book(text)
+            latencies: list[float] = []
+            for i in range(self.args.repeat):
+                await timed(lambda: db.user_interface.save_book(user_id, f'{BOOK_PREFIX} {name} {i}', pages), latencies)
+            results[name] = {
+                'pages': len(pages),
+                **summarize(latencies),
+                'pages_per_s': len(pages) * len(latencies) / sum(latencies),
+            }
+        return results
+
+    async def page_turns(self) -> dict[str, Any]:
+        latencies: dict[str, list[float]] = {'continue': [], 'forward': [], 'backward': []}
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        forward, backward = PageTurnCallbackFactory(step=1).pack(), PageTurnCallbackFactory(step=-1).pack()
+
+        async def read(user_id: int) -> None:
+            async with semaphore:
+                await timed(lambda: self.feed(message_update(user_id, '/continue')), latencies['continue'])
+                for _ in range(self.args.turns):
+                    await timed(lambda: self.feed(callback_update(user_id, forward)), latencies['forward'])
+                # as if the reader paused for longer than the flush interval, written positions are dropped
+                await db.positions.flush()
+                for _ in range(self.args.turns):
+                    await timed(lambda: self.feed(callback_update(user_id, backward)), latencies['backward'])
+
+        user_ids = [await self.new_reader() for _ in range(self.args.users)]
+        sessions_before = db.sessions.stats()
+        started = time.perf_counter()
+        await asyncio.gather(*(read(user_id) for user_id in user_ids))
+        elapsed = time.perf_counter() - started
+
+        updates = sum(len(values) for values in latencies.values())
+        cache_stats = db.page_cache.stats()
+        session_hits = db.sessions.stats()['hits'] - sessions_before['hits']
+        session_misses = db.sessions.stats()['misses'] - sessions_before['misses']
+        return {
+            'users': self.args.users,
+            'concurrency': self.args.concurrency,
+            'updates_per_s': updates / elapsed,
+            **{kind: summarize(values) for kind, values in latencies.items()},
+            'page_cache': {'hits': cache_stats['hits'], 'misses': cache_stats['misses']},
+            'session_cache': {
+                'hits': session_hits,
+                'misses': session_misses,
+                'hit_ratio': session_hits / (session_hits + session_misses),
+            },
+        }
+
+    async def bookmarks(self) -> dict[str, Any]:
+        user_id = await self.new_reader()
+        page_count = await db.book_interface.get_length(1)
+        for page in range(1, min(self.args.bookmarks, page_count) + 1):
+            await db.user_interface.add_book_mark(user_id, 1, page)
+        previews = await db.user_interface.get_book_marks(user_id, 1)
+
+        keyboard: list[float] = []
+        for _ in range(self.args.repeat * 100):
+            started = time.perf_counter()
+            create_bookmarks_keyboard(1, previews)
+            keyboard.append(time.perf_counter() - started)
+
+        command: list[float] = []
+        for _ in range(self.args.repeat * 10):
+            await timed(lambda: self.feed(message_update(user_id, '/bookmarks')), command)
+        return {'bookmarks': len(previews), 'keyboard': summarize(keyboard), 'command': summarize(command)}
+
+    async def books(self) -> dict[str, Any]:
+        results = {}
+        for size in self.args.library_sizes:
+            user_id = next(self._user_ids)
+            # fill_query numbers the users from `FIRST_USER_ID` of its own, here it is `user_id`
+            await db.execute_query_and_commit(fill_query, (0, 1, BOOK_PREFIX, size, user_id))
+            await db.user_interface.create_if_not_exists(user_id, 1, 1, [1])
+            latencies: list[float] = []
+            for _ in range(self.args.repeat * 10):
+                await timed(lambda: self.feed(message_update(user_id, '/books')), latencies)
+            results[str(size)] = summarize(latencies)
+        return results
+
+    async def search(self) -> dict[str, Any]:
+        user_id = await self.new_reader()
+        name, text = max(self.texts.items(), key=lambda item: len(item[1]))
+        book_name = f'{BOOK_PREFIX} {name}'
+        await db.user_interface.save_book(user_id, book_name, prepare_book(text))
+        book_id = next(book.id for book in await db.user_interface.get_books(user_id) if book.name == book_name)
+        await db.user_interface.open_page(user_id, 1, book_id)
+
+        results: dict[str, Any] = {'book': name}
+        for kind, phrase in SEARCH_PHRASES.items():
+            latencies: list[float] = []
+            for _ in range(self.args.repeat * 10):
+                await timed(lambda: db.book_interface.search(book_id, phrase), latencies)
+            result = await db.book_interface.search(book_id, phrase)
+            results[kind] = {'pages_found': len(result.pages), **summarize(latencies)}
+
+        command: list[float] = []
+        for _ in range(self.args.repeat * 10):
+            await timed(lambda: self.feed(message_update(user_id, f'/find {SEARCH_PHRASES["common_word"]}')), command)
+        results['command'] = summarize(command)
+        return results
+
+    async def bursts(self) -> dict[str, Any]:
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        forward = PageTurnCallbackFactory(step=1).pack()
+
+        async def press(user_id: int, latencies: list[float]) -> None:
+            async with semaphore:
+                await self.feed(message_update(user_id, '/continue'))
+                # the burst is over when its last press is handled, added up or not
+                await timed(
+                    lambda: asyncio.gather(*(self.feed(callback_update(user_id, forward)) for _ in range(self.args.burst))),
+                    latencies
+                )
+
+        async def run() -> dict[str, Any]:
+            user_ids = [await self.new_reader() for _ in range(self.args.users)]
+            latencies: list[float] = []
+            calls_before, methods_before = self.session.calls, self.session.methods.copy()
+            await asyncio.gather(*(press(user_id, latencies) for user_id in user_ids))
+            # every reader starts at the first page of the built-in book, which is longer than any burst
+            pages = {await db.user_interface.get_current_page(user_id) for user_id in user_ids}
+            methods = self.session.methods - methods_before
+            return {
+                'presses': self.args.users * self.args.burst,
+                # /continue sends a message of its own
+                'api_calls': self.session.calls - calls_before - self.args.users,
+                'edits': methods['editMessageText'],
+                'answers': methods['answerCallbackQuery'],
+                'pages_correct': pages == {1 + self.args.burst},
+                'burst': summarize(latencies),
+            }
+
+        self.session.latency = self.args.api_latency / 1000
+        try:
+            results = {'added_up': await run()}
+            self.set_middlewares(HandlerMetricsMiddleware())
+            results['one_by_one'] = await run()
+        finally:
+            self.session.latency = 0.0
+            self.set_middlewares(self.throttling, HandlerMetricsMiddleware())
+        return results
+
+    async def page_sizes(self) -> dict[str, Any]:
+        user_id = await self.new_reader()
+        name, text = max(self.texts.items(), key=lambda item: len(item[1]))
+        book_name = f'{BOOK_PREFIX} {name}'
+        await db.user_interface.save_book(user_id, book_name, prepare_book(text))
+        book_id = next(book.id for book in await db.user_interface.get_books(user_id) if book.name == book_name)
+        forward = PageTurnCallbackFactory(step=1).pack()
+
+        results: dict[str, Any] = {'book': name}
+        for size in self.args.page_sizes:
+            await db.user_interface.open_page(user_id, 1, book_id)
+            # the pages of every size are split anew, as if nobody has read the book at this size yet
+            db.book_interface.forget_book(book_id)
+            command: list[float] = []
+            await timed(lambda: self.feed(message_update(user_id, f'/pagesize {size}')), command)
+            turns: list[float] = []
+            for _ in range(self.args.turns * 10):
+                await timed(lambda: self.feed(callback_update(user_id, forward)), turns)
+            state = await db.user_interface.turn_page(user_id, 0)
+            results[str(size)] = {
+                'pages': state.page_count,
+                'pagesize_command_ms': command[0] * 1000,
+                'forward': summarize(turns),
+            }
+        return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Any, current: Any, path: str = '') -> list[str]:
+    """Changes of latencies and throughputs against a previous run."""
+    if isinstance(baseline, dict) and isinstance(current, dict):
+        return [
+            line for key in current if key in baseline
+            for line in compare(baseline[key], current[key], f'{path}.{key}' if path else key)
+        ]
+    if isinstance(baseline, (int, float)) and isinstance(current, (int, float)) and baseline \
+            and path.endswith(('_ms', '_per_s')):
+        return [f'{path}: {baseline:.3f} -> {current:.3f} ({(current / baseline - 1) * 100:+.1f}%)']
+    return []
+
+
+async def main(args: argparse.Namespace) -> None:
+    await db.connect()
+    await lexicon_provider.load()
+    suite = Suite(args)
+    results = {}
+    try:
+        for scenario in args.scenarios:
+            print(f'Running {scenario}', file=sys.stderr)
+            results[scenario] = await getattr(suite, scenario)()
+    finally:
+        await db.execute_query_and_commit(cleanup_users_query, (FIRST_USER_ID, next(suite._user_ids)))
+        await db.execute_query_and_commit(cleanup_books_query, (BOOK_PREFIX,))
+        await db.close()
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        print(f'Compared to {args.baseline} ({baseline.get("commit")}):', file=sys.stderr)
+        for line in compare(baseline['results'], results):
+            print(f'  {line}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', metavar='scenario',
+                        help=f'some of {", ".join(SCENARIOS)}, all by default')
+    parser.add_argument('--users', type=int, default=100, help='simulated readers turning pages')
+    parser.add_argument('--concurrency', type=int, default=20, help='readers turning pages at the same time')
+    parser.add_argument('--turns', type=int, default=20, help='forward and as many backward presses per reader')
+    parser.add_argument('--burst', type=int, default=10, help='forward presses of a reader at once')
+    parser.add_argument('--api-latency', type=float, default=50, help='milliseconds a Bot API call takes in bursts')
+    parser.add_argument('--bookmarks', type=int, default=50)
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[500, 1050, 2000, 4000])
+    parser.add_argument('--library-sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--baseline', help='a JSON written by a previous run to compare with')
+    args = parser.parse_args()
+    # choices and a default don't mix for nargs='*' positionals
+    if unknown := set(args.scenarios) - set(SCENARIOS):
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+    args.scenarios = args.scenarios or list(SCENARIOS)
+    asyncio.run(main(args))
@@ -0,0 +1,206 @@
+"""
+Load test the bot in webhook mode without Telegram. The script serves a
+minimal Bot API, waits until the bot sets its webhook, and then replays
+recorded updates as many simulated users at a limited rate.
+
+Every user sends the recorded updates in order and waits until the bot
+answers one before sending the next one, so the latency is measured
+from the webhook request to the Bot API call made by the handler. The
+updates are Telegram Update objects, one JSON per line, e.g. copied from
+the getUpdates output; user and chat ids are replaced.
+
+Start the stand-in first, then the bot pointed at it:
+
+    python -m benchmarks.telegram_stand_in --users 200 --rate 2000
+    TELEGRAM_API_URL=http://127.0.0.1:8081 WEBHOOK_URL=http://127.0.0.1:8080 python bot.py
+"""
+import argparse
+import asyncio
+import copy
+import itertools
+import json
+import statistics
+import time
+from collections import Counter
+from typing import Any
+
+import aiohttp
+from aiohttp import web
+
+FIRST_USER_ID = 2_000_000_000 - 2_000_000
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Book bot', 'username': 'book_bot'}
+UPDATE_TIMEOUT = 10
+
+
+class RatePacer:
+    """Spread requests evenly, `rate` per second in total."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self._next = time.perf_counter()
+
+    async def wait(self) -> None:
+        now = time.perf_counter()
+        delay = self._next - now
+        self._next = max(self._next, now) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class StandIn:
+    def __init__(self):
+        self.calls: Counter[str] = Counter()
+        self.webhook_set = asyncio.Event()
+        self.webhook_url = ''
+        self.secret_token = ''
+        self._waiters: dict[int, asyncio.Future] = {}
+        self._message_ids = itertools.count(1)
+
+    def expect_answer(self, user_id: int) -> asyncio.Future:
+        future = self._waiters[user_id] = asyncio.get_running_loop().create_future()
+        return future
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        data = dict(await request.post())
+        self.calls[method] += 1
+
+        if method.lower() == 'setwebhook':
+            self.webhook_url = data['url']
+            self.secret_token = data.get('secret_token', '')
+            self.webhook_set.set()
+
+        user_id = self._resolve_user(data)
+        if user_id is not None:
+            future = self._waiters.pop(user_id, None)
+            if future is not None and not future.done():
+                future.set_result(method)
+
+        return web.json_response({'ok': True, 'result': self._result(method, data)})
+
+    @staticmethod
+    def _resolve_user(data: dict[str, str]) -> int | None:
+        if 'chat_id' in data:
+            return int(data['chat_id'])
+        if 'callback_query_id' in data:
+            # callback query ids are made as "<user_id>:<n>" by `personalize`
+            return int(data['callback_query_id'].split(':')[0])
+        return None
+
+    def _result(self, method: str, data: dict[str, str]) -> Any:
+        if method.lower() == 'getme':
+            return BOT_USER
+        if method.lower() in ('sendmessage', 'editmessagetext'):
+            return {
+                'message_id': int(data.get('message_id') or next(self._message_ids)),
+                'date': int(time.time()),
+                'chat': {'id': int(data['chat_id']), 'type': 'private'},
+                'from': BOT_USER,
+                'text': data.get('text', ''),
+            }
+        return True
+
+
+def personalize(update: dict[str, Any], user_id: int, update_id: int) -> dict[str, Any]:
+    update = copy.deepcopy(update)
+    update['update_id'] = update_id
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        event['from']['id'] = user_id
+        if 'chat' in event:
+            event['chat']['id'] = user_id
+        if 'message' in event:
+            event['message']['chat']['id'] = user_id
+        if 'id' in event and 'chat_instance' in event:
+            event['id'] = f'{user_id}:{update_id}'
+    return update
+
+
+async def simulate_user(
+        session: aiohttp.ClientSession,
+        stand_in: StandIn,
+        pacer: RatePacer,
+        updates: list[dict[str, Any]],
+        user_id: int,
+        update_ids: itertools.count,
+        latencies: list[float],
+        failures: Counter[str]
+) -> None:
+    headers = {'X-Telegram-Bot-Api-Secret-Token': stand_in.secret_token} if stand_in.secret_token else {}
+    for update in updates:
+        await pacer.wait()
+        answered = stand_in.expect_answer(user_id)
+        started = time.perf_counter()
+        try:
+            async with session.post(
+                    stand_in.webhook_url,
+                    json=personalize(update, user_id, next(update_ids)),
+                    headers=headers
+            ) as response:
+                if response.status != 200:
+                    failures[f'HTTP {response.status}'] += 1
+                    continue
+        except aiohttp.ClientError as error:
+            # the bot is stopping or gone, the rest of the updates of the user are skipped
+            failures[type(error).__name__] += 1
+            return
+        try:
+            await asyncio.wait_for(answered, UPDATE_TIMEOUT)
+        except asyncio.TimeoutError:
+            failures['no answer'] += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+async def main(updates_path: str, users: int, rate: float, host: str, port: int) -> None:
+    with open(updates_path, encoding='utf-8') as file:
+        updates = [json.loads(line) for line in file if line.strip()]
+
+    stand_in = StandIn()
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', stand_in.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f'Bot API stand-in is listening on http://{host}:{port}, waiting for the bot to set a webhook')
+
+    try:
+        await stand_in.webhook_set.wait()
+        print(f'Replaying {len(updates)} updates for {users} users to {stand_in.webhook_url}')
+
+        latencies: list[float] = []
+        failures: Counter[str] = Counter()
+        pacer = RatePacer(rate)
+        update_ids = itertools.count(1)
+        connector = aiohttp.TCPConnector(limit=users)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            started = time.perf_counter()
+            await asyncio.gather(*(
+                simulate_user(session, stand_in, pacer, updates, FIRST_USER_ID + i, update_ids, latencies, failures)
+                for i in range(users)
+            ))
+            elapsed = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+
+    total = users * len(updates)
+    print(f'{total} updates in {elapsed:.2f}s: {len(latencies) / elapsed:.0f} answered updates/s')
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f'latency from webhook to answer: p50 {quantiles[49] * 1000:.2f}ms, '
+              f'p95 {quantiles[94] * 1000:.2f}ms, p99 {quantiles[98] * 1000:.2f}ms')
+    if failures:
+        print('failures:', dict(failures))
+    print('Bot API calls:', dict(stand_in.calls))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--updates', default='benchmarks/data/updates.jsonl')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=1000, help='updates per second in total')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+    asyncio.run(main(args.updates, args.users, args.rate, args.host, args.port))
@@ -2,11 +2,24 @@ import asyncio
 import logging
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
-from config_data.config import BOT_TOKEN
+from config_data.config import (
+    BOT_TOKEN, TELEGRAM_API_URL, WEBHOOK_URL, METRICS_HOST, METRICS_PORT,
+    USER_RATE_LIMIT, USER_RATE_BURST, RETRY_AFTER_MAX_DELAY
+)
+from database.database import bot_database
 from handlers import other_handlers, user_handlers
 from keyboards.main_menu import set_main_menu
-from scripts.setup_db import setup_db
+from lexicon.lexicon import lexicon_provider
+from middlewares.metrics import HandlerMetricsMiddleware
+from middlewares.retry_after import RetryAfterMiddleware
+from middlewares.throttling import ThrottlingMiddleware
+from scripts.migrate import apply_migrations
+from services.ingestion import book_ingestion
+from services.metrics import start_metrics_server
+from services.webhook import run_webhook
 
 logger = logging.getLogger(__name__)
 
@@ -20,20 +33,49 @@ async def main():
 
     logger.info('Starting bot')
 
-    # WARNING: This will delete all existing tables and will
-    # re-fill the data for the bot's lexicon. See docstring
-    setup_db()
+    await bot_database.connect()
+    await apply_migrations()
+    await lexicon_provider.load()
+    await lexicon_provider.start()
 
-    bot: Bot = Bot(token=BOT_TOKEN, parse_mode='HTML')
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot: Bot = Bot(token=BOT_TOKEN, parse_mode='HTML', session=session)
+    bot.session.middleware(RetryAfterMiddleware(RETRY_AFTER_MAX_DELAY))
     dp: Dispatcher = Dispatcher()
 
     await set_main_menu(bot)
+    await book_ingestion.start(bot)
+
+    # inner middlewares of the dispatcher wrap the handlers of all routers,
+    # the first registered is the outermost, so handlers skipped by throttling aren't measured
+    # only button presses are limited, messages are always answered
+    dp.callback_query.middleware(ThrottlingMiddleware(USER_RATE_LIMIT, USER_RATE_BURST))
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
 
     dp.include_router(user_handlers.router)
     dp.include_router(other_handlers.router)
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(dp, bot)
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await book_ingestion.stop()
+        # the session may be opened again to tell the users about unprocessed books
+        await bot.session.close()
+        await lexicon_provider.stop()
+        await bot_database.close()
 
 
 if __name__ == '__main__':
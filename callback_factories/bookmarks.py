@@ -0,0 +1,16 @@
+from aiogram.filters.callback_data import CallbackData
+
+
+class BookmarkCallbackFactory(CallbackData, prefix='m'):
+    book_id: int
+    page: int
+
+
+class DelBookmarkCallbackFactory(CallbackData, prefix='dm'):
+    book_id: int
+    page: int
+
+
+class AddBookmarkCallbackFactory(CallbackData, prefix='am'):
+    book_id: int
+    page: int
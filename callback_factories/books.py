@@ -0,0 +1,9 @@
+from aiogram.filters.callback_data import CallbackData
+
+
+class BookCallbackFactory(CallbackData, prefix='b'):
+    book_id: int
+
+
+class DelBookCallbackFactory(CallbackData, prefix='db'):
+    book_id: int
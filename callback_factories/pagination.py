@@ -0,0 +1,6 @@
+from aiogram.filters.callback_data import CallbackData
+
+
+class PageTurnCallbackFactory(CallbackData, prefix='t'):
+    # 1 for the forward button, -1 for the backward one
+    step: int
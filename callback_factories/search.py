@@ -0,0 +1,11 @@
+from aiogram.filters.callback_data import CallbackData
+
+
+class FoundPageCallbackFactory(CallbackData, prefix='f'):
+    book_id: int
+    page: int
+
+
+class SearchPageCallbackFactory(CallbackData, prefix='fs'):
+    # index of the first result shown on the keyboard
+    offset: int
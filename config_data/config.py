@@ -15,21 +15,25 @@ class ImproperlyConfigured(Exception):
         super().__init__(self.message, *args, **kwargs)
 
 
-def get_env_variable(var_name: str) -> str:
+def get_env_variable(var_name: str, default: str | None = None) -> str:
     """Get an environment variable or raise an exception.
 
     Args:
         var_name: a name of a environment variable.
+        default: a value to use if the environment variable is not set.
 
     Returns:
         A value of the environment variable.
 
     Raises:
-        ImproperlyConfigured: if the environment variable is not set.
+        ImproperlyConfigured: if the environment variable is not set
+            and there is no default value.
     """
     try:
         return os.environ[var_name]
     except KeyError:
+        if default is not None:
+            return default
         raise ImproperlyConfigured(var_name)
 
 
@@ -40,3 +44,72 @@ DB_PORT: str = get_env_variable('DB_PORT')
 DB_NAME: str = get_env_variable('DB_NAME')
 DB_USER: str = get_env_variable('DB_USER')
 DB_PASSWORD: str = get_env_variable('DB_PASSWORD')
+
+DB_POOL_MIN_SIZE: int = int(get_env_variable('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE: int = int(get_env_variable('DB_POOL_MAX_SIZE', '10'))
+DB_STATEMENT_CACHE_SIZE: int = int(get_env_variable('DB_STATEMENT_CACHE_SIZE', '100'))
+DB_ACQUIRE_TIMEOUT: float = float(get_env_variable('DB_ACQUIRE_TIMEOUT', '5'))
+DB_COMMAND_TIMEOUT: float = float(get_env_variable('DB_COMMAND_TIMEOUT', '10'))
+
+PAGE_CACHE_MAX_BYTES: int = int(get_env_variable('PAGE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+PAGE_CACHE_READ_AHEAD: int = int(get_env_variable('PAGE_CACHE_READ_AHEAD', '5'))
+
+# Pages of new books are stored compressed with zlib or zstd (needs the zstandard package)
+# if set, with a dictionary of up to PAGE_COMPRESSION_DICT_SIZE bytes built for every book.
+# PAGE_COMPRESSION_LEVEL=0 is the default level of the codec
+PAGE_COMPRESSION: str = get_env_variable('PAGE_COMPRESSION', '')
+PAGE_COMPRESSION_LEVEL: int = int(get_env_variable('PAGE_COMPRESSION_LEVEL', '0'))
+PAGE_COMPRESSION_DICT_SIZE: int = int(get_env_variable('PAGE_COMPRESSION_DICT_SIZE', '16384'))
+
+# Several copies of the bot may share the webhook behind a load balancer, then the updates of
+# a reader alternate between them, and neither the session cache nor the position buffer is on by default
+_REPLICATED: bool = bool(get_env_variable('WEBHOOK_URL', ''))
+
+# The current book, page and bookmarks of a reader are cached for SESSION_TTL seconds
+# after they are read, a change made by another copy of the bot is seen that late. 0 disables the cache
+SESSION_TTL: float = float(get_env_variable('SESSION_TTL', '0' if _REPLICATED else '900'))
+SESSION_CACHE_SIZE: int = int(get_env_variable('SESSION_CACHE_SIZE', '100000'))
+# The last /find result of a reader is kept for SEARCH_TTL seconds, its keyboard is paged through meanwhile
+SEARCH_TTL: float = float(get_env_variable('SEARCH_TTL', '900'))
+SEARCH_CACHE_SIZE: int = int(get_env_variable('SEARCH_CACHE_SIZE', '10000'))
+
+# Reading positions are written to the database in batches, so up to POSITION_FLUSH_INTERVAL
+# seconds of reading progress may be lost on a crash. 0 writes the position with every page turn
+POSITION_FLUSH_INTERVAL: float = float(get_env_variable('POSITION_FLUSH_INTERVAL', '0' if _REPLICATED else '5'))
+POSITION_FLUSH_BATCH: int = int(get_env_variable('POSITION_FLUSH_BATCH', '500'))
+
+# A user's button presses are handled at most USER_RATE_LIMIT a second on average, USER_RATE_BURST in a row,
+# page turns over the limit wait and add up, other presses are refused. Messages aren't limited. 0 disables the limit
+USER_RATE_LIMIT: float = float(get_env_variable('USER_RATE_LIMIT', '3'))
+USER_RATE_BURST: int = int(get_env_variable('USER_RATE_BURST', '10'))
+# Bot API calls rejected by the flood control are repeated if Telegram asks to wait up to this long (seconds)
+RETRY_AFTER_MAX_DELAY: float = float(get_env_variable('RETRY_AFTER_MAX_DELAY', '10'))
+
+# Bot API doesn't let bots download files larger than 20 MB
+MAX_BOOK_SIZE: int = int(get_env_variable('MAX_BOOK_SIZE', str(20 * 1024 * 1024)))
+DOWNLOAD_TIMEOUT: int = int(get_env_variable('DOWNLOAD_TIMEOUT', '60'))
+
+INGESTION_WORKERS: int = int(get_env_variable('INGESTION_WORKERS', '2'))
+INGESTION_QUEUE_SIZE: int = int(get_env_variable('INGESTION_QUEUE_SIZE', '50'))
+
+# Updates are received with long polling unless WEBHOOK_URL is set
+WEBHOOK_URL: str = get_env_variable('WEBHOOK_URL', '')
+WEBHOOK_PATH: str = get_env_variable('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET: str = get_env_variable('WEBHOOK_SECRET', '')
+WEBAPP_HOST: str = get_env_variable('WEBAPP_HOST', '0.0.0.0')
+WEBAPP_PORT: int = int(get_env_variable('WEBAPP_PORT', '8080'))
+MAX_CONCURRENT_UPDATES: int = int(get_env_variable('MAX_CONCURRENT_UPDATES', '100'))
+SHUTDOWN_TIMEOUT: float = float(get_env_variable('SHUTDOWN_TIMEOUT', '30'))
+
+# A local Bot API server or a stand-in for load testing, the official server by default
+TELEGRAM_API_URL: str = get_env_variable('TELEGRAM_API_URL', '')
+
+# The lexicon is read from this file on startup and kept in sync with the database
+LEXICON_SNAPSHOT_PATH: str = get_env_variable('LEXICON_SNAPSHOT_PATH', 'lexicon/snapshot.json')
+# Changes are announced with NOTIFY, the version is also checked this often (seconds)
+LEXICON_CHECK_INTERVAL: float = float(get_env_variable('LEXICON_CHECK_INTERVAL', '60'))
+
+# Prometheus metrics are served on http://METRICS_HOST:METRICS_PORT/metrics if the port is set,
+# they are off by default, so the bot doesn't clash with another exporter on the host
+METRICS_HOST: str = get_env_variable('METRICS_HOST', '127.0.0.1')
+METRICS_PORT: int = int(get_env_variable('METRICS_PORT', '0'))
@@ -0,0 +1,162 @@
+"""
+Optional compression of page texts.
+
+With `PAGE_COMPRESSION` set to `zlib` or `zstd`, the pages of new books
+are stored compressed in `book_pages.data` instead of `book_pages.text`,
+and the codec with its dictionary is stored in the `books` row. Pages of
+a book share a dictionary built from the book itself, which is kept only
+if the compressed book together with the dictionary gets smaller. Books
+saved before keep their plain text, both kinds of rows are read
+transparently by `BookInterface.get_page`.
+
+zlib is always available, zstd needs the optional `zstandard` package.
+"""
+import zlib
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from config_data.config import PAGE_COMPRESSION, PAGE_COMPRESSION_LEVEL, PAGE_COMPRESSION_DICT_SIZE
+
+CODECS = ('zlib', 'zstd')
+
+# zlib can't look further back than its 32 KB window, so a longer dictionary is useless
+ZLIB_MAX_DICT_SIZE = 32 * 1024
+
+
+class PageCodec(ABC):
+    name: str
+
+    @abstractmethod
+    def compress(self, text: str) -> bytes:
+        ...
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> str:
+        ...
+
+
+class ZlibCodec(PageCodec):
+    name = 'zlib'
+
+    def __init__(self, level: int = 0, zdict: bytes | None = None):
+        # 0 means the default level of the codec, for zlib itself it means no compression
+        self.level = level or zlib.Z_DEFAULT_COMPRESSION
+        self.zdict = zdict
+
+    def compress(self, text: str) -> bytes:
+        if self.zdict is None:
+            return zlib.compress(text.encode(), self.level)
+        compressor = zlib.compressobj(self.level, zdict=self.zdict)
+        return compressor.compress(text.encode()) + compressor.flush()
+
+    def decompress(self, data: bytes) -> str:
+        if self.zdict is None:
+            return zlib.decompress(data).decode()
+        decompressor = zlib.decompressobj(zdict=self.zdict)
+        return (decompressor.decompress(data) + decompressor.flush()).decode()
+
+
+class ZstdCodec(PageCodec):
+    name = 'zstd'
+
+    def __init__(self, level: int = 0, zdict: bytes | None = None):
+        self.zdict = zdict
+        dict_data = zstandard.ZstdCompressionDict(zdict) if zdict is not None else None
+        # the contexts are reused, preparing a dictionary for every page would cost more than the page
+        self._compressor = zstandard.ZstdCompressor(level=level or 3, dict_data=dict_data)
+        self._decompressor = zstandard.ZstdDecompressor(dict_data=dict_data)
+
+    def compress(self, text: str) -> bytes:
+        return self._compressor.compress(text.encode())
+
+    def decompress(self, data: bytes) -> str:
+        return self._decompressor.decompress(data).decode()
+
+
+def make_codec(name: str, zdict: bytes | None = None, level: int = PAGE_COMPRESSION_LEVEL) -> PageCodec:
+    if name == 'zlib':
+        return ZlibCodec(level, zdict)
+    if name == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('Install the zstandard package to use zstd compression')
+        return ZstdCodec(level, zdict)
+    raise ValueError(f'Unknown page compression codec {name!r}')
+
+
+if PAGE_COMPRESSION:
+    # a typo in the settings is reported on startup, not by the first uploaded book
+    make_codec(PAGE_COMPRESSION)
+
+
+@dataclass
+class CompressedBook:
+    codec: str
+    zdict: bytes | None
+    pages: list[bytes]
+
+    @property
+    def size(self) -> int:
+        return sum(map(len, self.pages)) + len(self.zdict or b'')
+
+
+def build_dictionary(codec_name: str, pages: list[str], size: int) -> bytes | None:
+    """Build a dictionary of about `size` bytes for the pages of a book.
+
+    zstd trains it on the pages. zlib has no trainer, but it only needs
+    text which is likely to repeat, so the dictionary is made of slices
+    taken evenly across the book.
+    """
+    samples = [page.encode() for page in pages if page]
+    if size <= 0 or not samples:
+        return None
+
+    if codec_name == 'zstd':
+        try:
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            # too few or too small pages to train on
+            return None
+
+    size = min(size, ZLIB_MAX_DICT_SIZE)
+    slice_size = max(size // len(samples), 64)
+    step = max(len(samples) * slice_size // size, 1)
+    zdict = b''.join(sample[:slice_size] for sample in samples[::step])[:size]
+    return zdict or None
+
+
+def compress_book(
+        pages: list[str],
+        codec_name: str = PAGE_COMPRESSION,
+        dict_size: int = PAGE_COMPRESSION_DICT_SIZE
+) -> CompressedBook | None:
+    """Compress the pages of a book, with a dictionary if it pays off.
+
+    It is CPU-bound, uploaded books are compressed in the ingestion
+    worker processes together with the pagination.
+
+    Args:
+        pages: texts of the pages.
+        codec_name: `zlib` or `zstd`, an empty string disables compression.
+        dict_size: a maximum size of the dictionary, 0 disables dictionaries.
+
+    Returns:
+        The compressed pages, or None if compression is disabled.
+    """
+    if not codec_name:
+        return None
+
+    codec = make_codec(codec_name)
+    best = CompressedBook(codec_name, None, [codec.compress(page) for page in pages])
+
+    zdict = build_dictionary(codec_name, pages, dict_size)
+    if zdict is not None:
+        codec = make_codec(codec_name, zdict)
+        with_dict = CompressedBook(codec_name, zdict, [codec.compress(page) for page in pages])
+        if with_dict.size < best.size:
+            best = with_dict
+    return best
@@ -1,202 +1,838 @@
+import asyncio
 import json
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable
+
+import asyncpg
+
+from config_data.config import (
+    DB_HOST,
+    DB_PORT,
+    DB_NAME,
+    DB_USER,
+    DB_PASSWORD,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_ACQUIRE_TIMEOUT,
+    DB_COMMAND_TIMEOUT,
+    PAGE_CACHE_MAX_BYTES,
+    PAGE_CACHE_READ_AHEAD,
+    POSITION_FLUSH_INTERVAL,
+    POSITION_FLUSH_BATCH,
+    SEARCH_TTL,
+    SEARCH_CACHE_SIZE,
+    SESSION_TTL,
+    SESSION_CACHE_SIZE
+)
+from database.compression import CompressedBook, PageCodec, make_codec
+from database.layouts import Layout, load_breaks, make_layout, save_breaks
+from database.page_cache import PageCache
+from database.positions import PositionBuffer
+from database.search import SEARCH_CONFIG, SEARCH_RESULTS_LIMIT, SearchCache, SearchResult, index_book
+from database.sessions import Session, SessionCache
+from services.file_handling import BreakIndex, index_pages
+from services.metrics import REGISTRY, timed_methods
+
+# length of a page beginning shown on bookmark buttons
+PREVIEW_LENGTH = 100
+
+# codecs of compressed books are kept for this many recently read books
+CODEC_CACHE_SIZE = 256
+
+# pages of custom sizes are kept for this many recently read books and sizes
+LAYOUT_CACHE_SIZE = 256
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # asyncpg returns jsonb values as strings by default
+    await conn.set_type_codec(
+        'jsonb',
+        encoder=json.dumps,
+        decoder=json.loads,
+        schema='pg_catalog'
+    )
+
+
+async def insert_book(
+        conn: asyncpg.Connection,
+        book_name: str,
+        pages: list[str],
+        compressed: CompressedBook | None = None,
+        content_hash: bytes | None = None
+) -> int | None:
+    """Insert a book and its pages, compressed ones if `compressed` is
+    passed. Previews are always stored as plain text.
+
+    Returns None without inserting anything if a book with the same
+    `content_hash` already exists."""
+    # the columns of later migrations are only named when they are used,
+    # so earlier migrations can insert books with this function too
+    book = {'name': book_name, 'page_count': len(pages)}
+    if compressed is not None:
+        book.update(codec=compressed.codec, zdict=compressed.zdict)
+    if content_hash is not None:
+        book.update(content_hash=content_hash)
+    placeholders = ', '.join(f'${number}' for number in range(1, len(book) + 1))
+    query = f"INSERT INTO books ({', '.join(book)}) VALUES ({placeholders})"
+    if content_hash is not None:
+        # the same book may be uploaded by two users at once
+        query += " ON CONFLICT (content_hash) WHERE content_hash IS NOT NULL DO NOTHING"
+    book_id = await conn.fetchval(query + " RETURNING id;", *book.values())
+    if book_id is None:
+        return None
+
+    if compressed is None:
+        records = (
+            (book_id, page_no, text, text[:PREVIEW_LENGTH])
+            for page_no, text in enumerate(pages, start=1)
+        )
+        columns = ('book_id', 'page_no', 'text', 'preview')
+    else:
+        records = (
+            (book_id, page_no, data, text[:PREVIEW_LENGTH])
+            for page_no, (text, data) in enumerate(zip(pages, compressed.pages), start=1)
+        )
+        columns = ('book_id', 'page_no', 'data', 'preview')
+
+    # COPY is the fastest way to load thousands of rows
+    await conn.copy_records_to_table('book_pages', records=records, columns=columns)
+    return book_id
 
-import psycopg2
-from psycopg2.extensions import connection
 
-from config_data.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+@dataclass
+class ReaderState:
+    text: str
+    page: int
+    page_count: int
+    book_id: int
+
+
+@dataclass
+class UserBook:
+    id: int
+    # the name under which the book is shown in the user's library
+    name: str
 
 
 @dataclass
 class BaseQueriesMixin:
-    conn: connection
+    pool: asyncpg.Pool
 
-    def get_row_by_query(self, query: str, values: tuple = None) -> tuple:
-        with self.conn.cursor() as cursor:
-            cursor.execute(query, values)
-            result = cursor.fetchone()
+    async def get_row_by_query(self, query: str, values: tuple = ()) -> tuple:
+        async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            result = await conn.fetchrow(query, *values)
         if result:
-            return result
+            return tuple(result)
         return (None,)
 
-    def execute_query_and_commit(self, query, values=None):
-        with self.conn.cursor() as cursor:
-            cursor.execute(query, values)
-            self.conn.commit()
-
+    async def get_rows_by_query(self, query: str, values: tuple = ()) -> list[tuple]:
+        async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            result = await conn.fetch(query, *values)
+        return [tuple(row) for row in result]
 
-class UserInterface(BaseQueriesMixin):
+    async def execute_query_and_commit(self, query: str, values: tuple = ()) -> None:
+        # every statement outside of a transaction block is committed by the server
+        async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            await conn.execute(query, *values)
 
-    def _exists(self, user_id: int) -> bool:
-        query = "SELECT EXISTS(SELECT 1 FROM users WHERE user_id = %s);"
-        values = (user_id,)
-        result = self.get_row_by_query(query, values)
-        return result[0]
 
-    def create_if_not_exists(
+@timed_methods
+@dataclass
+class BookInterface(BaseQueriesMixin):
+    page_cache: PageCache
+    read_ahead: int = 0
+    _read_ahead_tasks: set[asyncio.Task] = field(default_factory=set, init=False)
+    _read_ahead_pages: set[tuple[int, int]] = field(default_factory=set, init=False)
+    _codecs: OrderedDict[int, PageCodec] = field(default_factory=OrderedDict, init=False)
+    _layouts: OrderedDict[tuple[int, int | None], Layout] = field(default_factory=OrderedDict, init=False)
+
+    async def add_book(
             self,
-            user_id: int,
-            current_page: int,
-            current_book: int | None,
-            books: list,
-            book_marks: dict
-    ) -> None:
-        if not self._exists(user_id):
-            query = '''
-            INSERT INTO users (user_id, current_page, current_book, books, book_marks)
-            VALUES (%s, %s, %s, %s, %s);
-            '''
-            books_str = "{" + ",".join(map(str, books)) + "}"
-            book_marks_json = json.dumps(book_marks)
-            values = (user_id, current_page, current_book, books_str, book_marks_json)
-
-            self.execute_query_and_commit(query, values)
-
-    def book_exists(self, user_id: int, book_name: str) -> bool:
-        return book_name in self.get_books(user_id)
-
-    def get_books(self, user_id: int) -> list:
-        query = "SELECT name FROM books WHERE id = ANY(SELECT unnest(books) FROM users WHERE user_id = %s);"
-        values = (user_id,)
+            book_name: str,
+            pages: list[str],
+            compressed: CompressedBook | None = None,
+            breaks: BreakIndex | None = None
+    ) -> int:
+        async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            async with conn.transaction():
+                book_id = await insert_book(conn, book_name, pages, compressed)
+                await index_book(conn, book_id, pages)
+                await save_breaks(conn, book_id, breaks or index_pages(pages))
+        return book_id
 
-        with self.conn.cursor() as cursor:
-            cursor.execute(query, values)
-            result = cursor.fetchall()
+    def forget_book(self, book_id: int) -> None:
+        self.page_cache.invalidate_book(book_id)
+        self._codecs.pop(book_id, None)
+        for key in [key for key in self._layouts if key[0] == book_id]:
+            del self._layouts[key]
+
+    async def _get_codec(self, book_id: int) -> PageCodec:
+        codec = self._codecs.get(book_id)
+        if codec is None:
+            query = "SELECT codec, zdict FROM books WHERE id = $1;"
+            values = (book_id,)
+            name, zdict = await self.get_row_by_query(query, values)
+            # a zstd dictionary is prepared once per book, not for every page
+            codec = self._codecs[book_id] = make_codec(name, zdict)
+            if len(self._codecs) > CODEC_CACHE_SIZE:
+                self._codecs.popitem(last=False)
+        else:
+            self._codecs.move_to_end(book_id)
+        return codec
+
+    async def _decode(self, book_id: int, text: str | None, data: bytes | None) -> str | None:
+        if data is None:
+            return text
+        codec = await self._get_codec(book_id)
+        return codec.decompress(data)
+
+    async def get_layout(self, book_id: int, page_size: int | None) -> Layout:
+        """Return the pages of the book at `page_size`, see `database.layouts`."""
+        key = (book_id, page_size)
+        layout = self._layouts.get(key)
+        if layout is None:
+            async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+                index = await load_breaks(conn, book_id)
+                if index is None:
+                    # a book inserted without the index, e.g. by hand, is indexed on the first use
+                    query = "SELECT text, data FROM book_pages WHERE book_id = $1 ORDER BY page_no;"
+                    pages = [await self._decode(book_id, *row) for row in await conn.fetch(query, book_id)]
+                    index = index_pages(pages)
+                    await save_breaks(conn, book_id, index)
+            layout = self._layouts[key] = make_layout(index, page_size)
+            if len(self._layouts) > LAYOUT_CACHE_SIZE:
+                self._layouts.popitem(last=False)
+        else:
+            self._layouts.move_to_end(key)
+        return layout
+
+    async def get_page(
+            self,
+            book_id: int,
+            page: int,
+            page_count: int | None = None,
+            page_size: int | None = None
+    ) -> str | None:
+        """Return a page from the cache or from the database. Pass
+        `page_count` to read the following pages ahead in the background
+        and `page_size` of the user for a page of a custom size."""
+        if page_size is not None:
+            layout = await self.get_layout(book_id, page_size)
+            if not 1 <= page <= layout.page_count:
+                return None
+            start, end = layout.bounds(page)
+            base_pages = layout.base_pages(start, end)
+            texts = await self.get_pages(book_id, list(base_pages))
+            if page_count is not None:
+                self._schedule_read_ahead(book_id, base_pages[-1], len(layout.base_starts))
+            return layout.cut(texts, start, end)
+
+        page_text = self.page_cache.get(book_id, page)
+        if page_text is None:
+            query = "SELECT text, data FROM book_pages WHERE book_id = $1 AND page_no = $2;"
+            values = (book_id, page)
+            result = await self.get_rows_by_query(query, values)
+            # a compressed page is decompressed once, the cache keeps the text
+            page_text = await self._decode(book_id, *result[0]) if result else None
+            if page_text is not None:
+                self.page_cache.put(book_id, page, page_text)
+
+        if page_count is not None:
+            self._schedule_read_ahead(book_id, page, page_count)
+        return page_text
 
-        book_names = [row[0] for row in result]
-        return book_names
+    def _schedule_read_ahead(self, book_id: int, page: int, page_count: int) -> None:
+        # read the whole window at once when the reader comes to its end
+        if (book_id, page + 1) in self.page_cache or (book_id, page + 1) in self._read_ahead_pages:
+            return
 
-    def get_current_book(self, user_id: int) -> str | None:
-        query = "SELECT current_book FROM users WHERE user_id = %s;"
-        values = (user_id,)
-        result = self.get_row_by_query(query, values)
-        book_id = result[0]
+        pages = [
+            next_page for next_page in range(page + 1, min(page + self.read_ahead, page_count) + 1)
+            if (book_id, next_page) not in self.page_cache
+            and (book_id, next_page) not in self._read_ahead_pages
+        ]
+        if not pages:
+            return
 
-        if book_id:
-            query2 = "SELECT name FROM books WHERE id = %s;"
-            values2 = (book_id,)
-            result2 = self.get_row_by_query(query2, values2)
+        self._read_ahead_pages.update((book_id, next_page) for next_page in pages)
+        task = asyncio.create_task(self._read_ahead(book_id, pages))
+        self._read_ahead_tasks.add(task)
+        task.add_done_callback(self._read_ahead_tasks.discard)
+
+    async def _read_ahead(self, book_id: int, pages: list[int]) -> None:
+        try:
+            await self._fetch_pages(book_id, pages)
+        finally:
+            self._read_ahead_pages.difference_update((book_id, page) for page in pages)
+
+    async def _fetch_pages(self, book_id: int, pages: list[int]) -> dict[int, str]:
+        query = "SELECT page_no, text, data FROM book_pages WHERE book_id = $1 AND page_no = ANY($2::integer[]);"
+        values = (book_id, pages)
+        texts = {}
+        for page, page_text, data in await self.get_rows_by_query(query, values):
+            texts[page] = await self._decode(book_id, page_text, data)
+            self.page_cache.put(book_id, page, texts[page])
+        return texts
+
+    async def get_pages(self, book_id: int, pages: list[int], page_size: int | None = None) -> dict[int, str]:
+        """Return several pages, the ones missing from the cache are read in one query."""
+        if page_size is not None:
+            return await self._cut_pages(book_id, pages, page_size)
+        texts = {}
+        for page in pages:
+            page_text = self.page_cache.get(book_id, page)
+            if page_text is not None:
+                texts[page] = page_text
+        missing = [page for page in pages if page not in texts]
+        if missing:
+            texts.update(await self._fetch_pages(book_id, missing))
+        return texts
+
+    async def _cut_pages(
+            self,
+            book_id: int,
+            pages: list[int],
+            page_size: int,
+            max_length: int | None = None
+    ) -> dict[int, str]:
+        # the stored pages of all the pages are read at once
+        layout = await self.get_layout(book_id, page_size)
+        bounds = {}
+        for page in pages:
+            if 1 <= page <= layout.page_count:
+                start, end = layout.bounds(page)
+                bounds[page] = start, end if max_length is None else min(end, start + max_length)
+        base_pages = {base_page for start, end in bounds.values() for base_page in layout.base_pages(start, end)}
+        texts = await self.get_pages(book_id, sorted(base_pages))
+        return {page: layout.cut(texts, start, end) for page, (start, end) in bounds.items()}
+
+    async def search(self, book_id: int, phrase: str, page_size: int | None = None) -> SearchResult:
+        """Find pages of the book with the phrase, in the reading order.
+
+        The phrase is parsed by `websearch_to_tsquery`: all words are
+        looked for, a quoted phrase is looked for as a whole. The stored
+        pages are searched, for a custom `page_size` the result has the
+        pages of that size which overlap the found ones.
+        """
+        query = '''
+        SELECT array(
+            SELECT page_no
+            FROM page_search
+            WHERE book_id = $1 AND tsv @@ websearch_to_tsquery($3::regconfig, $2)
+            ORDER BY page_no
+            LIMIT $4
+        ), tsvector_to_array(to_tsvector($3::regconfig, $2));
+        '''
+        values = (book_id, phrase, SEARCH_CONFIG, SEARCH_RESULTS_LIMIT)
+        pages, lexemes = await self.get_row_by_query(query, values)
+        if page_size is not None and pages:
+            layout = await self.get_layout(book_id, page_size)
+            pages = sorted({page for base_page in pages for page in layout.pages_of_base(base_page)})
+        return SearchResult(book_id, phrase, pages, lexemes, page_size)
+
+    async def get_page_content(self, book_id: int, page: int) -> str:
+        return await self.get_page(book_id, page)
+
+    async def get_previews(self, book_id: int, pages: list[int], page_size: int | None = None) -> dict[int, str]:
+        """Return beginnings of the pages in one query."""
+        if page_size is not None:
+            return await self._cut_pages(book_id, pages, page_size, PREVIEW_LENGTH)
+        query = "SELECT page_no, preview FROM book_pages WHERE book_id = $1 AND page_no = ANY($2::integer[]);"
+        values = (book_id, pages)
+        result = await self.get_rows_by_query(query, values)
+        return dict(result)
+
+    async def get_length(self, book_id: int) -> int:
+        query = "SELECT page_count FROM books WHERE id = $1;"
+        values = (book_id,)
+        result = await self.get_row_by_query(query, values)
+        return result[0]
 
-            return result2[0]
 
-    def _get_book_id_by_name(self, user_id: int, book_name: str) -> int:
-        query = "SELECT id FROM books WHERE name = %s;"
-        values = (book_name,)
-        result = self.get_row_by_query(query, values)
-        book_id = result[0]
-        return book_id
+@timed_methods
+@dataclass
+class UserInterface(BaseQueriesMixin):
+    book_interface: BookInterface
+    positions: PositionBuffer
+    sessions: SessionCache
+    searches: SearchCache
 
-    def remove_book(self, user_id: int, book_name: str) -> None:
-        book_id = self._get_book_id_by_name(user_id, book_name)
+    async def create_if_not_exists(
+            self,
+            user_id: int,
+            current_page: int,
+            current_book: int | None,
+            books: list
+    ) -> None:
+        # the books are linked under their original names in the same statement
         query = '''
-        UPDATE users
-         SET books = array_remove(books, %s),
-             current_book = CASE WHEN current_book = %s THEN 1 ELSE current_book END
-        WHERE user_id = %s;
+        WITH new_user AS (
+            INSERT INTO users (user_id, current_page, current_book)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (user_id) DO NOTHING
+            RETURNING user_id
+        )
+        INSERT INTO user_books (user_id, book_id, display_name)
+        SELECT new_user.user_id, books.id, books.name
+        FROM new_user, books
+        WHERE books.id = ANY($4::integer[]);
         '''
-        values = (book_id, book_id, user_id)
-        self.execute_query_and_commit(query, values)
-
-        query2 = "DELETE FROM books WHERE id = %s;"
-        values2 = (book_id,)
-        self.execute_query_and_commit(query2, values2)
+        values = (user_id, current_page, current_book, books)
+        await self.execute_query_and_commit(query, values)
 
-    def set_current_book(self, user_id: int, book_name: str) -> None:
-        book_id = self._get_book_id_by_name(user_id, book_name)
-        query = "UPDATE users SET current_book = %s WHERE user_id = %s;"
-        values = (book_id, user_id)
-        self.execute_query_and_commit(query, values)
-
-    def get_current_page(self, user_id: int) -> int:
-        query = "SELECT current_page FROM users WHERE user_id = %s;"
-        values = (user_id,)
-        result = self.get_row_by_query(query, values)
+    async def book_exists(self, user_id: int, book_name: str) -> bool:
+        query = "SELECT EXISTS(SELECT 1 FROM user_books WHERE user_id = $1 AND display_name = $2);"
+        values = (user_id, book_name)
+        result = await self.get_row_by_query(query, values)
         return result[0]
 
-    def set_current_page(self, user_id: int, page: int) -> None:
-        query = "UPDATE users SET current_page = %s WHERE user_id = %s;"
-        values = (page, user_id)
-        self.execute_query_and_commit(query, values)
-
-    def get_book_marks(self, user_id: int) -> dict:
-        query = "SELECT book_marks FROM users WHERE user_id = %s;"
+    async def get_books(self, user_id: int) -> list[UserBook]:
+        query = "SELECT book_id, display_name FROM user_books WHERE user_id = $1 ORDER BY display_name;"
         values = (user_id,)
-        result = self.get_row_by_query(query, values)
-        marks = result[0]
-        if marks:
-            return marks
-        return {}
-
-    def _save_book_marks(self, user_id: int, book_marks: dict) -> None:
-        query = "UPDATE users SET book_marks = %s WHERE user_id = %s;"
-        book_marks_json = json.dumps(book_marks)
-        values = (book_marks_json, user_id)
-        self.execute_query_and_commit(query, values)
-
-    def add_book_mark(self, user_id: int, book_name: str, book_mark: str) -> None:
-        book_marks: dict[str, list] = self.get_book_marks(user_id)
-        if book_name in book_marks and book_mark in book_marks[book_name]:
-            return
-        book_marks.setdefault(book_name, []).append(book_mark)
-        self._save_book_marks(user_id, book_marks)
-
-    def remove_book_mark(self, user_id: int, book_name: str, book_mark: str) -> None:
-        book_marks: dict[str, list] = self.get_book_marks(user_id)
-        book_marks.get(book_name).remove(book_mark)
-        if not book_marks[book_name]:
-            del book_marks[book_name]
-        self._save_book_marks(user_id, book_marks)
-
-    def save_book(self, user_id: int, book_name: str, content: str) -> None:
-        query = "INSERT INTO books (name, content) VALUES (%s, %s) RETURNING id;"
-        values = (book_name, content)
-
-        with self.conn.cursor() as cursor:
-            cursor.execute(query, values)
-            book_id = cursor.fetchone()[0]
-            self.conn.commit()
-
-        query2 = "UPDATE users SET books = array_append(books, %s) WHERE user_id = %s;"
-        values2 = (book_id, user_id)
-
-        self.execute_query_and_commit(query2, values2)
-
+        result = await self.get_rows_by_query(query, values)
+        return [UserBook(*row) for row in result]
+
+    async def get_current_book(self, user_id: int) -> UserBook | None:
+        session = await self._get_session(user_id)
+        if session is not None and session.book_name is not None:
+            return UserBook(session.book_id, session.book_name)
+
+    async def remove_book(self, user_id: int, book_id: int) -> None:
+        """Remove a book from the user's library. The book itself is
+        collected with its pages when no library references it anymore."""
+        # the id comes from a button, so only a book of the user's own library is removed.
+        # The book is locked first, so it can't be linked to another library while it is collected
+        query = '''
+        SELECT books.id
+        FROM books
+         JOIN user_books ON user_books.book_id = books.id
+        WHERE books.id = $1 AND user_books.user_id = $2
+        FOR UPDATE OF books;
+        '''
+        # if the book is the current one, the user is moved to the built-in book
+        query2 = '''
+        UPDATE users
+         SET current_book = 1,
+             current_page = 1
+        WHERE user_id = $2 AND current_book = $1
+        RETURNING user_id;
+        '''
+        # the trigger decrements books.ref_count, the bookmarks are removed by the cascade
+        query3 = "DELETE FROM user_books WHERE user_id = $2 AND book_id = $1;"
+        # the pages are removed by the cascade
+        query4 = "DELETE FROM books WHERE id = $1 AND ref_count = 0 RETURNING id;"
+
+        async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            async with conn.transaction():
+                if await conn.fetchval(query, book_id, user_id) is None:
+                    return
+                moved = await conn.fetchval(query2, book_id, user_id)
+                await conn.execute(query3, book_id, user_id)
+                collected = await conn.fetchval(query4, book_id)
+        if moved is not None:
+            self._forget_session(user_id)
+        else:
+            # an unwritten page turn in the current book is still valid, it is kept
+            self.sessions.forget(user_id)
+        result = self.searches.get(user_id)
+        if result is not None and result.book_id == book_id:
+            self.searches.forget(user_id)
+        if collected is not None:
+            self.book_interface.forget_book(book_id)
+
+    async def link_book(self, user_id: int, content_hash: bytes, book_name: str) -> str | None:
+        """Add a book which is already stored to the user's library, the
+        pages are shared with the other libraries.
+
+        Args:
+            user_id: an id of the user.
+            content_hash: a hash of the uploaded file, see `services.file_handling.hash_file`.
+            book_name: a name for the book in the library.
+
+        Returns:
+            The name of the book in the library, which is not `book_name`
+            if the user already has the book, or None if the book isn't stored.
+        """
+        # the lock keeps the book from being collected until it is linked
+        query = "SELECT id FROM books WHERE content_hash = $1 FOR KEY SHARE;"
+        query2 = '''
+        INSERT INTO user_books (user_id, book_id, display_name)
+        VALUES ($1, $2, $3)
+        ON CONFLICT (user_id, book_id) DO NOTHING
+        RETURNING display_name;
+        '''
+        query3 = "SELECT display_name FROM user_books WHERE user_id = $1 AND book_id = $2;"
+
+        async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            async with conn.transaction():
+                book_id = await conn.fetchval(query, content_hash)
+                if book_id is None:
+                    return None
+                display_name = await conn.fetchval(query2, user_id, book_id, book_name)
+                if display_name is None:
+                    display_name = await conn.fetchval(query3, user_id, book_id)
+        return display_name
+
+    async def set_current_book(self, user_id: int, book_id: int) -> None:
+        query = '''
+        UPDATE users
+         SET current_book = user_books.book_id
+        FROM user_books
+        WHERE users.user_id = $1 AND user_books.user_id = $1 AND user_books.book_id = $2;
+        '''
+        values = (user_id, book_id)
+        await self.execute_query_and_commit(query, values)
+        self._forget_session(user_id)
+
+    def _forget_session(self, user_id: int) -> None:
+        # called after the current book or page was written to the database directly
+        self.positions.forget(user_id)
+        self.sessions.forget(user_id)
+
+    async def _get_session(self, user_id: int) -> Session | None:
+        session = self.sessions.get(user_id)
+        if session is None:
+            # the book may be out of the library, the built-in one after it was removed
+            query = '''
+            SELECT users.current_book, user_books.display_name, users.current_page, books.page_count, users.page_size
+            FROM users
+             JOIN books ON books.id = users.current_book
+             LEFT JOIN user_books ON user_books.user_id = users.user_id AND user_books.book_id = users.current_book
+            WHERE users.user_id = $1;
+            '''
+            values = (user_id,)
+            result = await self.get_row_by_query(query, values)
+            if result[0] is None:
+                return None
+            session = await self._make_session(result)
+            # a page turn may not have been written yet
+            position = self.positions.get(user_id)
+            if position is not None and position.book_id == session.book_id:
+                session.page = position.page
+            self.sessions.put(user_id, session)
+        return session
+
+    async def _make_session(self, row: tuple) -> Session:
+        session = Session(*row)
+        if session.page_size is not None:
+            layout = await self.book_interface.get_layout(session.book_id, session.page_size)
+            session.page_count = layout.page_count
+        return session
+
+    async def get_current_page(self, user_id: int) -> int | None:
+        session = await self._get_session(user_id)
+        if session is not None:
+            return session.page
+
+    async def set_current_page(self, user_id: int, page: int) -> None:
+        session = await self._get_session(user_id)
+        if session is not None:
+            session.page = page
+            await self.positions.write(user_id, session.book_id, page, session.page_count)
+
+    async def turn_page(self, user_id: int, step: int) -> ReaderState | None:
+        """Move the current page of the user by `step` pages, wrapping
+        around at both ends of the book, and return the new page.
+        Pass `step=0` to read the current page.
+
+        The position is read from the `SessionCache` and the new one is
+        written to the database later by the `PositionBuffer`, so a page
+        turn usually makes no queries at all. In webhook mode both are off
+        by default, a page turn then reads and writes the users row."""
+        session = await self._get_session(user_id)
+        if session is not None:
+            page = (session.page - 1 + step) % session.page_count + 1
+            return await self._show_page(user_id, session, page)
+
+    async def open_page(self, user_id: int, page: int, book_id: int | None = None) -> ReaderState | None:
+        """Set the current page of the user and return it. If `book_id`
+        of a book from the user's library is passed, the book also becomes
+        the current one. Returns None if there is no such book or page,
+        e.g. the button was sent before the user changed the page size."""
+        if book_id is None:
+            session = await self._get_session(user_id)
+            if session is not None and 1 <= page <= session.page_count:
+                return await self._show_page(user_id, session, page)
+            return None
 
-class BookInterface(BaseQueriesMixin):
+        query = '''
+        SELECT user_books.book_id, users.page_size
+        FROM users
+         JOIN user_books ON user_books.user_id = users.user_id
+        WHERE users.user_id = $1 AND user_books.book_id = $2;
+        '''
+        query2 = '''
+        UPDATE users
+         SET current_book = user_books.book_id,
+             current_page = $2
+        FROM user_books
+         JOIN books ON books.id = user_books.book_id
+        WHERE users.user_id = $1 AND user_books.user_id = $1 AND user_books.book_id = $3
+        RETURNING users.current_book, user_books.display_name, users.current_page, books.page_count, users.page_size;
+        '''
+        result = await self.get_row_by_query(query, (user_id, book_id))
+        if result[0] is None:
+            return None
+        # the page is checked at the user's size before it is written
+        layout = await self.book_interface.get_layout(book_id, result[1])
+        if not 1 <= page <= layout.page_count:
+            return None
+
+        values = (user_id, page, book_id)
+        result = await self.get_row_by_query(query2, values)
+        self._forget_session(user_id)
+        if result[0] is not None:
+            # the new session is known already, the next page turn doesn't read it back
+            session = await self._make_session(result)
+            self.sessions.put(user_id, session)
+            text = await self.book_interface.get_page(session.book_id, page, session.page_count, session.page_size)
+            return ReaderState(text, page, session.page_count, session.book_id)
+
+    async def _show_page(self, user_id: int, session: Session, page: int) -> ReaderState:
+        if page != session.page:
+            session.page = page
+            await self.positions.write(user_id, session.book_id, page, session.page_count)
+        # the page text is usually in the cache already, thanks to the read-ahead
+        text = await self.book_interface.get_page(session.book_id, page, session.page_count, session.page_size)
+        return ReaderState(text, page, session.page_count, session.book_id)
+
+    async def get_book_marks(self, user_id: int, book_id: int) -> dict[int, str]:
+        """Return the bookmarked pages of the book with their beginnings,
+        ordered by page. Bookmarks of the current book are cached in the
+        session until they change."""
+        session = await self._get_session(user_id)
+        if session is not None and session.book_id == book_id and session.bookmarks is not None:
+            return session.bookmarks
+
+        values = (user_id, book_id)
+        if session is None or session.page_size is None:
+            query = '''
+            SELECT bookmarks.page_no, book_pages.preview
+            FROM bookmarks
+             JOIN book_pages ON book_pages.book_id = bookmarks.book_id AND book_pages.page_no = bookmarks.page_no
+            WHERE bookmarks.user_id = $1 AND bookmarks.book_id = $2
+            ORDER BY bookmarks.page_no;
+            '''
+            book_marks = dict(await self.get_rows_by_query(query, values))
+        else:
+            # the beginnings of the pages of a custom size are cut out of the stored pages
+            query = "SELECT page_no FROM bookmarks WHERE user_id = $1 AND book_id = $2 ORDER BY page_no;"
+            pages = [page for page, in await self.get_rows_by_query(query, values)]
+            previews = await self.book_interface.get_previews(book_id, pages, session.page_size)
+            book_marks = {page: previews[page] for page in pages if page in previews}
+        if session is not None and session.book_id == book_id:
+            session.bookmarks = book_marks
+        return book_marks
+
+    async def find(self, user_id: int, phrase: str) -> SearchResult | None:
+        """Search the current book of the user. A result with pages is kept
+        in the `SearchCache`, so its keyboard can be paged through without
+        searching again. Returns None if the user has no current book."""
+        session = await self._get_session(user_id)
+        if session is None:
+            return None
+        result = await self.book_interface.search(session.book_id, phrase, session.page_size)
+        if result.pages:
+            self.searches.put(user_id, result)
+        return result
+
+    async def get_search(self, user_id: int) -> SearchResult | None:
+        """Return the last search result, None if it has expired, the user
+        has changed the page size or removed the book since."""
+        return self.searches.get(user_id)
+
+    async def add_book_mark(self, user_id: int, book_id: int, book_mark: int) -> None:
+        # the book may have been removed since the page was shown, then nothing is added
+        query = '''
+        INSERT INTO bookmarks (user_id, book_id, page_no)
+        SELECT user_id, book_id, $3
+        FROM user_books
+        WHERE user_id = $1 AND book_id = $2
+        ON CONFLICT DO NOTHING;
+        '''
+        values = (user_id, book_id, book_mark)
+        await self.execute_query_and_commit(query, values)
+        self.sessions.forget_bookmarks(user_id)
+
+    async def remove_book_mark(self, user_id: int, book_id: int, book_mark: int) -> None:
+        query = "DELETE FROM bookmarks WHERE user_id = $1 AND book_id = $2 AND page_no = $3;"
+        values = (user_id, book_id, book_mark)
+        await self.execute_query_and_commit(query, values)
+        self.sessions.forget_bookmarks(user_id)
+
+    async def set_page_size(self, user_id: int, page_size: int | None) -> None:
+        """Change the size of the user's pages, None for the default one.
+
+        The current page and the bookmarks of every book are moved to the
+        pages of the new size with the first character of the old ones,
+        so the user goes on reading from the same place.
+        """
+        session = await self._get_session(user_id)
+        if session is None or session.page_size == page_size:
+            return
+        query = "SELECT DISTINCT book_id FROM bookmarks WHERE user_id = $1;"
+        query2 = '''
+        UPDATE users
+         SET page_size = $2,
+             current_page = CASE WHEN current_book = $4 THEN $3 ELSE current_page END
+        WHERE user_id = $1;
+        '''
+        # the bookmarks are read by the statement which removes them, so one added meanwhile isn't lost
+        query3 = "DELETE FROM bookmarks WHERE user_id = $1 RETURNING book_id, page_no;"
+        query4 = '''
+        INSERT INTO bookmarks (user_id, book_id, page_no)
+        SELECT $1, moved.book_id, moved.page_no
+        FROM unnest($2::integer[], $3::integer[]) AS moved (book_id, page_no)
+         JOIN user_books ON user_books.user_id = $1 AND user_books.book_id = moved.book_id;
+        '''
 
-    def get_page_content(self, book_name: str, page: int) -> str:
-        query = "SELECT content->%s FROM books WHERE name = %s;"
-        values = (str(page), book_name)
-        result = self.get_row_by_query(query, values)
-        page_text = result[0]
-        return page_text
+        # an unwritten page turn of the old size mustn't be written after the new page
+        await self.positions.flush()
+        current = await self._move_pages(session.book_id, [session.page], session.page_size, page_size)
+        page = current[0] if current else 1
+        # the layouts are loaded before the transaction, so it doesn't wait for another connection
+        for book_id, in await self.get_rows_by_query(query, (user_id,)):
+            await self.book_interface.get_layout(book_id, session.page_size)
+            await self.book_interface.get_layout(book_id, page_size)
+
+        async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            async with conn.transaction():
+                await conn.execute(query2, user_id, page_size, page, session.book_id)
+                book_marks: dict[int, list[int]] = {}
+                for book_id, page_no in await conn.fetch(query3, user_id):
+                    book_marks.setdefault(book_id, []).append(page_no)
+                book_ids, pages = [], []
+                for book_id, book_pages in book_marks.items():
+                    moved = await self._move_pages(book_id, book_pages, session.page_size, page_size)
+                    book_ids.extend([book_id] * len(moved))
+                    pages.extend(moved)
+                await conn.execute(query4, user_id, book_ids, pages)
+        self._forget_session(user_id)
+        # the found pages are numbered in the old size
+        self.searches.forget(user_id)
+
+    async def _move_pages(
+            self,
+            book_id: int,
+            pages: list[int],
+            old_size: int | None,
+            new_size: int | None
+    ) -> list[int]:
+        old = await self.book_interface.get_layout(book_id, old_size)
+        new = await self.book_interface.get_layout(book_id, new_size)
+        # pages of a smaller size may become one
+        moved = {new.page_at(old.bounds(page)[0]) for page in pages if 1 <= page <= old.page_count}
+        return sorted(moved)
+
+    async def save_book(
+            self,
+            user_id: int,
+            book_name: str,
+            pages: list[str],
+            compressed: CompressedBook | None = None,
+            content_hash: bytes | None = None,
+            breaks: BreakIndex | None = None
+    ) -> None:
+        query = "SELECT id FROM books WHERE content_hash = $1 FOR KEY SHARE;"
+        query2 = "INSERT INTO user_books (user_id, book_id, display_name) VALUES ($1, $2, $3);"
 
-    def get_length(self, book_name: str) -> int:
-        query = "SELECT content FROM books WHERE name = %s;"
-        values = (book_name,)
-        result = self.get_row_by_query(query, values)
-        content = result[0]
-        return len(content)
+        async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            async with conn.transaction():
+                book_id = await insert_book(conn, book_name, pages, compressed, content_hash)
+                if book_id is None:
+                    # another user has just saved the same book, it is shared instead
+                    book_id = await conn.fetchval(query, content_hash)
+                else:
+                    await index_book(conn, book_id, pages)
+                    await save_breaks(conn, book_id, breaks or index_pages(pages))
+                await conn.execute(query2, user_id, book_id, book_name)
 
 
 class Database(BaseQueriesMixin):
     def __init__(self):
-        self.conn = psycopg2.connect(
+        self.pool = None
+        self.page_cache = PageCache(PAGE_CACHE_MAX_BYTES)
+        self.positions = None
+        self.sessions = SessionCache(SESSION_TTL, SESSION_CACHE_SIZE)
+        self.searches = SearchCache(SEARCH_TTL, SEARCH_CACHE_SIZE)
+        self.user_interface = None
+        self.book_interface = None
+        REGISTRY.add_collector(self._collect_metrics)
+
+    async def connect(self) -> None:
+        self.pool = await asyncpg.create_pool(
+            host=DB_HOST,
+            port=DB_PORT,
+            database=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            init=_init_connection,
+        )
+        self.positions = PositionBuffer(self.pool, POSITION_FLUSH_INTERVAL, POSITION_FLUSH_BATCH)
+        await self.positions.start()
+        self.book_interface = BookInterface(self.pool, self.page_cache, PAGE_CACHE_READ_AHEAD)
+        self.user_interface = UserInterface(self.pool, self.book_interface, self.positions, self.sessions, self.searches)
+
+    async def listen(self, channel: str, callback: Callable) -> asyncpg.Connection:
+        """Open a separate connection which calls `callback` on every
+        notification of the channel, so no pool connection is held."""
+        conn = await asyncpg.connect(
             host=DB_HOST,
             port=DB_PORT,
             database=DB_NAME,
             user=DB_USER,
             password=DB_PASSWORD,
         )
-        self.user_interface = UserInterface(self.conn)
-        self.book_interface = BookInterface(self.conn)
-
-    def get_table_data_as_dict(self, table_name: str) -> dict:
-        with self.conn.cursor() as cursor:
-            query = f"SELECT * FROM {table_name};"
-            cursor.execute(query)
-            results: list[tuple] = cursor.fetchall()
-            return dict(results)
+        await conn.add_listener(channel, callback)
+        return conn
+
+    async def close(self) -> None:
+        # unwritten reading positions are saved before the pool is closed
+        await self.positions.stop()
+        await self.pool.close()
+
+    def _collect_metrics(self) -> list:
+        if self.pool is None:
+            return []
+        cache = self.page_cache.stats()
+        positions = self.positions.stats()
+        sessions = self.sessions.stats()
+        return [
+            ('bot_page_cache_requests_total', 'counter', 'Page cache lookups.',
+             [({'result': 'hit'}, cache['hits']), ({'result': 'miss'}, cache['misses'])]),
+            ('bot_page_cache_evictions_total', 'counter', 'Pages evicted from the cache.',
+             [({}, cache['evictions'])]),
+            ('bot_page_cache_pages', 'gauge', 'Pages in the cache.', [({}, cache['pages'])]),
+            ('bot_page_cache_bytes', 'gauge', 'Size of the cached pages.',
+             [({'kind': 'used'}, cache['size_bytes']), ({'kind': 'max'}, cache['max_bytes'])]),
+            ('bot_db_pool_connections', 'gauge', 'Connections of the database pool.',
+             [({'state': 'open'}, self.pool.get_size()), ({'state': 'idle'}, self.pool.get_idle_size()),
+              ({'state': 'max'}, self.pool.get_max_size())]),
+            ('bot_session_cache_requests_total', 'counter', 'Reader session lookups.',
+             [({'result': 'hit'}, sessions['hits']), ({'result': 'miss'}, sessions['misses'])]),
+            ('bot_session_cache_sessions', 'gauge', 'Reader sessions in the cache.', [({}, sessions['sessions'])]),
+            ('bot_search_cache_results', 'gauge', 'Kept /find results.', [({}, len(self.searches))]),
+            ('bot_positions_dirty', 'gauge', 'Reading positions waiting to be written.',
+             [({}, positions['dirty'])]),
+            ('bot_positions_oldest_dirty_age_seconds', 'gauge', 'Age of the oldest unwritten position.',
+             [({}, positions['oldest_dirty_age_seconds'])]),
+            ('bot_positions_durability_window_seconds', 'gauge',
+             'Longest reading progress lost on a crash, the flush interval.',
+             [({}, positions['durability_window_seconds'])]),
+            ('bot_positions_flushed_total', 'counter', 'Reading positions written to the database.',
+             [({}, positions['flushed_positions'])]),
+        ]
+
+    async def get_table_data_as_dict(self, table_name: str) -> dict:
+        query = f"SELECT * FROM {table_name};"
+        results: list[tuple] = await self.get_rows_by_query(query)
+        return dict(results)
 
 
 bot_database = Database()
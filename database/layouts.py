@@ -0,0 +1,123 @@
+"""
+Pages of the size chosen by a user with /pagesize.
+
+The pages of a book are stored at the default `PAGE_SIZE`. The
+`book_breaks` table keeps the `BreakIndex` of every book, built when the
+book is saved, so the book is split into pages of another size by
+`paginate_index` in a few milliseconds, without reading its text. A page
+of a custom size is cut out of the stored pages it overlaps, which are
+read through the page cache as usual.
+
+Page numbers of a user, the current page and the bookmarks, are numbers
+of the pages of the user's size.
+"""
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from itertools import accumulate
+
+import asyncpg
+
+from services.file_handling import BreakIndex, paginate_index
+
+
+@dataclass
+class Layout:
+    """Pages of a book at some size, as positions in the text of the book,
+    the stored pages joined."""
+    # the page `n` starts at `starts[n - 1]`
+    starts: array
+    # the same for the stored pages
+    base_starts: array
+    length: int
+
+    @property
+    def page_count(self) -> int:
+        return len(self.starts)
+
+    def bounds(self, page: int) -> tuple[int, int]:
+        return _bounds(self.starts, self.length, page)
+
+    def page_at(self, position: int) -> int:
+        """Return the page with the character at `position`."""
+        return max(bisect_right(self.starts, position), 1)
+
+    def base_pages(self, start: int, end: int) -> range:
+        """Return the stored pages with the text from `start` to `end`."""
+        return range(max(bisect_right(self.base_starts, start), 1), bisect_left(self.base_starts, end) + 1)
+
+    def pages_of_base(self, base_page: int) -> range:
+        """Return the pages with the text of a stored page."""
+        start, end = _bounds(self.base_starts, self.length, base_page)
+        return range(self.page_at(start), bisect_left(self.starts, end) + 1)
+
+    def cut(self, texts: dict[int, str], start: int, end: int) -> str:
+        """Cut the text from `start` to `end` out of the stored pages.
+
+        Args:
+            texts: texts of the stored pages, at least of `base_pages(start, end)`.
+            start: a position of the first character.
+            end: a position after the last character.
+
+        Returns:
+            The text without whitespace around.
+        """
+        pieces = []
+        base_pages = self.base_pages(start, end)
+        for base_page in base_pages:
+            page_start, page_end = _bounds(self.base_starts, self.length, base_page)
+            text = texts[base_page]
+            # the space put between the stripped pages of the books saved before, see `index_pages`
+            pieces.append(text + ' ' * (page_end - page_start - len(text)))
+        offset = self.base_starts[base_pages[0] - 1]
+        return ''.join(pieces)[start - offset:end - offset].strip()
+
+
+def _bounds(starts: array, length: int, page: int) -> tuple[int, int]:
+    end = starts[page] if page < len(starts) else length
+    return starts[page - 1], end
+
+
+def make_layout(index: BreakIndex, page_size: int | None) -> Layout:
+    """Split a book into pages of `page_size`, None for the stored pages."""
+    starts = index.page_starts if page_size is None else paginate_index(index, page_size)
+    return Layout(starts, index.page_starts, index.length)
+
+
+def pack_positions(positions: array) -> bytes:
+    # the distances between the breaks are small numbers, they are compressed several times better
+    deltas = array('I', (end - start for start, end in zip([0, *positions], positions)))
+    return zlib.compress(deltas.tobytes())
+
+
+def unpack_positions(data: bytes) -> array:
+    deltas = array('I')
+    deltas.frombytes(zlib.decompress(data))
+    return array('I', accumulate(deltas))
+
+
+async def save_breaks(conn: asyncpg.Connection, book_id: int, index: BreakIndex) -> None:
+    query = '''
+    INSERT INTO book_breaks (book_id, length, positions, kinds, page_starts)
+    VALUES ($1, $2, $3, $4, $5)
+    ON CONFLICT (book_id) DO NOTHING;
+    '''
+    values = (
+        book_id,
+        index.length,
+        pack_positions(index.positions),
+        zlib.compress(index.kinds),
+        pack_positions(index.page_starts)
+    )
+    await conn.execute(query, *values)
+
+
+async def load_breaks(conn: asyncpg.Connection, book_id: int) -> BreakIndex | None:
+    query = "SELECT length, positions, kinds, page_starts FROM book_breaks WHERE book_id = $1;"
+    row = await conn.fetchrow(query, book_id)
+    if row is None:
+        return None
+    length, positions, kinds, page_starts = row
+    kinds = bytearray(zlib.decompress(kinds))
+    return BreakIndex(unpack_positions(positions), kinds, length, unpack_positions(page_starts))
@@ -0,0 +1,59 @@
+import sys
+from collections import OrderedDict
+
+
+class PageCache:
+    """LRU cache of page texts keyed by (book_id, page) and bounded
+    by the total size of the cached strings in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pages: OrderedDict[tuple[int, int], str] = OrderedDict()
+
+    def __contains__(self, key: tuple[int, int]) -> bool:
+        return key in self._pages
+
+    def get(self, book_id: int, page: int) -> str | None:
+        key = (book_id, page)
+        text = self._pages.get(key)
+        if text is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._pages.move_to_end(key)
+        return text
+
+    def put(self, book_id: int, page: int, text: str) -> None:
+        size = sys.getsizeof(text)
+        if size > self.max_bytes:
+            return
+
+        key = (book_id, page)
+        old_text = self._pages.pop(key, None)
+        if old_text is not None:
+            self.size_bytes -= sys.getsizeof(old_text)
+        self._pages[key] = text
+        self.size_bytes += size
+
+        while self.size_bytes > self.max_bytes:
+            _, evicted_text = self._pages.popitem(last=False)
+            self.size_bytes -= sys.getsizeof(evicted_text)
+            self.evictions += 1
+
+    def invalidate_book(self, book_id: int) -> None:
+        for key in [key for key in self._pages if key[0] == book_id]:
+            self.size_bytes -= sys.getsizeof(self._pages.pop(key))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'pages': len(self._pages),
+            'size_bytes': self.size_bytes,
+            'max_bytes': self.max_bytes,
+        }
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Position:
+    book_id: int
+    page: int
+    page_count: int
+    # monotonic time of the first change that hasn't been written yet
+    dirty_since: float | None = None
+    version: int = 0
+
+
+class PositionBuffer:
+    """Write-behind buffer of reading positions.
+
+    Page turns only change the position in memory. Dirty positions are
+    written with one multi-row UPDATE every `flush_interval` seconds, or
+    as soon as `max_dirty` of them are collected, and on `stop`. So at
+    most `flush_interval` seconds of reading progress can be lost if
+    the process crashes. With `flush_interval=0` every position is
+    written right away, for copies of the bot sharing the readers.
+    """
+
+    flush_query = '''
+    UPDATE users
+     SET current_page = positions.page
+    FROM unnest($1::integer[], $2::integer[], $3::integer[]) AS positions (user_id, book_id, page)
+    WHERE users.user_id = positions.user_id AND users.current_book = positions.book_id;
+    '''
+
+    def __init__(self, pool: asyncpg.Pool, flush_interval: float, max_dirty: int):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        self.flushes = 0
+        self.flushed_positions = 0
+        self._positions: dict[int, Position] = {}
+        self._dirty: set[int] = set()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self._background_flush: asyncio.Task | None = None
+
+    def get(self, user_id: int) -> Position | None:
+        return self._positions.get(user_id)
+
+    def update(self, user_id: int, book_id: int, page: int, page_count: int) -> None:
+        """Change a position, it will be written later."""
+        position = self._positions.get(user_id)
+        if position is None or position.book_id != book_id:
+            position = self._positions[user_id] = Position(book_id, page, page_count)
+        position.page = page
+        position.page_count = page_count
+        position.version += 1
+        if position.dirty_since is None:
+            position.dirty_since = time.monotonic()
+        self._dirty.add(user_id)
+
+        if len(self._dirty) >= self.max_dirty and (self._background_flush is None or self._background_flush.done()):
+            self._background_flush = asyncio.create_task(self._flush_logging_errors())
+
+    async def write(self, user_id: int, book_id: int, page: int, page_count: int) -> None:
+        """Change a position, it is written right away if the buffer is off."""
+        if self.flush_interval > 0:
+            self.update(user_id, book_id, page, page_count)
+            return
+        async with self.pool.acquire() as conn:
+            await conn.execute(self.flush_query, [user_id], [book_id], [page])
+
+    def forget(self, user_id: int) -> None:
+        """Drop a position which has been overwritten in the database."""
+        self._positions.pop(user_id, None)
+        self._dirty.discard(user_id)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+
+            batch = {user_id: self._positions[user_id] for user_id in self._dirty}
+            versions = {user_id: position.version for user_id, position in batch.items()}
+            values = (
+                list(batch),
+                [position.book_id for position in batch.values()],
+                [position.page for position in batch.values()],
+            )
+            async with self.pool.acquire() as conn:
+                await conn.execute(self.flush_query, *values)
+
+            for user_id, position in batch.items():
+                # the reader may have turned the page while the batch was being written
+                if self._positions.get(user_id) is position and position.version == versions[user_id]:
+                    # written positions are dropped, so a long-lived process doesn't keep every reader
+                    del self._positions[user_id]
+                    self._dirty.discard(user_id)
+            self.flushes += 1
+            self.flushed_positions += len(batch)
+
+    async def start(self) -> None:
+        if self.flush_interval > 0:
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logging_errors()
+
+    async def _flush_logging_errors(self) -> None:
+        # positions that failed to be written stay dirty and are retried with the next batch
+        try:
+            await self.flush()
+        except (asyncpg.PostgresError, OSError, asyncio.TimeoutError):
+            logger.exception('Failed to write %d reading positions', len(self._dirty))
+
+    def stats(self) -> dict[str, float]:
+        now = time.monotonic()
+        oldest = min((self._positions[user_id].dirty_since for user_id in self._dirty), default=now)
+        return {
+            'dirty': len(self._dirty),
+            'oldest_dirty_age_seconds': now - oldest,
+            'durability_window_seconds': self.flush_interval,
+            'flushes': self.flushes,
+            'flushed_positions': self.flushed_positions,
+        }
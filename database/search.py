@@ -0,0 +1,106 @@
+"""
+Full-text search inside a book.
+
+Every page has a `tsvector` in the `page_search` table, built from the
+plain text of the pages when the book is saved, so compressed pages are
+searchable too. The table is separate from `book_pages`, so page rows,
+which are read on every page turn, stay as small as they are.
+"""
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import asyncpg
+
+SEARCH_CONFIG = 'russian'
+# a phrase found on more pages is too common to be worth paging through
+SEARCH_RESULTS_LIMIT = 500
+
+
+@dataclass
+class SearchResult:
+    book_id: int
+    phrase: str
+    # found pages in the reading order
+    pages: list[int]
+    # stems of the words of the phrase, to find them on a page for a snippet
+    lexemes: list[str]
+    # the size of the pages, see `BookInterface.search`
+    page_size: int | None = None
+
+
+class SearchCache:
+    """The last /find result of every user, kept for `ttl` seconds, so
+    its keyboard is paged through without searching again.
+
+    It doesn't depend on the `SessionCache`, which is off in webhook mode:
+    a result doesn't change when another copy of the bot moves the reader.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._results: OrderedDict[int, tuple[float, SearchResult]] = OrderedDict()
+
+    def get(self, user_id: int) -> SearchResult | None:
+        item = self._results.get(user_id)
+        if item is None:
+            return None
+        expires_at, result = item
+        if expires_at <= time.monotonic():
+            del self._results[user_id]
+            return None
+        return result
+
+    def put(self, user_id: int, result: SearchResult) -> None:
+        self._results[user_id] = (time.monotonic() + self.ttl, result)
+        self._results.move_to_end(user_id)
+        if len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    def forget(self, user_id: int) -> None:
+        self._results.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+
+async def index_book(conn: asyncpg.Connection, book_id: int, pages: list[str]) -> None:
+    query = '''
+    INSERT INTO page_search (book_id, page_no, tsv)
+    SELECT $1, page_no, to_tsvector($3::regconfig, text)
+    FROM unnest($2::text[]) WITH ORDINALITY AS pages (text, page_no);
+    '''
+    await conn.execute(query, book_id, pages, SEARCH_CONFIG)
+
+
+def make_snippet(text: str, lexemes: list[str], length: int) -> str:
+    """Cut about `length` characters of the page around the first word
+    of the phrase, or from the beginning if no word is found literally.
+
+    Args:
+        text: a text of the page.
+        lexemes: stems of the words, they are usually beginnings of the words.
+        length: a maximum length of the snippet.
+
+    Returns:
+        The snippet, with an ellipsis on the cut sides.
+    """
+    start = 0
+    if lexemes:
+        pattern = r'\b(?:' + '|'.join(map(re.escape, lexemes)) + ')'
+        match = re.search(pattern, text, flags=re.IGNORECASE)
+        if match is not None:
+            # a few words before the match give it some context
+            start = max(match.start() - length // 4, 0)
+            space = text.find(' ', start, match.start())
+            if start > 0 and space != -1:
+                start = space + 1
+
+    snippet = ' '.join(text[start:start + length].split())
+    if start > 0:
+        snippet = '…' + snippet
+    if start + length < len(text):
+        snippet += '…'
+    return snippet
@@ -0,0 +1,78 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class Session:
+    """What handlers need to know about a reader."""
+    book_id: int
+    # None if the current book isn't in the user's library, the built-in one after it was removed
+    book_name: str | None
+    page: int
+    page_count: int
+    # None for the default size, the stored pages are turned then
+    page_size: int | None = None
+    # bookmarks of the current book with page beginnings, loaded on the first request
+    bookmarks: dict[int, str] | None = None
+    # monotonic time after which the session is read from the database again
+    expires_at: float = 0.0
+
+
+class SessionCache:
+    """LRU cache of reader sessions keyed by user id.
+
+    A session expires `ttl` seconds after it was read from the database,
+    so a change made by another copy of the bot is picked up at most
+    `ttl` seconds later. Writes of this process drop the session or
+    update it in place. `ttl=0` disables the cache.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self._sessions: OrderedDict[int, Session] = OrderedDict()
+
+    def get(self, user_id: int) -> Session | None:
+        session = self._sessions.get(user_id)
+        if session is None:
+            self.misses += 1
+            return None
+        if session.expires_at <= time.monotonic():
+            del self._sessions[user_id]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def put(self, user_id: int, session: Session) -> None:
+        if self.ttl <= 0:
+            return
+        session.expires_at = time.monotonic() + self.ttl
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        if len(self._sessions) > self.max_size:
+            self._sessions.popitem(last=False)
+
+    def forget(self, user_id: int) -> None:
+        self._sessions.pop(user_id, None)
+
+    def forget_bookmarks(self, user_id: int) -> None:
+        session = self._sessions.get(user_id)
+        if session is not None:
+            session.bookmarks = None
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'expirations': self.expirations,
+            'sessions': len(self._sessions),
+        }
@@ -1,5 +1,5 @@
 from aiogram import Router
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, Message
 
 from lexicon.lexicon import LEXICON
 
@@ -9,3 +9,9 @@ router: Router = Router()
 @router.message()
 async def send_echo(message: Message):
     await message.answer(LEXICON['miss_message'])
+
+
+@router.callback_query()
+async def process_outdated_button_press(callback: CallbackQuery):
+    # buttons of keyboards sent before the callback data format changed
+    await callback.answer(LEXICON['outdated_button'])
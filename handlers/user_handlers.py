@@ -1,21 +1,25 @@
 from aiogram import Router, F
-from aiogram.filters import Command, CommandStart, Text
-from aiogram.types import CallbackQuery, Message
+from aiogram.filters import Command, CommandObject, CommandStart, Text
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message
 
+from callback_factories.bookmarks import (
+    AddBookmarkCallbackFactory,
+    BookmarkCallbackFactory,
+    DelBookmarkCallbackFactory
+)
+from callback_factories.books import BookCallbackFactory, DelBookCallbackFactory
 from callback_factories.edit_items import EditItemsCallbackFactory
+from callback_factories.pagination import PageTurnCallbackFactory
+from callback_factories.search import FoundPageCallbackFactory, SearchPageCallbackFactory
 from database.database import bot_database as db
-from filters.filters import (
-    IsAddToBookMarksCallbackData,
-    IsBookmarkCallbackData,
-    IsDelBookmarkCallbackData,
-    IsBookCallbackData,
-    IsDelBookCallbackData
-)
+from database.search import SearchResult
 from keyboards.bookmarks_kb import create_bookmarks_keyboard, create_edit_bookmarks_keyboard
 from keyboards.books_kb import create_books_keyboard, create_edit_books_keyboard
 from keyboards.pagination_kb import create_pagination_keyboard
+from keyboards.search_kb import FOUND_PAGES_PER_KEYBOARD, create_search_keyboard
 from lexicon.lexicon import LEXICON
-from services.file_handling import get_file_text_from_server, prepare_book, pretty_name, BadBookError
+from services.file_handling import MAX_PAGE_SIZE, MIN_PAGE_SIZE, PAGE_SIZE, pretty_name
+from services.ingestion import IngestionJob, book_ingestion
 
 
 router: Router = Router()
@@ -23,12 +27,11 @@ router: Router = Router()
 
 @router.message(CommandStart())
 async def process_start_command(message: Message):
-    db.user_interface.create_if_not_exists(
+    await db.user_interface.create_if_not_exists(
         user_id=message.from_user.id,
         current_page=1,
         current_book=1,
-        books=[1],
-        book_marks={}
+        books=[1]
     )
     await message.answer(LEXICON[message.text])
 
@@ -40,7 +43,7 @@ async def process_help_command(message: Message):
 
 @router.message(Command(commands='books'))
 async def process_books_command(message: Message):
-    user_books = db.user_interface.get_books(message.from_user.id)
+    user_books = await db.user_interface.get_books(message.from_user.id)
     if user_books:
         await message.answer(
             text=LEXICON[message.text],
@@ -52,12 +55,12 @@ async def process_books_command(message: Message):
 
 @router.message(Command(commands='bookmarks'))
 async def process_bookmarks_command(message: Message):
-    user_book = db.user_interface.get_current_book(message.from_user.id)
-    book_marks = db.user_interface.get_book_marks(message.from_user.id)
+    user_book = await db.user_interface.get_current_book(message.from_user.id)
+    book_marks = await db.user_interface.get_book_marks(message.from_user.id, user_book.id)
     if book_marks:
         await message.answer(
             text=LEXICON[message.text],
-            reply_markup=create_bookmarks_keyboard(user_book, *book_marks[user_book])
+            reply_markup=create_bookmarks_keyboard(user_book.id, book_marks)
         )
     else:
         await message.answer(text=LEXICON['no_bookmarks'])
@@ -65,56 +68,98 @@ async def process_bookmarks_command(message: Message):
 
 @router.message(Command(commands='continue'))
 async def process_continue_command(message: Message):
-    user_book = db.user_interface.get_current_book(message.from_user.id)
-    user_page = db.user_interface.get_current_page(message.from_user.id)
-    text = db.book_interface.get_page_content(user_book, user_page)
-    book_length = db.book_interface.get_length(user_book)
+    state = await db.user_interface.turn_page(message.from_user.id, 0)
+    await message.answer(
+        text=state.text,
+        reply_markup=create_pagination_keyboard(state)
+    )
+
+
+async def _search_keyboard(result: SearchResult, offset: int) -> InlineKeyboardMarkup:
+    # only the pages shown on the keyboard are read for snippets
+    pages = result.pages[offset:offset + FOUND_PAGES_PER_KEYBOARD]
+    texts = await db.book_interface.get_pages(result.book_id, pages, result.page_size)
+    return create_search_keyboard(result, offset, texts)
+
+
+@router.message(Command(commands='find'))
+async def process_find_command(message: Message, command: CommandObject):
+    if not command.args:
+        await message.answer(LEXICON['find_usage'])
+        return
+    result = await db.user_interface.find(message.from_user.id, command.args)
+    if result is None or not result.pages:
+        await message.answer(LEXICON['nothing_found'])
+        return
     await message.answer(
-        text=text,
-        reply_markup=create_pagination_keyboard('backward', f'{user_page}/{book_length}', 'forward')
+        text=LEXICON['/find'],
+        reply_markup=await _search_keyboard(result, 0)
     )
 
 
+@router.message(Command(commands='pagesize'))
+async def process_page_size_command(message: Message, command: CommandObject):
+    args = (command.args or '').strip()
+    if not args.isdecimal() or not MIN_PAGE_SIZE <= int(args) <= MAX_PAGE_SIZE:
+        await message.answer(LEXICON['pagesize_usage'])
+        return
+    # the pages of the default size are the stored ones, they are read without cutting
+    page_size = int(args) if int(args) != PAGE_SIZE else None
+    await db.user_interface.set_page_size(message.from_user.id, page_size)
+    await message.answer(LEXICON['/pagesize'])
+
+
 @router.message(F.document)
 async def process_load_book(message: Message):
     if message.document.mime_type == 'text/plain':
         book_name = message.caption or pretty_name(message.document.file_name)
         beautiful_name = '📖 ' + book_name
-        if db.user_interface.book_exists(message.from_user.id, beautiful_name):
-            answer = LEXICON['book_exists']
+        if await db.user_interface.book_exists(message.from_user.id, beautiful_name):
+            await message.answer(LEXICON['book_exists'])
         else:
-            text = get_file_text_from_server(message.document.file_id)
-            try:
-                content = prepare_book(text)
-                db.user_interface.save_book(message.from_user.id, beautiful_name, content)
-                answer = f'Книга успешно сохранена под именем "{book_name}"'
-            except BadBookError:
-                answer = LEXICON['cant_parse']
+            status = await message.answer(LEXICON['book_processing'])
+            job = IngestionJob(
+                user_id=message.from_user.id,
+                file_id=message.document.file_id,
+                book_name=book_name,
+                chat_id=status.chat.id,
+                message_id=status.message_id
+            )
+            if not book_ingestion.submit(job):
+                await status.edit_text(LEXICON['ingestion_queue_full'])
     else:
-        answer = LEXICON['miss_message']
+        await message.answer(LEXICON['miss_message'])
 
-    await message.answer(answer)
 
+# page turns are the most frequent callbacks, so their filter is checked first
+@router.callback_query(PageTurnCallbackFactory.filter())
+async def process_page_turn_press(callback: CallbackQuery, callback_data: PageTurnCallbackFactory):
+    state = await db.user_interface.turn_page(callback.from_user.id, callback_data.step)
+    await callback.message.edit_text(
+        text=state.text,
+        reply_markup=create_pagination_keyboard(state)
+    )
 
-@router.callback_query(IsBookCallbackData())
-async def process_book_press(callback: CallbackQuery, user_book: str):
-    db.user_interface.set_current_book(callback.from_user.id, user_book)
-    db.user_interface.set_current_page(callback.from_user.id, 1)
-    text = db.book_interface.get_page_content(user_book, 1)
-    book_length = db.book_interface.get_length(user_book)
+
+@router.callback_query(BookCallbackFactory.filter())
+async def process_book_press(callback: CallbackQuery, callback_data: BookCallbackFactory):
+    state = await db.user_interface.open_page(callback.from_user.id, 1, callback_data.book_id)
+    if state is None:
+        await callback.answer(LEXICON['outdated_button'])
+        return
     await callback.message.edit_text(
-        text=text,
-        reply_markup=create_pagination_keyboard('backward', f'1/{book_length}', 'forward')
+        text=state.text,
+        reply_markup=create_pagination_keyboard(state)
     )
 
 
 @router.callback_query(EditItemsCallbackFactory.filter(F.item_type == 'books'))
-async def process_edit_books_press(callback: CallbackQuery):
-    user_books = db.user_interface.get_books(callback.from_user.id)
+async def process_edit_books_press(callback: CallbackQuery, callback_data: EditItemsCallbackFactory):
+    user_books = await db.user_interface.get_books(callback.from_user.id)
     if len(user_books) > 1:
         answer = LEXICON['edit']
         await callback.message.edit_text(
-            text=LEXICON[callback.data],
+            text=LEXICON[f'edit_{callback_data.item_type}'],
             reply_markup=create_edit_books_keyboard(*user_books)
         )
     else:
@@ -124,18 +169,18 @@ async def process_edit_books_press(callback: CallbackQuery):
 
 
 @router.callback_query(Text(text='cancel_edit_book'))
-async def process_edit_books_press(callback: CallbackQuery):
-    user_books = db.user_interface.get_books(callback.from_user.id)
+async def process_cancel_edit_books_press(callback: CallbackQuery):
+    user_books = await db.user_interface.get_books(callback.from_user.id)
     await callback.message.edit_text(
         text=LEXICON['/books'],
         reply_markup=create_books_keyboard(*user_books)
     )
 
 
-@router.callback_query(IsDelBookCallbackData())
-async def process_del_book_press(callback: CallbackQuery, user_book: str):
-    db.user_interface.remove_book(callback.from_user.id, user_book)
-    user_books = db.user_interface.get_books(callback.from_user.id)
+@router.callback_query(DelBookCallbackFactory.filter())
+async def process_del_book_press(callback: CallbackQuery, callback_data: DelBookCallbackFactory):
+    await db.user_interface.remove_book(callback.from_user.id, callback_data.book_id)
+    user_books = await db.user_interface.get_books(callback.from_user.id)
     reply_markup = create_books_keyboard(*user_books)
     if len(user_books) > 1:
         text = LEXICON['edit_books']
@@ -148,69 +193,58 @@ async def process_del_book_press(callback: CallbackQuery, user_book: str):
     await callback.answer(answer)
 
 
-@router.callback_query(Text(text='forward'))
-async def process_forward_press(callback: CallbackQuery):
-    user_page = db.user_interface.get_current_page(callback.from_user.id)
-    user_book = db.user_interface.get_current_book(callback.from_user.id)
-    book_length = db.book_interface.get_length(user_book)
+@router.callback_query(AddBookmarkCallbackFactory.filter())
+async def process_page_press(callback: CallbackQuery, callback_data: AddBookmarkCallbackFactory):
+    # the page and the book shown on the message, not the ones the user has turned to since
+    await db.user_interface.add_book_mark(callback.from_user.id, callback_data.book_id, callback_data.page)
+    await callback.answer(f'Страница {callback_data.page} добавлена в закладки!')
 
-    next_page = user_page + 1
-    if user_page == book_length:
-        next_page = 1
-    db.user_interface.set_current_page(callback.from_user.id, next_page)
-    text = db.book_interface.get_page_content(user_book, next_page)
 
+@router.callback_query(EditItemsCallbackFactory.filter(F.item_type == 'bookmarks'))
+async def process_edit_bookmarks_press(callback: CallbackQuery, callback_data: EditItemsCallbackFactory):
+    user_book = await db.user_interface.get_current_book(callback.from_user.id)
+    book_marks = await db.user_interface.get_book_marks(callback.from_user.id, user_book.id)
     await callback.message.edit_text(
-        text=text,
-        reply_markup=create_pagination_keyboard('backward', f'{next_page}/{book_length}', 'forward')
+        text=LEXICON[f'edit_{callback_data.item_type}'],
+        reply_markup=create_edit_bookmarks_keyboard(user_book.id, book_marks)
     )
+    await callback.answer()
 
 
-@router.callback_query(Text(text='backward'))
-async def process_backward_press(callback: CallbackQuery):
-    user_page = db.user_interface.get_current_page(callback.from_user.id)
-    user_book = db.user_interface.get_current_book(callback.from_user.id)
-    book_length = db.book_interface.get_length(user_book)
-
-    next_page = user_page - 1
-    if user_page == 0:
-        next_page = book_length
-    db.user_interface.set_current_page(callback.from_user.id, next_page)
-    text = db.book_interface.get_page_content(user_book, next_page)
-
+@router.callback_query(BookmarkCallbackFactory.filter())
+async def process_bookmark_press(callback: CallbackQuery, callback_data: BookmarkCallbackFactory):
+    # the book of the keyboard, even if the user has switched to another one since
+    state = await db.user_interface.open_page(callback.from_user.id, callback_data.page, callback_data.book_id)
+    if state is None:
+        await callback.answer(LEXICON['outdated_button'])
+        return
     await callback.message.edit_text(
-        text=text,
-        reply_markup=create_pagination_keyboard('backward', f'{next_page}/{book_length}', 'forward')
+        text=state.text,
+        reply_markup=create_pagination_keyboard(state)
     )
+    await callback.answer()
 
 
-@router.callback_query(IsAddToBookMarksCallbackData())
-async def process_page_press(callback: CallbackQuery):
-    user_page = db.user_interface.get_current_page(callback.from_user.id)
-    user_book = db.user_interface.get_current_book(callback.from_user.id)
-    db.user_interface.add_book_mark(callback.from_user.id, user_book, user_page)
-    await callback.answer(f'Страница {user_page} добавлена в закладки!')
-
-
-@router.callback_query(EditItemsCallbackFactory.filter(F.item_type == 'bookmarks'))
-async def process_edit_bookmarks_press(callback: CallbackQuery):
-    user_book = db.user_interface.get_current_book(callback.from_user.id)
-    book_marks = db.user_interface.get_book_marks(callback.from_user.id)
-    await callback.message.edit_text(
-        text=LEXICON[callback.data],
-        reply_markup=create_edit_bookmarks_keyboard(user_book, *book_marks[user_book])
-    )
+@router.callback_query(SearchPageCallbackFactory.filter())
+async def process_search_page_press(callback: CallbackQuery, callback_data: SearchPageCallbackFactory):
+    result = await db.user_interface.get_search(callback.from_user.id)
+    if result is None:
+        await callback.answer(LEXICON['search_expired'])
+        return
+    await callback.message.edit_reply_markup(reply_markup=await _search_keyboard(result, callback_data.offset))
     await callback.answer()
 
 
-@router.callback_query(IsBookmarkCallbackData())
-async def process_bookmark_press(callback: CallbackQuery, page: int):
-    user_book = db.user_interface.get_current_book(callback.from_user.id)
-    text = db.book_interface.get_page_content(user_book, page)
-    book_length = db.book_interface.get_length(user_book)
+@router.callback_query(FoundPageCallbackFactory.filter())
+async def process_found_page_press(callback: CallbackQuery, callback_data: FoundPageCallbackFactory):
+    # the book the search was made in, even if the user has switched to another one since
+    state = await db.user_interface.open_page(callback.from_user.id, callback_data.page, callback_data.book_id)
+    if state is None:
+        await callback.answer(LEXICON['outdated_button'])
+        return
     await callback.message.edit_text(
-        text=text,
-        reply_markup=create_pagination_keyboard('backward', f'{page}/{book_length}', 'forward')
+        text=state.text,
+        reply_markup=create_pagination_keyboard(state)
     )
     await callback.answer()
 
@@ -221,15 +255,14 @@ async def process_cancel_press(callback: CallbackQuery):
     await callback.answer()
 
 
-@router.callback_query(IsDelBookmarkCallbackData())
-async def process_del_bookmark_press(callback: CallbackQuery, page: int):
-    user_book = db.user_interface.get_current_book(callback.from_user.id)
-    db.user_interface.remove_book_mark(callback.from_user.id, user_book, page)
-    book_marks = db.user_interface.get_book_marks(callback.from_user.id)
+@router.callback_query(DelBookmarkCallbackFactory.filter())
+async def process_del_bookmark_press(callback: CallbackQuery, callback_data: DelBookmarkCallbackFactory):
+    await db.user_interface.remove_book_mark(callback.from_user.id, callback_data.book_id, callback_data.page)
+    book_marks = await db.user_interface.get_book_marks(callback.from_user.id, callback_data.book_id)
     if book_marks:
         await callback.message.edit_text(
             text=LEXICON['edit_bookmarks'],
-            reply_markup=create_edit_bookmarks_keyboard(user_book, *book_marks[user_book])
+            reply_markup=create_edit_bookmarks_keyboard(callback_data.book_id, book_marks)
         )
     else:
         await callback.message.edit_text(text=LEXICON['no_bookmarks'])
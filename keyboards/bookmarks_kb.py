@@ -1,19 +1,20 @@
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from callback_factories.bookmarks import BookmarkCallbackFactory, DelBookmarkCallbackFactory
 from callback_factories.edit_items import EditItemsCallbackFactory
-from database.database import bot_database as db
 from lexicon.lexicon import LEXICON
 
 
-def create_bookmarks_keyboard(book_name: str, *args: int) -> InlineKeyboardMarkup:
+def create_bookmarks_keyboard(book_id: int, previews: dict[int, str]) -> InlineKeyboardMarkup:
     kb_builder: InlineKeyboardBuilder = InlineKeyboardBuilder()
 
-    for button in sorted(set(args)):
+    # the pages come ordered from the database
+    for button, preview in previews.items():
         kb_builder.row(
             InlineKeyboardButton(
-                text=f'{button} - {db.book_interface.get_page_content(book_name, button)[:100]}',
-                callback_data=f'{button}#$%bookmark#$%'
+                text=f'{button} - {preview}',
+                callback_data=BookmarkCallbackFactory(book_id=book_id, page=button).pack()
             )
         )
 
@@ -31,14 +32,14 @@ def create_bookmarks_keyboard(book_name: str, *args: int) -> InlineKeyboardMarku
     return kb_builder.as_markup()
 
 
-def create_edit_bookmarks_keyboard(book_name: str, *args: int) -> InlineKeyboardMarkup:
+def create_edit_bookmarks_keyboard(book_id: int, previews: dict[int, str]) -> InlineKeyboardMarkup:
     kb_builder: InlineKeyboardBuilder = InlineKeyboardBuilder()
 
-    for button in sorted(args):
+    for button, preview in previews.items():
         kb_builder.row(
             InlineKeyboardButton(
-                text=f'{LEXICON["del"]} {button} - {db.book_interface.get_page_content(book_name, button)[:100]}',
-                callback_data=f'{button}#$%delbookmark#$%'
+                text=f'{LEXICON["del"]} {button} - {preview}',
+                callback_data=DelBookmarkCallbackFactory(book_id=book_id, page=button).pack()
             )
         )
 
@@ -1,18 +1,20 @@
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from callback_factories.books import BookCallbackFactory, DelBookCallbackFactory
 from callback_factories.edit_items import EditItemsCallbackFactory
+from database.database import UserBook
 from lexicon.lexicon import LEXICON
 
 
-def create_books_keyboard(*args: str) -> InlineKeyboardMarkup:
+def create_books_keyboard(*args: UserBook) -> InlineKeyboardMarkup:
     kb_builder: InlineKeyboardBuilder = InlineKeyboardBuilder()
 
-    for book_name in sorted(args):
+    for book in sorted(args, key=lambda book: book.name):
         kb_builder.row(
             InlineKeyboardButton(
-                text=book_name,
-                callback_data=f'{book_name}#$%book#$%'
+                text=book.name,
+                callback_data=BookCallbackFactory(book_id=book.id).pack()
             )
         )
 
@@ -31,16 +33,16 @@ def create_books_keyboard(*args: str) -> InlineKeyboardMarkup:
     return kb_builder.as_markup()
 
 
-def create_edit_books_keyboard(*args: str) -> InlineKeyboardMarkup:
+def create_edit_books_keyboard(*args: UserBook) -> InlineKeyboardMarkup:
     kb_builder: InlineKeyboardBuilder = InlineKeyboardBuilder()
 
-    for book_name in sorted(args):
-        if book_name == '📖 Ray Bradbury `The Martian Chronicles`':
+    for book in sorted(args, key=lambda book: book.name):
+        if book.name == '📖 Ray Bradbury `The Martian Chronicles`':
             continue
         kb_builder.row(
             InlineKeyboardButton(
-                text=f'{LEXICON["del"]} {book_name}',
-                callback_data=f'{book_name}#$%delbook#$%'
+                text=f'{LEXICON["del"]} {book.name}',
+                callback_data=DelBookCallbackFactory(book_id=book.id).pack()
             )
         )
 
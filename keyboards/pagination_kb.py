@@ -1,17 +1,26 @@
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from callback_factories.bookmarks import AddBookmarkCallbackFactory
+from callback_factories.pagination import PageTurnCallbackFactory
+from database.database import ReaderState
 from lexicon.lexicon import LEXICON
 
 
-def create_pagination_keyboard(*buttons: str) -> InlineKeyboardMarkup:
+def create_pagination_keyboard(state: ReaderState) -> InlineKeyboardMarkup:
     kb_builder: InlineKeyboardBuilder = InlineKeyboardBuilder()
     kb_builder.row(
-        *[
-            InlineKeyboardButton(
-                text=LEXICON[button] if button in LEXICON else button,
-                callback_data=button
-            ) for button in buttons
-        ]
+        InlineKeyboardButton(
+            text=LEXICON['backward'],
+            callback_data=PageTurnCallbackFactory(step=-1).pack()
+        ),
+        InlineKeyboardButton(
+            text=f'{state.page}/{state.page_count}',
+            callback_data=AddBookmarkCallbackFactory(book_id=state.book_id, page=state.page).pack()
+        ),
+        InlineKeyboardButton(
+            text=LEXICON['forward'],
+            callback_data=PageTurnCallbackFactory(step=1).pack()
+        )
     )
     return kb_builder.as_markup()
@@ -0,0 +1,46 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from callback_factories.search import FoundPageCallbackFactory, SearchPageCallbackFactory
+from database.search import SearchResult, make_snippet
+from lexicon.lexicon import LEXICON
+
+FOUND_PAGES_PER_KEYBOARD = 8
+SNIPPET_LENGTH = 60
+
+
+def create_search_keyboard(result: SearchResult, offset: int, texts: dict[int, str]) -> InlineKeyboardMarkup:
+    """Keyboard of the found pages from `offset` on, `texts` are the texts of these pages."""
+    kb_builder: InlineKeyboardBuilder = InlineKeyboardBuilder()
+
+    for page in result.pages[offset:offset + FOUND_PAGES_PER_KEYBOARD]:
+        kb_builder.row(
+            InlineKeyboardButton(
+                text=f'{page} - {make_snippet(texts.get(page, ""), result.lexemes, SNIPPET_LENGTH)}',
+                callback_data=FoundPageCallbackFactory(book_id=result.book_id, page=page).pack()
+            )
+        )
+
+    navigation = []
+    if offset > 0:
+        navigation.append(
+            InlineKeyboardButton(
+                text=LEXICON['backward'],
+                callback_data=SearchPageCallbackFactory(offset=max(offset - FOUND_PAGES_PER_KEYBOARD, 0)).pack()
+            )
+        )
+    navigation.append(
+        InlineKeyboardButton(
+            text=LEXICON['cancel'],
+            callback_data='cancel'
+        )
+    )
+    if offset + FOUND_PAGES_PER_KEYBOARD < len(result.pages):
+        navigation.append(
+            InlineKeyboardButton(
+                text=LEXICON['forward'],
+                callback_data=SearchPageCallbackFactory(offset=offset + FOUND_PAGES_PER_KEYBOARD).pack()
+            )
+        )
+    kb_builder.row(*navigation)
+    return kb_builder.as_markup()
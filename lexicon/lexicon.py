@@ -1,5 +1,141 @@
+import asyncio
+import json
+import logging
+import os
+
+import asyncpg
+
+from config_data.config import DB_ACQUIRE_TIMEOUT, LEXICON_SNAPSHOT_PATH, LEXICON_CHECK_INTERVAL
 from database.database import bot_database as db
 
+logger = logging.getLogger(__name__)
+
+LEXICON: dict[str, str] = {}
+LEXICON_COMMANDS: dict[str, str] = {}
+
+NOTIFY_CHANNEL = 'lexicon_changed'
+
+
+class LexiconProvider:
+    """Keeps `LEXICON` and `LEXICON_COMMANDS` in sync with the database.
+
+    Nothing is loaded on import. `load` fills the dictionaries from the
+    on-disk snapshot, so a restart reads only the version from the
+    database, and falls back to the database on the first start or if
+    the snapshot is older, e.g. migrations have added phrases and menu
+    commands since, so the menu is set from the current ones. `start` listens for
+    the NOTIFY sent by the lexicon triggers and also compares versions
+    every `check_interval` seconds, in case a notification was missed.
+    The dictionaries are updated in place, so handlers keep reading
+    them as plain dicts.
+    """
+
+    def __init__(self, snapshot_path: str, check_interval: float):
+        self.snapshot_path = snapshot_path
+        self.check_interval = check_interval
+        self.version = 0
+        self._listener: asyncpg.Connection | None = None
+        self._watch_task: asyncio.Task | None = None
+        self._reload_task: asyncio.Task | None = None
+        self._stale = False
+
+    async def load(self) -> None:
+        if self._load_snapshot():
+            try:
+                version = await db.get_row_by_query("SELECT version FROM lexicon_version;")
+            except (asyncpg.PostgresError, OSError, asyncio.TimeoutError):
+                logger.warning('Failed to check the lexicon version, the snapshot is used', exc_info=True)
+                return
+            if version[0] == self.version:
+                return
+            logger.info('The lexicon snapshot is outdated, the database has version %d', version[0])
+        await self.reload()
+
+    async def start(self) -> None:
+        self._watch_task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        for task in (self._watch_task, self._reload_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        if self._listener is not None:
+            await self._listener.close()
+
+    async def reload(self) -> None:
+        async with db.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            # one snapshot of both tables and the version they belong to
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                version = await conn.fetchval("SELECT version FROM lexicon_version;")
+                lexicon = dict(await conn.fetch("SELECT key, value FROM lexicon;"))
+                commands = dict(await conn.fetch("SELECT command, description FROM menu_commands;"))
+
+        self._apply(version, lexicon, commands)
+        self._save_snapshot(lexicon, commands)
+        logger.info('Loaded lexicon version %d from the database', version)
+
+    def _apply(self, version: int, lexicon: dict[str, str], commands: dict[str, str]) -> None:
+        # nothing is awaited in between, so handlers never see a half-updated lexicon
+        LEXICON.clear()
+        LEXICON.update(lexicon)
+        LEXICON_COMMANDS.clear()
+        LEXICON_COMMANDS.update(commands)
+        self.version = version
+
+    def _load_snapshot(self) -> bool:
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as file:
+                snapshot = json.load(file)
+            self._apply(snapshot['version'], snapshot['lexicon'], snapshot['commands'])
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError):
+            logger.warning('Ignoring the broken lexicon snapshot %s', self.snapshot_path)
+            return False
+        logger.info('Loaded lexicon version %d from %s', self.version, self.snapshot_path)
+        return True
+
+    def _save_snapshot(self, lexicon: dict[str, str], commands: dict[str, str]) -> None:
+        snapshot = {'version': self.version, 'lexicon': lexicon, 'commands': commands}
+        temporary_path = self.snapshot_path + '.tmp'
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as file:
+                json.dump(snapshot, file, ensure_ascii=False)
+            # readers never see a partly written snapshot
+            os.replace(temporary_path, self.snapshot_path)
+        except OSError:
+            logger.warning('Failed to save the lexicon snapshot %s', self.snapshot_path, exc_info=True)
+
+    async def _watch(self) -> None:
+        while True:
+            try:
+                if self._listener is None or self._listener.is_closed():
+                    self._listener = await db.listen(NOTIFY_CHANNEL, self._on_notify)
+                version = await db.get_row_by_query("SELECT version FROM lexicon_version;")
+                if version[0] != self.version:
+                    self._schedule_reload()
+            except (asyncpg.PostgresError, OSError, asyncio.TimeoutError):
+                logger.warning('Failed to check the lexicon version', exc_info=True)
+            await asyncio.sleep(self.check_interval)
+
+    def _on_notify(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str) -> None:
+        if int(payload) != self.version:
+            self._schedule_reload()
+
+    def _schedule_reload(self) -> None:
+        # a burst of notifications causes one or two reloads, not one per notification
+        self._stale = True
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self._reload_while_stale())
+
+    async def _reload_while_stale(self) -> None:
+        while self._stale:
+            self._stale = False
+            try:
+                await self.reload()
+            except (asyncpg.PostgresError, OSError, asyncio.TimeoutError):
+                logger.warning('Failed to reload the lexicon', exc_info=True)
+                return
+
 
-LEXICON: dict[str, str] = db.get_table_data_as_dict('lexicon')
-LEXICON_COMMANDS: dict[str, str] = db.get_table_data_as_dict('menu_commands')
+lexicon_provider = LexiconProvider(LEXICON_SNAPSHOT_PATH, LEXICON_CHECK_INTERVAL)
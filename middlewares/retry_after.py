@@ -0,0 +1,46 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from services.metrics import TELEGRAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 3
+
+
+class RetryAfterMiddleware(BaseRequestMiddleware):
+    """Request middleware of the bot's session repeating a Bot API call
+    rejected by the flood control after the delay Telegram asks for.
+
+    A delay longer than `max_delay` isn't waited for, the error is raised
+    as before. While a page turn waits here, the next presses of the user
+    are added up by `ThrottlingMiddleware`.
+    """
+
+    def __init__(self, max_delay: float):
+        self.max_delay = max_delay
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        retries = 0
+        while True:
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as error:
+                if retries == MAX_RETRIES or error.retry_after > self.max_delay:
+                    raise
+                retries += 1
+                name = type(method).__name__
+                TELEGRAM_RETRIES.inc(name)
+                logger.warning('Flood control on %s, retrying in %s seconds', name, error.retry_after)
+                await asyncio.sleep(error.retry_after)
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import CallbackQuery, TelegramObject
+
+from callback_factories.pagination import PageTurnCallbackFactory
+from lexicon.lexicon import LEXICON
+from services.metrics import THROTTLED_UPDATES
+
+# idle readers are forgotten when there are more of them
+PRUNE_SIZE = 10000
+
+
+@dataclass
+class _Reader:
+    tokens: float
+    refilled_at: float
+    # a page turn of the reader is being handled, the next ones are added up
+    turning: bool = False
+    pending_step: int = 0
+    # the latest of the added up presses, its message gets the page
+    pending_event: CallbackQuery | None = None
+    pending_data: dict[str, Any] | None = None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Inner middleware limiting how often the button presses of a user
+    are handled.
+
+    A page turn pressed while the previous one of the user is still
+    handled doesn't get a handler call of its own: its callback is
+    answered right away and its step is added to the pending step, which
+    is turned by one more call when the current one is done. A fast
+    series of presses costs one or two page reads and message edits
+    instead of one for every press.
+
+    Every handler call takes a token from the user's bucket, which holds
+    up to `burst` tokens and gets `rate` of them a second. A page turn
+    waits for a token, and the presses made meanwhile are added up,
+    other presses without one are answered with `too_many_requests`.
+    `rate=0` disables the limit. Messages are passed through: a command
+    or an uploaded book dropped silently would look like a broken bot.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._readers: dict[int, _Reader] = {}
+        self._prune_at = PRUNE_SIZE
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None or not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+        reader = self._get_reader(user.id)
+        callback_data = data.get('callback_data')
+        if isinstance(callback_data, PageTurnCallbackFactory):
+            return await self._turn_page(handler, event, data, reader, callback_data.step)
+
+        if not self._take_token(reader):
+            THROTTLED_UPDATES.inc('limited')
+            await event.answer(LEXICON['too_many_requests'])
+            return None
+        return await handler(event, data)
+
+    async def _turn_page(self, handler, event: CallbackQuery, data: dict[str, Any], reader: _Reader, step: int) -> Any:
+        if reader.turning:
+            reader.pending_step += step
+            reader.pending_event, reader.pending_data = event, data
+            THROTTLED_UPDATES.inc('coalesced')
+            # only stops the progress indicator on the button, the message is edited by the running turn
+            await event.answer()
+            return None
+
+        reader.turning = True
+        try:
+            result = await self._call_when_allowed(handler, event, data, reader)
+            # presses going back and forth may add up to 0, there is nothing to turn then
+            while reader.pending_step:
+                event, data = reader.pending_event, reader.pending_data
+                data['callback_data'] = PageTurnCallbackFactory(step=reader.pending_step)
+                reader.pending_step = 0
+                await self._call_when_allowed(handler, event, data, reader)
+            return result
+        finally:
+            reader.turning = False
+            reader.pending_step = 0
+            reader.pending_event = reader.pending_data = None
+
+    async def _call_when_allowed(self, handler, event: CallbackQuery, data: dict[str, Any], reader: _Reader) -> Any:
+        while not self._take_token(reader):
+            THROTTLED_UPDATES.inc('delayed')
+            await asyncio.sleep((1 - reader.tokens) / self.rate)
+        try:
+            return await handler(event, data)
+        except TelegramBadRequest as error:
+            # the added up step has led to the page already shown, e.g. in a book of one page
+            if 'message is not modified' not in error.message:
+                raise
+
+    def _get_reader(self, user_id: int) -> _Reader:
+        reader = self._readers.get(user_id)
+        if reader is None:
+            if len(self._readers) >= self._prune_at:
+                self._prune()
+            reader = self._readers[user_id] = _Reader(tokens=self.burst, refilled_at=time.monotonic())
+        return reader
+
+    def _take_token(self, reader: _Reader) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        reader.tokens = min(self.burst, reader.tokens + (now - reader.refilled_at) * self.rate)
+        reader.refilled_at = now
+        if reader.tokens < 1:
+            return False
+        reader.tokens -= 1
+        return True
+
+    def _prune(self) -> None:
+        """Forget the readers with a full bucket and no page turn going on,
+        they are the same as new ones."""
+        now = time.monotonic()
+        for user_id, reader in list(self._readers.items()):
+            full = self.rate <= 0 or reader.tokens + (now - reader.refilled_at) * self.rate >= self.burst
+            if full and not reader.turning:
+                del self._readers[user_id]
+        self._prune_at = max(PRUNE_SIZE, 2 * len(self._readers))
@@ -0,0 +1,138 @@
+"""
+Apply pending schema migrations.
+
+Every module `vNNNN_<name>.py` in `scripts/migrations` is a migration
+with an `upgrade(conn)` coroutine. Applied versions are recorded in the
+`schema_migrations` table, and only the pending ones are applied, in
+order, each in its own transaction. Replicas starting at the same time
+wait for each other on a Postgres advisory lock instead of racing.
+
+The bot applies the migrations on startup, the script lets you do it
+before a deployment or check the current version:
+
+Usage:
+    python -m scripts.migrate [--status]
+"""
+import argparse
+import asyncio
+import importlib
+import logging
+import pkgutil
+import re
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import asyncpg
+
+from config_data.config import DB_ACQUIRE_TIMEOUT
+from database.database import bot_database as db
+from scripts import migrations
+
+logger = logging.getLogger(__name__)
+
+# an arbitrary key of the advisory lock, shared by all replicas
+MIGRATIONS_LOCK_ID = 640_913_205
+
+create_query = '''
+CREATE TABLE IF NOT EXISTS public.schema_migrations
+(
+    version integer PRIMARY KEY,
+    name text,
+    applied_at timestamptz DEFAULT now()
+);
+'''
+
+version_query = "SELECT coalesce(max(version), 0) FROM schema_migrations;"
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[asyncpg.Connection], Awaitable[None]]
+
+
+def load_migrations() -> list[Migration]:
+    found = []
+    for module_info in pkgutil.iter_modules(migrations.__path__):
+        match = re.fullmatch(r'v(\d{4})_(\w+)', module_info.name)
+        if match is None:
+            continue
+        module = importlib.import_module(f'{migrations.__name__}.{module_info.name}')
+        found.append(Migration(int(match[1]), match[2], module.upgrade))
+    return sorted(found, key=lambda migration: migration.version)
+
+
+async def get_schema_version(conn: asyncpg.Connection) -> int:
+    """Return the last applied version, 0 for an empty database."""
+    try:
+        return await conn.fetchval(version_query)
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def apply_migrations() -> int:
+    """Apply pending migrations and return the schema version."""
+    available = load_migrations()
+    latest = available[-1].version if available else 0
+
+    async with db.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+        # an up-to-date database is recognized by one query, without the lock
+        version = await get_schema_version(conn)
+        if version >= latest:
+            _log_version(version, latest)
+            return version
+
+        await conn.execute("SELECT pg_advisory_lock($1);", MIGRATIONS_LOCK_ID)
+        try:
+            await conn.execute(create_query)
+            # another replica may have applied the migrations while we were waiting for the lock
+            version = await get_schema_version(conn)
+            for migration in available:
+                if migration.version <= version:
+                    continue
+                logger.info('Applying migration %04d %s', migration.version, migration.name)
+                async with conn.transaction():
+                    await migration.upgrade(conn)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2);",
+                        migration.version, migration.name
+                    )
+                version = migration.version
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1);", MIGRATIONS_LOCK_ID)
+
+    _log_version(version, latest)
+    return version
+
+
+def _log_version(version: int, latest: int) -> None:
+    if version > latest:
+        # a newer replica has already migrated the database during a rolling deploy
+        logger.warning('Schema version %d is newer than the latest known migration %d', version, latest)
+    else:
+        logger.info('Schema version %d', version)
+
+
+async def main(status: bool) -> None:
+    await db.connect()
+    try:
+        if status:
+            async with db.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+                version = await get_schema_version(conn)
+            pending = [migration for migration in load_migrations() if migration.version > version]
+            print(f'Schema version {version}, {len(pending)} pending migrations')
+            for migration in pending:
+                print(f'  {migration.version:04d} {migration.name}')
+        else:
+            await apply_migrations()
+    finally:
+        await db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--status', action='store_true', help='only show the schema version')
+    args = parser.parse_args()
+    asyncio.run(main(args.status))
@@ -0,0 +1,123 @@
+"""
+Move books stored as a single jsonb document (`books.content`) into the
+`book_pages` table, one row per page, and fill `books.page_count`.
+
+The migration is done in two steps, so the bot never has to be stopped:
+
+1. Run the script while the old version of the bot is still working.
+   It adds the new tables and column and copies books in small batches,
+   every batch in its own short transaction, and indexes their pages
+   for /find. `books.content` is not touched, so the old version keeps
+   reading it. Books uploaded during the migration are picked up by the
+   following batches.
+
+2. Deploy the new version of the bot and run the script again with
+   `--drop-content`. It copies the books that have been uploaded since
+   the first run and drops the `books.content` column.
+
+Usage:
+    python -m scripts.migrate_book_pages [--batch-size 20] [--drop-content]
+"""
+import argparse
+import asyncio
+import logging
+
+from database.database import bot_database as db
+
+logger = logging.getLogger(__name__)
+
+prepare_query = '''
+ALTER TABLE public.books ADD COLUMN IF NOT EXISTS page_count integer;
+ALTER TABLE IF EXISTS public.book_pages ADD COLUMN IF NOT EXISTS preview text;
+
+CREATE TABLE IF NOT EXISTS public.book_pages
+(
+    book_id integer,
+    page_no integer,
+    text text,
+    preview text,
+    PRIMARY KEY (book_id, page_no),
+    CONSTRAINT fkkey_book_pages_book FOREIGN KEY (book_id) REFERENCES public.books (id) ON DELETE CASCADE
+);
+
+-- migration 0008 indexes only the pages copied before it is applied
+CREATE TABLE IF NOT EXISTS public.page_search
+(
+    book_id integer,
+    page_no integer,
+    tsv tsvector,
+    PRIMARY KEY (book_id, page_no),
+    CONSTRAINT fkkey_page_search_book FOREIGN KEY (book_id) REFERENCES public.books (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_page_search_tsv ON public.page_search USING gin (tsv);
+'''
+
+content_exists_query = '''
+SELECT EXISTS(
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = 'public' AND table_name = 'books' AND column_name = 'content'
+);
+'''
+
+migrate_batch_query = '''
+WITH batch AS (
+    SELECT id, content
+    FROM books
+    WHERE page_count IS NULL AND content IS NOT NULL
+    ORDER BY id
+    LIMIT $1
+    FOR UPDATE SKIP LOCKED
+), pages AS (
+    INSERT INTO book_pages (book_id, page_no, text, preview)
+    SELECT batch.id, page.key::integer, page.value, left(page.value, 100)
+    FROM batch, jsonb_each_text(batch.content) AS page
+    ON CONFLICT DO NOTHING
+), search AS (
+    INSERT INTO page_search (book_id, page_no, tsv)
+    SELECT batch.id, page.key::integer, to_tsvector('russian', page.value)
+    FROM batch, jsonb_each_text(batch.content) AS page
+    ON CONFLICT DO NOTHING
+)
+UPDATE books
+ SET page_count = (SELECT count(*) FROM jsonb_object_keys(batch.content))
+FROM batch
+WHERE books.id = batch.id
+RETURNING books.id;
+'''
+
+drop_content_query = "ALTER TABLE public.books DROP COLUMN IF EXISTS content;"
+
+
+async def migrate(batch_size: int, drop_content: bool) -> None:
+    await db.connect()
+    try:
+        content_exists, = await db.get_row_by_query(content_exists_query)
+        if not content_exists:
+            logger.info('Nothing to migrate, the books.content column is already dropped')
+            return
+
+        await db.execute_query_and_commit(prepare_query)
+
+        migrated = 0
+        while True:
+            batch = await db.get_rows_by_query(migrate_batch_query, (batch_size,))
+            if not batch:
+                break
+            migrated += len(batch)
+            logger.info('Migrated %d books, last id is %d', migrated, batch[-1][0])
+
+        if drop_content:
+            await db.execute_query_and_commit(drop_content_query)
+            logger.info('Dropped the books.content column')
+    finally:
+        await db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--drop-content', action='store_true')
+    args = parser.parse_args()
+    asyncio.run(migrate(args.batch_size, args.drop_content))
@@ -0,0 +1,74 @@
+"""
+Move bookmarks from the `users.book_marks` jsonb document into the
+`bookmarks` table. Run it after `migrate_user_books`, because bookmarks
+are stored by book name and are matched against the user's library.
+
+The copy and the removal of the column are done in one transaction, so
+the script should be run together with the deployment of the version
+which reads `bookmarks`.
+
+Usage:
+    python -m scripts.migrate_bookmarks
+"""
+import asyncio
+import logging
+
+from config_data.config import DB_ACQUIRE_TIMEOUT
+from database.database import bot_database as db
+
+logger = logging.getLogger(__name__)
+
+book_marks_exists_query = '''
+SELECT EXISTS(
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = 'public' AND table_name = 'users' AND column_name = 'book_marks'
+);
+'''
+
+create_query = '''
+CREATE TABLE IF NOT EXISTS public.bookmarks
+(
+    user_id integer,
+    book_id integer,
+    page_no integer,
+    PRIMARY KEY (user_id, book_id, page_no),
+    CONSTRAINT fkkey_bookmarks_user_book FOREIGN KEY (user_id, book_id)
+        REFERENCES public.user_books (user_id, book_id) ON DELETE CASCADE
+);
+'''
+
+copy_query = '''
+INSERT INTO bookmarks (user_id, book_id, page_no)
+SELECT users.user_id, user_books.book_id, page.value::integer
+FROM users
+ CROSS JOIN jsonb_each(users.book_marks) AS book (name, pages)
+ CROSS JOIN jsonb_array_elements_text(book.pages) AS page (value)
+ JOIN user_books ON user_books.user_id = users.user_id AND user_books.display_name = book.name
+WHERE jsonb_typeof(users.book_marks) = 'object'
+ON CONFLICT DO NOTHING;
+'''
+
+drop_book_marks_query = "ALTER TABLE public.users DROP COLUMN book_marks;"
+
+
+async def migrate() -> None:
+    await db.connect()
+    try:
+        book_marks_exists, = await db.get_row_by_query(book_marks_exists_query)
+        if not book_marks_exists:
+            logger.info('Nothing to migrate, the users.book_marks column is already dropped')
+            return
+
+        async with db.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            async with conn.transaction():
+                await conn.execute(create_query)
+                status = await conn.execute(copy_query)
+                await conn.execute(drop_book_marks_query)
+        logger.info('Copied %s bookmarks, dropped the users.book_marks column', status.split()[-1])
+    finally:
+        await db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate())
@@ -0,0 +1,76 @@
+"""
+Move user libraries from the `users.books` array into the `user_books`
+table. Every book is linked under its name from `books.name`.
+
+The copy and the removal of the column are done in one transaction, so
+the script should be run together with the deployment of the version
+which reads `user_books`.
+
+Usage:
+    python -m scripts.migrate_user_books
+"""
+import asyncio
+import logging
+
+from config_data.config import DB_ACQUIRE_TIMEOUT
+from database.database import bot_database as db
+
+logger = logging.getLogger(__name__)
+
+books_exists_query = '''
+SELECT EXISTS(
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = 'public' AND table_name = 'users' AND column_name = 'books'
+);
+'''
+
+create_query = '''
+CREATE TABLE IF NOT EXISTS public.user_books
+(
+    user_id integer,
+    book_id integer,
+    display_name text,
+    PRIMARY KEY (user_id, book_id),
+    CONSTRAINT uq_user_books_display_name UNIQUE (user_id, display_name) INCLUDE (book_id),
+    CONSTRAINT fkkey_user_books_user FOREIGN KEY (user_id) REFERENCES public.users (user_id) ON DELETE CASCADE,
+    CONSTRAINT fkkey_user_books_book FOREIGN KEY (book_id) REFERENCES public.books (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_user_books_book_id ON public.user_books (book_id);
+-- the foreign key of users is checked on every removal of a book
+CREATE INDEX IF NOT EXISTS ix_users_current_book ON public.users (current_book);
+'''
+
+copy_query = '''
+INSERT INTO user_books (user_id, book_id, display_name)
+SELECT users.user_id, books.id, books.name
+FROM users
+ CROSS JOIN unnest(users.books) AS user_book (book_id)
+ JOIN books ON books.id = user_book.book_id
+ON CONFLICT DO NOTHING;
+'''
+
+drop_books_query = "ALTER TABLE public.users DROP COLUMN books;"
+
+
+async def migrate() -> None:
+    await db.connect()
+    try:
+        books_exists, = await db.get_row_by_query(books_exists_query)
+        if not books_exists:
+            logger.info('Nothing to migrate, the users.books column is already dropped')
+            return
+
+        async with db.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            async with conn.transaction():
+                await conn.execute(create_query)
+                status = await conn.execute(copy_query)
+                await conn.execute(drop_books_query)
+        logger.info('Copied %s user books, dropped the users.books column', status.split()[-1])
+    finally:
+        await db.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate())
@@ -0,0 +1,97 @@
+"""Tables of books, users and their libraries, lexicon and menu commands."""
+import asyncpg
+
+query = '''
+CREATE TABLE IF NOT EXISTS public.books
+(
+    id serial PRIMARY KEY,
+    name text,
+    page_count integer
+);
+
+CREATE TABLE IF NOT EXISTS public.book_pages
+(
+    book_id integer,
+    page_no integer,
+    text text,
+    preview text,
+    PRIMARY KEY (book_id, page_no),
+    CONSTRAINT fkkey_book_pages_book FOREIGN KEY (book_id) REFERENCES public.books (id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS public.lexicon
+(
+    key character varying PRIMARY KEY,
+    value text
+);
+
+CREATE TABLE IF NOT EXISTS public.menu_commands
+(
+    command character varying PRIMARY KEY,
+    description text
+);
+
+CREATE TABLE IF NOT EXISTS public.users
+(
+    user_id integer PRIMARY KEY,
+    current_book integer,
+    current_page integer,
+    CONSTRAINT fkkey_users_current_book FOREIGN KEY (current_book) REFERENCES public.books (id)
+);
+
+CREATE TABLE IF NOT EXISTS public.user_books
+(
+    user_id integer,
+    book_id integer,
+    display_name text,
+    PRIMARY KEY (user_id, book_id),
+    -- name lookups of a user are answered by an index-only scan
+    CONSTRAINT uq_user_books_display_name UNIQUE (user_id, display_name) INCLUDE (book_id),
+    CONSTRAINT fkkey_user_books_user FOREIGN KEY (user_id) REFERENCES public.users (user_id) ON DELETE CASCADE,
+    CONSTRAINT fkkey_user_books_book FOREIGN KEY (book_id) REFERENCES public.books (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_user_books_book_id ON public.user_books (book_id);
+-- the foreign key of users is checked on every removal of a book
+CREATE INDEX IF NOT EXISTS ix_users_current_book ON public.users (current_book);
+
+CREATE TABLE IF NOT EXISTS public.bookmarks
+(
+    user_id integer,
+    book_id integer,
+    page_no integer,
+    -- bookmarks of a book are read by one range scan, already ordered by page
+    PRIMARY KEY (user_id, book_id, page_no),
+    CONSTRAINT fkkey_bookmarks_user_book FOREIGN KEY (user_id, book_id)
+        REFERENCES public.user_books (user_id, book_id) ON DELETE CASCADE
+);
+'''
+
+# the tables created by `scripts/setup_db.py` of the first versions are kept by
+# CREATE TABLE IF NOT EXISTS as they are: their books are moved to `book_pages` by
+# `scripts.migrate_book_pages`, and lexicon and menu_commands have no keys, while
+# the phrases are seeded with ON CONFLICT, so a duplicated key keeps its last row
+adopt_query = '''
+ALTER TABLE public.books ADD COLUMN IF NOT EXISTS page_count integer;
+
+DO $$
+BEGIN
+    IF NOT EXISTS(SELECT 1 FROM pg_constraint WHERE conrelid = 'public.lexicon'::regclass AND contype = 'p') THEN
+        DELETE FROM public.lexicon a USING public.lexicon b WHERE a.key = b.key AND a.ctid < b.ctid;
+        DELETE FROM public.lexicon WHERE key IS NULL;
+        ALTER TABLE public.lexicon ADD PRIMARY KEY (key);
+    END IF;
+    IF NOT EXISTS(SELECT 1 FROM pg_constraint WHERE conrelid = 'public.menu_commands'::regclass AND contype = 'p') THEN
+        DELETE FROM public.menu_commands a USING public.menu_commands b
+        WHERE a.command = b.command AND a.ctid < b.ctid;
+        DELETE FROM public.menu_commands WHERE command IS NULL;
+        ALTER TABLE public.menu_commands ADD PRIMARY KEY (command);
+    END IF;
+END
+$$;
+'''
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    await conn.execute(query)
+    await conn.execute(adopt_query)
@@ -1,39 +1,9 @@
-query = '''
-drop table if exists users;
-drop table if exists books;
-drop table if exists lexicon;
-drop table if exists menu_commands;
-
-CREATE TABLE IF NOT EXISTS public.books
-(
-    id serial PRIMARY KEY,
-    name text,
-    content jsonb
-);
-
-CREATE TABLE IF NOT EXISTS public.lexicon
-(
-    key character varying,
-    value text
-);
-
-CREATE TABLE IF NOT EXISTS public.menu_commands
-(
-    command character varying,
-    description text
-);
-
-CREATE TABLE IF NOT EXISTS public.users
-(
-    user_id integer PRIMARY KEY,
-    current_book integer,
-    current_page integer,
-    books integer[],
-    book_marks jsonb,
-	CONSTRAINT fkkey_users_current_book FOREIGN KEY (current_book) REFERENCES public.books (id)
-);
+"""Phrases of the bot and commands of the main menu."""
+import asyncpg
 
+from scripts.migrations.v0001_initial_schema import adopt_query
 
+query = '''
 INSERT INTO lexicon (key, value)
 VALUES
     ('/start', 'Привет, читатель!\n\nЭто бот с помощью которого ты можешь добавлять книги в свою библиотеку, для удобного чтения\n\nЧтобы посмотреть список доступных команд - набери /help'),
@@ -41,6 +11,11 @@ VALUES
     ('/books', 'Это список ваших книг:'),
     ('/bookmarks', 'Это список ваших закладок:'),
     ('cant_parse', 'Я не смог спарсить данный файл :(\nПроверьте его исправность'),
+    ('book_too_large', 'Файл слишком большой, попробуйте разбить книгу на несколько частей'),
+    ('book_processing', 'Книга загружается, я сообщу, когда она будет готова'),
+    ('book_paginating', 'Книга загружена, разбиваю её на страницы...'),
+    ('book_failed', 'Не удалось сохранить книгу, попробуйте отправить её ещё раз'),
+    ('ingestion_queue_full', 'Сейчас я обрабатываю слишком много книг, попробуйте отправить файл чуть позже'),
     ('forward', '>'),
     ('backward', '<'),
     ('edit_books', 'Редактировать книги:'),
@@ -55,12 +30,20 @@ VALUES
     ('del', '❌'),
     ('cancel', 'ОТМЕНИТЬ'),
     ('cancel_text', '/continue - продолжить чтение'),
-    ('miss_message', 'Данное сообщение не предусмотрено моей логикой, посмотрите справку по использованию - /help');
+    ('miss_message', 'Данное сообщение не предусмотрено моей логикой, посмотрите справку по использованию - /help')
+ON CONFLICT (key) DO NOTHING;
 
 INSERT INTO menu_commands (command, description)
 VALUES
     ('/continue', 'Продолжить чтение'),
     ('/books', 'Мои книги'),
     ('/bookmarks', 'Мои закладки'),
-    ('/help', 'Справка по работе бота');
+    ('/help', 'Справка по работе бота')
+ON CONFLICT (command) DO NOTHING;
 '''
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    # a database of the first versions could stop here with 0001 applied before it adopted the old tables
+    await conn.execute(adopt_query)
+    await conn.execute(query)
@@ -0,0 +1,15 @@
+"""The book every new user starts with. Handlers expect it to have id 1."""
+import asyncpg
+
+from database.database import insert_book
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    # the bundled JSON is parsed only when the book is actually seeded
+    from scripts.storage.add_book_query import book_name, pages
+
+    if await conn.fetchval("SELECT EXISTS(SELECT 1 FROM books WHERE id = 1);"):
+        return
+    book_id = await insert_book(conn, book_name, pages)
+    if book_id != 1:
+        raise RuntimeError(f'The built-in book got id {book_id} instead of 1')
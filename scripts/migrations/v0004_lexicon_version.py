@@ -0,0 +1,36 @@
+"""Version of the lexicon, bumped and announced with NOTIFY on every change,
+so running bots reload their phrases."""
+import asyncpg
+
+query = '''
+CREATE TABLE IF NOT EXISTS public.lexicon_version
+(
+    version integer NOT NULL
+);
+
+INSERT INTO lexicon_version (version)
+SELECT 1
+WHERE NOT EXISTS(SELECT 1 FROM lexicon_version);
+
+CREATE OR REPLACE FUNCTION public.lexicon_changed() RETURNS trigger AS $$
+DECLARE
+    new_version integer;
+BEGIN
+    UPDATE lexicon_version SET version = version + 1 RETURNING version INTO new_version;
+    PERFORM pg_notify('lexicon_changed', new_version::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER lexicon_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.lexicon
+FOR EACH STATEMENT EXECUTE FUNCTION public.lexicon_changed();
+
+CREATE OR REPLACE TRIGGER menu_commands_changed
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.menu_commands
+FOR EACH STATEMENT EXECUTE FUNCTION public.lexicon_changed();
+'''
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    await conn.execute(query)
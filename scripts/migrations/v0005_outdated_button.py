@@ -0,0 +1,12 @@
+"""A phrase for buttons of keyboards sent before the callback data format changed."""
+import asyncpg
+
+query = '''
+INSERT INTO lexicon (key, value)
+VALUES ('outdated_button', 'Эта кнопка устарела, откройте меню заново: /continue, /books или /bookmarks')
+ON CONFLICT (key) DO NOTHING;
+'''
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    await conn.execute(query)
@@ -0,0 +1,23 @@
+"""Optional compressed page storage, see `database.compression`.
+
+A page keeps either its text or the compressed `data`, the codec and
+the dictionary of the book are in the `books` row.
+"""
+import asyncpg
+
+query = '''
+ALTER TABLE public.books
+    ADD COLUMN IF NOT EXISTS codec text,
+    ADD COLUMN IF NOT EXISTS zdict bytea;
+
+ALTER TABLE public.book_pages
+    ADD COLUMN IF NOT EXISTS data bytea;
+
+-- the values are compressed already, TOAST shouldn't try again
+ALTER TABLE public.books ALTER COLUMN zdict SET STORAGE EXTERNAL;
+ALTER TABLE public.book_pages ALTER COLUMN data SET STORAGE EXTERNAL;
+'''
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    await conn.execute(query)
@@ -0,0 +1,41 @@
+"""Books shared between libraries.
+
+An uploaded book is found by the hash of its normalized text, so a copy
+uploaded by another user is only linked to their library. `ref_count`
+is the number of libraries with the book and is kept by a trigger on
+`user_books`, the built-in book holds one more reference, so it is never
+collected. Books saved before have no hash and are never shared.
+"""
+import asyncpg
+
+query = '''
+ALTER TABLE public.books
+    ADD COLUMN IF NOT EXISTS content_hash bytea,
+    ADD COLUMN IF NOT EXISTS ref_count integer NOT NULL DEFAULT 0;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ux_books_content_hash ON public.books (content_hash)
+WHERE content_hash IS NOT NULL;
+
+UPDATE books
+SET ref_count = (SELECT count(*) FROM user_books WHERE user_books.book_id = books.id)
+                + CASE WHEN books.id = 1 THEN 1 ELSE 0 END;
+
+CREATE OR REPLACE FUNCTION public.count_book_references() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE books SET ref_count = ref_count + 1 WHERE id = NEW.book_id;
+    ELSE
+        UPDATE books SET ref_count = ref_count - 1 WHERE id = OLD.book_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER user_books_ref_count
+AFTER INSERT OR DELETE ON public.user_books
+FOR EACH ROW EXECUTE FUNCTION public.count_book_references();
+'''
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    await conn.execute(query)
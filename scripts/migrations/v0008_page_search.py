@@ -0,0 +1,44 @@
+"""Full-text index of pages for /find, see `database.search`.
+
+Pages stored as text are indexed by SQL, pages of compressed books are
+decompressed and indexed book by book.
+"""
+import asyncpg
+
+query = '''
+CREATE TABLE IF NOT EXISTS public.page_search
+(
+    book_id integer,
+    page_no integer,
+    tsv tsvector,
+    PRIMARY KEY (book_id, page_no),
+    CONSTRAINT fkkey_page_search_book FOREIGN KEY (book_id) REFERENCES public.books (id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS ix_page_search_tsv ON public.page_search USING gin (tsv);
+
+INSERT INTO page_search (book_id, page_no, tsv)
+SELECT book_id, page_no, to_tsvector('russian', text)
+FROM book_pages
+WHERE text IS NOT NULL
+ON CONFLICT DO NOTHING;
+'''
+
+compressed_books_query = '''
+SELECT id, codec, zdict
+FROM books
+WHERE codec IS NOT NULL AND NOT EXISTS(SELECT 1 FROM page_search WHERE book_id = books.id);
+'''
+
+pages_query = "SELECT data FROM book_pages WHERE book_id = $1 ORDER BY page_no;"
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    from database.compression import make_codec
+    from database.search import index_book
+
+    await conn.execute(query)
+    for book_id, codec_name, zdict in await conn.fetch(compressed_books_query):
+        codec = make_codec(codec_name, zdict)
+        pages = [codec.decompress(data) for data, in await conn.fetch(pages_query, book_id)]
+        await index_book(conn, book_id, pages)
@@ -0,0 +1,29 @@
+"""Phrases and the menu command of /find."""
+import asyncpg
+
+query = '''
+INSERT INTO lexicon (key, value)
+VALUES
+    ('/find', 'Страницы текущей книги, на которых есть эта фраза:'),
+    ('find_usage', 'Напишите фразу после команды, например: /find капитанская дочка\n\nЧтобы найти фразу целиком, возьмите её в кавычки'),
+    ('nothing_found', 'В текущей книге нет такой фразы'),
+    ('search_expired', 'Результаты поиска устарели, повторите /find')
+ON CONFLICT (key) DO NOTHING;
+
+-- a /help edited by hand is left as it is
+UPDATE lexicon
+SET value = replace(
+    value,
+    E'/bookmarks - посмотреть список закладок у текущей книги\\n',
+    E'/bookmarks - посмотреть список закладок у текущей книги\\n/find фраза - найти страницы с фразой в текущей книге\\n'
+)
+WHERE key = '/help' AND value NOT LIKE '%/find%';
+
+INSERT INTO menu_commands (command, description)
+VALUES ('/find', 'Поиск по книге')
+ON CONFLICT (command) DO NOTHING;
+'''
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    await conn.execute(query)
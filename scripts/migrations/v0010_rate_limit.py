@@ -0,0 +1,12 @@
+"""The answer to a button pressed over the per-user rate limit."""
+import asyncpg
+
+query = '''
+INSERT INTO lexicon (key, value)
+VALUES ('too_many_requests', 'Слишком много нажатий, подождите немного')
+ON CONFLICT (key) DO NOTHING;
+'''
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    await conn.execute(query)
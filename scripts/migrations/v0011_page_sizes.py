@@ -0,0 +1,63 @@
+"""Pages of the size chosen by a user, see `database.layouts`.
+
+The break indexes of the stored books are built from their pages, the
+pages of compressed books are decompressed book by book. The books not
+yet moved to `book_pages` by `scripts.migrate_book_pages` are indexed
+when they are first read at a custom size.
+"""
+import asyncpg
+
+query = '''
+CREATE TABLE IF NOT EXISTS public.book_breaks
+(
+    book_id integer PRIMARY KEY,
+    length integer NOT NULL,
+    positions bytea NOT NULL,
+    kinds bytea NOT NULL,
+    page_starts bytea NOT NULL,
+    CONSTRAINT fkkey_book_breaks_book FOREIGN KEY (book_id) REFERENCES public.books (id) ON DELETE CASCADE
+);
+
+-- NULL is the default size, the pages are stored at it
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS page_size integer;
+
+INSERT INTO lexicon (key, value)
+VALUES
+    ('/pagesize', 'Размер страниц изменён, продолжить чтение - /continue'),
+    ('pagesize_usage', 'Напишите после команды, сколько символов помещать на страницу, от 300 до 4000, например: /pagesize 2000\n\nОбычный размер страницы - 1050 символов')
+ON CONFLICT (key) DO NOTHING;
+
+-- a /help edited by hand is left as it is
+UPDATE lexicon
+SET value = replace(
+    value,
+    E'/find фраза - найти страницы с фразой в текущей книге\\n',
+    E'/find фраза - найти страницы с фразой в текущей книге\\n/pagesize число - изменить размер страниц\\n'
+)
+WHERE key = '/help' AND value NOT LIKE '%/pagesize%';
+
+INSERT INTO menu_commands (command, description)
+VALUES ('/pagesize', 'Размер страниц')
+ON CONFLICT (command) DO NOTHING;
+'''
+
+books_query = '''
+SELECT id, codec, zdict
+FROM books
+WHERE page_count IS NOT NULL AND NOT EXISTS(SELECT 1 FROM book_breaks WHERE book_id = books.id);
+'''
+
+pages_query = "SELECT text, data FROM book_pages WHERE book_id = $1 ORDER BY page_no;"
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    from database.compression import make_codec
+    from database.layouts import save_breaks
+    from services.file_handling import index_pages
+
+    await conn.execute(query)
+    for book_id, codec_name, zdict in await conn.fetch(books_query):
+        codec = make_codec(codec_name, zdict) if codec_name is not None else None
+        rows = await conn.fetch(pages_query, book_id)
+        pages = [text if data is None else codec.decompress(data) for text, data in rows]
+        await save_breaks(conn, book_id, index_pages(pages))
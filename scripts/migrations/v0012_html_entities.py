@@ -0,0 +1,76 @@
+"""Repair the HTML entities of the stored pages.
+
+The pages used to be escaped without semicolons and with `&` replaced
+last, so `<` became `&amplt`. The pages with such entities are fixed,
+compressed ones are decompressed and compressed again, and their books
+get new search vectors and break indexes, as the page lengths change.
+An entity which was cut between two pages is left as it is.
+"""
+import re
+
+import asyncpg
+
+# `&amp` is the beginning of every entity of an old page, one which is
+# followed by a semicolon is an entity of a new page or an escaped `&amp;`
+_OLD_ENTITY = re.compile(r'&amp(lt|gt)?(?!;)')
+
+# the pages of compressed books can only be checked decompressed
+books_query = '''
+SELECT id, codec, zdict
+FROM books
+WHERE page_count IS NOT NULL
+ AND (codec IS NOT NULL OR EXISTS(SELECT 1 FROM book_pages WHERE book_id = books.id AND text LIKE '%&amp%'));
+'''
+
+pages_query = "SELECT page_no, text, data FROM book_pages WHERE book_id = $1 ORDER BY page_no;"
+
+update_query = '''
+UPDATE book_pages
+ SET text = pages.text,
+     data = pages.data,
+     preview = pages.preview
+FROM unnest($2::integer[], $3::text[], $4::bytea[], $5::text[]) AS pages (page_no, text, data, preview)
+WHERE book_pages.book_id = $1 AND book_pages.page_no = pages.page_no;
+'''
+
+search_query = '''
+UPDATE page_search
+ SET tsv = to_tsvector($4::regconfig, pages.text)
+FROM unnest($2::integer[], $3::text[]) AS pages (page_no, text)
+WHERE page_search.book_id = $1 AND page_search.page_no = pages.page_no;
+'''
+
+delete_breaks_query = "DELETE FROM book_breaks WHERE book_id = $1;"
+
+
+def _fix_entities(text: str) -> str:
+    return _OLD_ENTITY.sub(lambda match: f'&{match.group(1) or "amp"};', text)
+
+
+async def upgrade(conn: asyncpg.Connection) -> None:
+    from database.compression import make_codec
+    from database.database import PREVIEW_LENGTH
+    from database.layouts import save_breaks
+    from database.search import SEARCH_CONFIG
+    from services.file_handling import index_pages
+
+    for book_id, codec_name, zdict in await conn.fetch(books_query):
+        codec = make_codec(codec_name, zdict) if codec_name is not None else None
+        rows = await conn.fetch(pages_query, book_id)
+        pages = [text if data is None else codec.decompress(data) for _, text, data in rows]
+        fixed = [_fix_entities(text) for text in pages]
+        changed = [i for i, (old, new) in enumerate(zip(pages, fixed)) if old != new]
+        if not changed:
+            continue
+
+        page_numbers = [rows[i]['page_no'] for i in changed]
+        texts = [fixed[i] for i in changed]
+        if codec is None:
+            values = (texts, [None] * len(texts))
+        else:
+            values = ([None] * len(texts), [codec.compress(text) for text in texts])
+        previews = [text[:PREVIEW_LENGTH] for text in texts]
+        await conn.execute(update_query, book_id, page_numbers, *values, previews)
+        await conn.execute(search_query, book_id, page_numbers, texts, SEARCH_CONFIG)
+        await conn.execute(delete_breaks_query, book_id)
+        await save_breaks(conn, book_id, index_pages(fixed))
@@ -2,7 +2,6 @@ import json
 
 with open(r'scripts/storage/Bredberi_Marsianskie_hroniki.json', encoding='utf-8') as f:
     content = json.load(f)
-    content_str = json.dumps(content)
 
-query = 'INSERT INTO books (name, content) VALUES (%s, %s)'
-values = ('📖 Ray Bradbury `The Martian Chronicles`', content_str)
+book_name = '📖 Ray Bradbury `The Martian Chronicles`'
+pages = [content[str(page)] for page in range(1, len(content) + 1)]
@@ -1,11 +1,51 @@
-import json
+import codecs
+import hashlib
+import html
 import re
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import AsyncIterator, BinaryIO, Iterator
 
-import requests
+from aiogram import Bot
+from aiohttp import ClientTimeout
+from charset_normalizer import from_bytes
 
-from config_data.config import BOT_TOKEN
+from config_data.config import MAX_BOOK_SIZE, DOWNLOAD_TIMEOUT
 
 PAGE_SIZE = 1050
+# the page sizes a user may choose with /pagesize
+MIN_PAGE_SIZE = 300
+MAX_PAGE_SIZE = 4000
+# the part of a page its end is looked for in first, see `pick_page_end`
+PAGE_FILL = 0.75
+CHUNK_SIZE = 64 * 1024
+# the encoding of an uploaded file is detected by this many bytes from its beginning
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+_BOMS = ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+         (codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+# of the codecs decoding a sample the same, these are the usual ones for Russian texts
+_COMMON_ENCODINGS = ('cp1251', 'koi8_r', 'cp866')
+# control characters which are neither whitespace nor printable, NUL can't even be stored in Postgres
+_CONTROL_CHARS = re.compile(r'[\x00-\x08\x0e-\x1b\x7f-\x84\x86-\x9f]')
+# held back at the end of a chunk, U+3000 is the last whitespace character
+_TRAILING_CHARS = ''.join(char for char in map(chr, range(0x3001)) if char.isspace() or _CONTROL_CHARS.match(char))
+
+# kinds of break points, from the weakest to the strongest
+WORD, CLAUSE, SENTENCE, PARAGRAPH = range(4)
+# a punctuation mark with the closing quotes or brackets and the whitespace after it, or an empty line.
+# The semicolon of an HTML entity isn't a punctuation mark
+_BREAK = re.compile(r'[.!?…,;:](?<!&lt;)(?<!&gt;)(?<!&amp;)[»"”’\')\]]*\s+|\n\n\s*')
+# whitespace, or the end of an HTML entity, so a text without whitespace isn't cut in the middle of one
+_WORD_BREAK = re.compile(r'\s+|&(?:lt|gt|amp);')
+_SENTENCE_ENDS = '.!?…'
+# kinds of the separators found so far, there are only a few different ones
+_SEPARATOR_KINDS: dict[str, int] = {}
+# the whitespace of a normalized text is at most an empty line
+_SEPARATOR_MAX_LENGTH = 64
+# words are only collected between breaks further apart than the last part of the smallest page
+WORD_GAP = int(MIN_PAGE_SIZE * (1 - PAGE_FILL))
 
 
 class BadBookError(Exception):
@@ -14,40 +54,484 @@ class BadBookError(Exception):
         super().__init__(self.message, *args, **kwargs)
 
 
-def _get_part_text(text: str, start: int, page_size: int) -> tuple[str, int] | None:
+class BookTooLargeError(Exception):
+    def __init__(self, *args, **kwargs):
+        self.message = f'The file is larger than {MAX_BOOK_SIZE} bytes'
+        super().__init__(self.message, *args, **kwargs)
+
+
+def _escape_html(text: str) -> str:
     # we use HTML parse mode in our bot, so we need to edit some symbols
-    text = text.replace('<', '&lt').replace('>', '&gt').replace('&', '&amp')
-    end = start + page_size
-    if end >= len(text):
-        return text[start:], len(text) - start
-
-    for i in range(end - 1, start - 1, -1):
-        if text[i] in ",.!:;?":
-            return text[start:i + 1], i + 1 - start
-
-    raise BadBookError()
-
-
-def prepare_book(text: str) -> str:
-    content = {}
-    cur_idx = cur_page = 0
-    while cur_idx < len(text):
-        cur_page += 1
-        page_text, page_length = _get_part_text(text, cur_idx, PAGE_SIZE)
-        content[cur_page] = page_text.lstrip()
-        cur_idx += page_length
-
-    return json.dumps(content)
-
-
-def get_file_text_from_server(file_id: str) -> str:
-    file_info_url = f'https://api.telegram.org/bot{BOT_TOKEN}/getFile?file_id={file_id}'
-    response = requests.get(file_info_url)
-    file_info = response.json()
-    file_path = file_info["result"]["file_path"]
-    file_url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_path}"
-    response = requests.get(file_url)
-    return response.text
+    return html.escape(text, quote=False)
+
+
+def _separator_kind(separator: str) -> int:
+    if separator[0] in _SENTENCE_ENDS:
+        # a line break after a sentence ends a paragraph in texts with indents instead of empty lines
+        return PARAGRAPH if '\n' in separator else SENTENCE
+    return PARAGRAPH if '\n\n' in separator else CLAUSE
+
+
+@dataclass
+class BreakIndex:
+    """Points of a text where a page may end, see `BreakIndexer`."""
+    # positions of the first characters after the breaks, ascending
+    positions: array = field(default_factory=lambda: array('I'))
+    kinds: bytearray = field(default_factory=bytearray)
+    length: int = 0
+    # positions of the stored pages of a book, see `index_pages`
+    page_starts: array = field(default_factory=lambda: array('I'))
+
+
+def detect_encoding(sample: bytes) -> str:
+    """Guess the encoding of a text by its beginning.
+
+    A BOM is trusted, a sample which is valid UTF-8 is UTF-8 (a character
+    cut at the end of the sample is fine), otherwise `charset_normalizer`
+    picks the most likely legacy encoding, e.g. cp1251 or koi8-r.
+
+    Args:
+        sample: the first bytes of the text.
+
+    Returns:
+        A name of a Python codec.
+
+    Raises:
+        BadBookError: if the sample doesn't look like a text.
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    results = from_bytes(sample)
+    match = results.best()
+    if match is None:
+        raise BadBookError()
+    # e.g. cp1125 and cp866 differ only in a few symbols, which may be missing from the sample
+    for name in _COMMON_ENCODINGS:
+        if any(name in result.could_be_from_charset and result.chaos <= match.chaos
+               and result.coherence >= match.coherence for result in results):
+            return name
+    return match.encoding
+
+
+class TextNormalizer:
+    """Incremental cleanup of a decoded text.
+
+    Line endings become `\\n`, control characters are dropped and every
+    run of whitespace becomes a space, a line break or an empty line, so
+    indents and trailing spaces of lines are gone and the words of every
+    line are separated by single spaces. The whitespace at the end of a
+    chunk is held back until the next one, as it may continue there.
+    """
+
+    def __init__(self):
+        self._tail = ''
+        self._started = False
+        # line breaks after the last word, they are written in front of the next one
+        self._line_breaks = 0
+
+    def feed(self, text: str) -> str:
+        text = self._tail + text
+        # the control characters at the end may be followed by more whitespace
+        cut = len(text.rstrip(_TRAILING_CHARS))
+        self._tail = text[cut:]
+        if len(self._tail) > CHUNK_SIZE:
+            # only the line breaks of a run of whitespace matter, so it doesn't pile up
+            line_breaks = _CONTROL_CHARS.sub('', self._tail).replace('\r\n', '\n').replace('\r', '\n').count('\n')
+            self._tail = '\n' * min(line_breaks, 2) or ' '
+        return self._normalize(text[:cut])
+
+    def close(self) -> str:
+        # whitespace at the end of the text is dropped
+        self._tail = ''
+        return ''
+
+    def _normalize(self, text: str) -> str:
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        parts = []
+        line_breaks = self._line_breaks
+        for line in text.split('\n'):
+            if line.isprintable() and '  ' not in line:
+                # most lines have nothing to clean up but spaces at the ends, checking it is cheaper than splitting
+                cleaned = line.strip(' ')
+            else:
+                line = _CONTROL_CHARS.sub('', line)
+                cleaned = ' '.join(line.split())
+            if cleaned:
+                if not self._started:
+                    # the whitespace in front of the first word of the text is dropped
+                    self._started = True
+                elif line_breaks:
+                    parts.append('\n\n' if line_breaks > 1 else '\n')
+                elif line[0].isspace():
+                    parts.append(' ')
+                parts.append(cleaned)
+                line_breaks = 0
+            line_breaks += 1
+        # `text` ends with a word unless it has no words at all, no line break follows the last line
+        self._line_breaks = line_breaks - 1
+        return ''.join(parts)
+
+
+class BreakIndexer:
+    """Single pass over a text fed part by part, collecting its break
+    points into a `BreakIndex`.
+
+    Punctuation marks followed by whitespace and empty lines are found
+    everywhere. Plain whitespace between words is only collected where
+    those are more than `WORD_GAP` characters apart: every page of at
+    least `MIN_PAGE_SIZE` characters which can't end at a stronger break
+    has its end in such a gap, so the index stays several times smaller
+    than the one of every word and the pages are the same.
+    """
+
+    def __init__(self):
+        self.index = BreakIndex()
+        # the part of the text which may have more breaks to find, from `_offset` on
+        self._text = ''
+        self._offset = 0
+        self._scan_from = 0
+        # the last break which isn't a word one and the position the words after it are collected from
+        self._gap_start = 0
+        self._words_from = 0
+
+    def feed(self, text: str) -> None:
+        self._text += text
+        self._scan(final=False)
+        keep_from = min(self._scan_from, self._words_from) - self._offset
+        self._text = self._text[keep_from:]
+        self._offset += keep_from
+
+    @property
+    def indexed_to(self) -> int:
+        """The position up to which the index has all its breaks, later
+        parts of the text may add ones after it only."""
+        return self._words_from
+
+    def close(self) -> BreakIndex:
+        self._scan(final=True)
+        self.index.length = self._offset + len(self._text)
+        self._text = ''
+        return self.index
+
+    def _scan(self, final: bool) -> None:
+        text, offset = self._text, self._offset
+        positions, kinds = self.index.positions, self.index.kinds
+        scanned = self._scan_from - offset
+        # the position of the last break relative to `text`, the loop is the hot spot of the pagination
+        gap_start = self._gap_start - offset
+        for match in _BREAK.finditer(text, scanned):
+            start, end = match.span()
+            if end == len(text):
+                # the whitespace may go on in the next part
+                break
+            if end - gap_start >= WORD_GAP:
+                self._words_from = max(self._words_from, offset + gap_start)
+                self._add_words(offset + start)
+            separator = match.group()
+            kind = _SEPARATOR_KINDS.get(separator)
+            if kind is None:
+                kind = _SEPARATOR_KINDS[separator] = _separator_kind(separator)
+            positions.append(offset + end)
+            kinds.append(kind)
+            gap_start = scanned = end
+        self._gap_start = offset + gap_start
+        # the words of the gap may be collected up to a later position already
+        self._words_from = max(self._gap_start, self._words_from)
+        # a separator can't be longer, so the text before it is done with
+        self._scan_from = offset + (len(text) if final else max(scanned, len(text) - _SEPARATOR_MAX_LENGTH))
+        # the gap may go on after the scanned text, its words are collected as soon as it is long enough
+        if self._scan_from - self._gap_start >= WORD_GAP:
+            self._add_words(self._scan_from)
+
+    def _add_words(self, end: int) -> None:
+        offset = self._offset
+        last = self._words_from - offset
+        for match in _WORD_BREAK.finditer(self._text, last, end - offset):
+            if match.end() == end - offset:
+                break
+            self.index.positions.append(offset + match.end())
+            self.index.kinds.append(WORD)
+            last = match.end()
+        self._words_from = offset + max(last, end - offset - _SEPARATOR_MAX_LENGTH)
+
+
+def pick_page_end(index: BreakIndex, start: int, page_size: int) -> int:
+    """Choose where a page starting at `start` ends, if the text goes on
+    for more than `page_size` characters after it.
+
+    The page ends at the strongest break among the ones which make it at
+    least `PAGE_FILL` full, the last one of its kind. Without such breaks
+    it ends at the last break before, and a text without any whitespace
+    is cut at `page_size` characters.
+    """
+    positions, kinds = index.positions, index.kinds
+    limit = start + page_size
+    last = bisect_right(positions, limit) - 1
+    first = bisect_right(positions, start + int(page_size * PAGE_FILL))
+    if first <= last:
+        best = last
+        for i in range(last - 1, first - 1, -1):
+            if kinds[i] > kinds[best]:
+                best = i
+        return positions[best]
+    if last >= 0 and positions[last] > start:
+        return positions[last]
+    return limit
+
+
+def paginate_index(index: BreakIndex, page_size: int) -> array:
+    """Split the text of `index` into pages of at most `page_size`
+    characters with `pick_page_end`, without the text itself.
+
+    Returns:
+        Positions of the first characters of the pages.
+    """
+    starts = array('I')
+    start = 0
+    while start < index.length:
+        starts.append(start)
+        start = pick_page_end(index, start, page_size) if index.length - start > page_size else index.length
+    return starts
+
+
+def index_pages(pages: list[str]) -> BreakIndex:
+    """Build the `BreakIndex` of a paginated book, so it can be split
+    into pages of another size with `paginate_index`.
+
+    The text of the book is its pages joined. A space is put between two
+    pages if neither has whitespace at the joint, e.g. the pages of the
+    books saved before, which were stripped.
+
+    Args:
+        pages: texts of the pages.
+
+    Returns:
+        The index with `page_starts` filled.
+    """
+    indexer = BreakIndexer()
+    page_starts = array('I')
+    position = 0
+    previous = ''
+    for text in pages:
+        if previous and text and not previous[-1].isspace() and not text[0].isspace():
+            indexer.feed(' ')
+            position += 1
+        page_starts.append(position)
+        indexer.feed(text)
+        position += len(text)
+        previous = text or previous
+    index = indexer.close()
+    index.page_starts = page_starts
+    return index
+
+
+class Paginator:
+    """Incremental version of `iter_pages`.
+
+    Feed the text chunk by chunk, pages are returned as soon as they are
+    complete, and only the unfinished page is kept in memory. The pages
+    are the same as if the whole text had been passed to `iter_pages`.
+    After `close`, `index` is the `BreakIndex` of the text with `page_starts` filled.
+    """
+
+    def __init__(self, page_size: int = PAGE_SIZE):
+        self.page_size = page_size
+        self._indexer = BreakIndexer()
+        self.index = self._indexer.index
+        # the text of the unfinished page and its position in the text
+        self._buffer = ''
+        self._start = 0
+
+    def feed(self, text: str) -> list[str]:
+        text = _escape_html(text)
+        self._indexer.feed(text)
+        self._buffer += text
+        return self._split(final=False)
+
+    def close(self) -> list[str]:
+        self._indexer.close()
+        return self._split(final=True)
+
+    def _split(self, final: bool) -> list[str]:
+        pages = []
+        start = self._start
+        text_end = start + len(self._buffer)
+        # a page is cut only if the text goes beyond it, otherwise it may be the last one,
+        # and once all the breaks it may end at are indexed, e.g. the words of a long gap
+        while (text_end - start > self.page_size and start + self.page_size <= self._indexer.indexed_to
+               or final and start < text_end):
+            end = pick_page_end(self.index, start, self.page_size) if text_end - start > self.page_size else text_end
+            # the whitespace of a break stays at the end of the page, so the pages joined are the text
+            pages.append(self._buffer[start - self._start:end - self._start])
+            self.index.page_starts.append(start)
+            start = end
+        self._buffer = self._buffer[start - self._start:]
+        self._start = start
+        return pages
+
+
+def iter_pages(text: str, page_size: int = PAGE_SIZE) -> Iterator[str]:
+    """Split a book into pages lazily.
+
+    The text is normalized by `TextNormalizer` and escaped once, the
+    page ends are chosen by `pick_page_end`, preferably at the end of a
+    paragraph or a sentence.
+
+    Args:
+        text: a raw text of the book.
+        page_size: a maximum length of a page.
+
+    Yields:
+        Texts of the pages, the whitespace of a break ends a page.
+    """
+    normalizer = TextNormalizer()
+    paginator = Paginator(page_size)
+    for cur_idx in range(0, len(text), CHUNK_SIZE):
+        yield from paginator.feed(normalizer.feed(text[cur_idx:cur_idx + CHUNK_SIZE]))
+    yield from paginator.feed(normalizer.close())
+    yield from paginator.close()
+
+
+def prepare_book(text: str) -> list[str]:
+    return list(iter_pages(text))
+
+
+async def _stream_file(bot: Bot, file_path: str) -> AsyncIterator[bytes]:
+    session = await bot.session.create_session()
+    async with session.get(
+            bot.session.api.file_url(bot.token, file_path),
+            timeout=ClientTimeout(total=DOWNLOAD_TIMEOUT),
+            # the download may be aborted half way, such a connection can't be reused
+            headers={'Connection': 'close'},
+            raise_for_status=True
+    ) as response:
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            yield chunk
+
+
+async def download_file(bot: Bot, file_id: str, destination: BinaryIO) -> None:
+    """Stream a file from the Telegram server into `destination`.
+
+    Args:
+        bot: a bot whose session is used for downloading.
+        file_id: an identifier of the file on the Telegram server.
+        destination: a binary file to write the content to.
+
+    Raises:
+        BookTooLargeError: if the file is bigger than `MAX_BOOK_SIZE`.
+    """
+    file = await bot.get_file(file_id, request_timeout=DOWNLOAD_TIMEOUT)
+    if file.file_size and file.file_size > MAX_BOOK_SIZE:
+        raise BookTooLargeError()
+
+    downloaded = 0
+    stream = _stream_file(bot, file.file_path)
+    try:
+        async for chunk in stream:
+            downloaded += len(chunk)
+            if downloaded > MAX_BOOK_SIZE:
+                raise BookTooLargeError()
+            destination.write(chunk)
+    finally:
+        await stream.aclose()
+
+
+def read_text(path: str) -> Iterator[str]:
+    """Decode a downloaded text file chunk by chunk in the encoding
+    detected by its beginning and normalize it with `TextNormalizer`.
+
+    Only a chunk, the encoding sample and the whitespace held back by
+    the normalizer are in memory at a time, whatever the file size.
+
+    Args:
+        path: a path to the file.
+
+    Yields:
+        Consecutive parts of the normalized text.
+
+    Raises:
+        BadBookError: if the encoding can't be detected, the file can't
+            be decoded in it or there is no text left after normalizing,
+            e.g. in an empty file.
+    """
+    normalizer = TextNormalizer()
+    empty = True
+    with open(path, 'rb') as file:
+        chunk = file.read(ENCODING_SAMPLE_SIZE)
+        decoder = codecs.getincrementaldecoder(detect_encoding(chunk))()
+        try:
+            while chunk:
+                text = normalizer.feed(decoder.decode(chunk))
+                empty = empty and not text
+                yield text
+                chunk = file.read(CHUNK_SIZE)
+            text = normalizer.feed(decoder.decode(b'', final=True))
+        except UnicodeDecodeError:
+            raise BadBookError()
+    text += normalizer.close()
+    if empty and not text:
+        # a book without pages can't be opened
+        raise BadBookError()
+    yield text
+
+
+def paginate_file(path: str) -> tuple[list[str], BreakIndex]:
+    """Read a downloaded text file with `read_text` and split it into pages.
+
+    It is CPU-bound, so it is run in a worker process, see `services.ingestion`.
+
+    Args:
+        path: a path to the file.
+
+    Returns:
+        Texts of the pages and the `BreakIndex` of the text.
+
+    Raises:
+        BadBookError: if the file is not a text.
+    """
+    paginator = Paginator()
+    pages = []
+    for text in read_text(path):
+        pages.extend(paginator.feed(text))
+    pages.extend(paginator.close())
+    return pages, paginator.index
+
+
+def hash_file(path: str) -> bytes:
+    """Hash the normalized text of a downloaded file, so that copies of
+    a book which differ only in the encoding, line endings, a BOM or
+    whitespace get the same hash, see `UserInterface.link_book`.
+
+    Args:
+        path: a path to the file.
+
+    Returns:
+        A SHA-256 digest of the words of every non-empty line.
+
+    Raises:
+        BadBookError: if the file is not a text.
+    """
+    digest = hashlib.sha256()
+    # the lines of a normalized text have no whitespace around, but may be split between parts
+    in_line = False
+    for text in read_text(path):
+        for i, part in enumerate(text.split('\n')):
+            if i and in_line:
+                digest.update(b'\n')
+                in_line = False
+            if part:
+                digest.update(part.encode())
+                in_line = True
+    if in_line:
+        digest.update(b'\n')
+    return digest.digest()
 
 
 def pretty_name(name: str) -> str:
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from config_data.config import INGESTION_WORKERS, INGESTION_QUEUE_SIZE
+from database.compression import CompressedBook, compress_book
+from database.database import bot_database as db
+from lexicon.lexicon import LEXICON
+from services.file_handling import download_file, hash_file, paginate_file, BadBookError, BookTooLargeError, BreakIndex
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+def prepare_upload(path: str) -> tuple[list[str], CompressedBook | None, BreakIndex]:
+    """Paginate a downloaded file and compress the pages if page
+    compression is enabled. It is run in a worker process."""
+    pages, breaks = paginate_file(path)
+    return pages, compress_book(pages), breaks
+
+
+@dataclass
+class IngestionJob:
+    user_id: int
+    file_id: str
+    book_name: str
+    # the message which is edited to report the progress to the user
+    chat_id: int
+    message_id: int
+
+
+class IngestionQueue:
+    """Bounded queue of uploaded books.
+
+    Every worker downloads a file into a temporary file, paginates and
+    compresses it in a separate process, so that the event loop keeps
+    serving other users, saves the book and reports the result to the user.
+    A book which is already stored, uploaded by another user for example,
+    is recognized by the hash of its text and only linked to the library,
+    without paginating it again. On `stop` the users of the books still
+    queued or being processed are told to send them again.
+    """
+
+    def __init__(self, workers: int, max_size: int):
+        self.workers = workers
+        self.max_size = max_size
+        self._queue: asyncio.Queue[IngestionJob] | None = None
+        self._executor: ProcessPoolExecutor | None = None
+        self._tasks: list[asyncio.Task] = []
+        # the jobs the workers are busy with
+        self._running: list[IngestionJob] = []
+        self._bot: Bot | None = None
+        self._saved_books = {'stored': 0, 'linked': 0}
+        REGISTRY.add_collector(self._collect_metrics)
+
+    async def start(self, bot: Bot) -> None:
+        self._bot = bot
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+        # otherwise the users would see that the book is being processed forever
+        unfinished = self._running
+        self._running = []
+        while not self._queue.empty():
+            unfinished.append(self._queue.get_nowait())
+        await asyncio.gather(*(self._report(job, LEXICON['book_failed']) for job in unfinished))
+
+    def _collect_metrics(self) -> list:
+        if self._queue is None:
+            return []
+        return [
+            ('bot_ingestion_queue_jobs', 'gauge', 'Uploaded books waiting to be processed.',
+             [({}, self._queue.qsize())]),
+            ('bot_ingestion_books_total', 'counter', 'Uploaded books saved as new ones or linked to stored ones.',
+             [({'result': result}, count) for result, count in self._saved_books.items()]),
+        ]
+
+    def submit(self, job: IngestionJob) -> bool:
+        """Put the job in the queue. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            self._running.append(job)
+            try:
+                answer = await self._ingest(job)
+            except BookTooLargeError:
+                answer = LEXICON['book_too_large']
+            except BadBookError:
+                answer = LEXICON['cant_parse']
+            except Exception:
+                logger.exception('Failed to save the book "%s" of the user %d', job.book_name, job.user_id)
+                answer = LEXICON['book_failed']
+            finally:
+                self._queue.task_done()
+            self._running.remove(job)
+            await self._report(job, answer)
+
+    async def _ingest(self, job: IngestionJob) -> str:
+        loop = asyncio.get_running_loop()
+        book_name = '📖 ' + job.book_name
+        # the file is kept on disk, so the memory usage doesn't depend on the file size
+        with tempfile.NamedTemporaryFile(suffix='.txt', delete=False) as file:
+            path = file.name
+        try:
+            with open(path, 'wb') as file:
+                await download_file(self._bot, job.file_id, file)
+            content_hash = await loop.run_in_executor(self._executor, hash_file, path)
+            linked_name = await db.user_interface.link_book(job.user_id, content_hash, book_name)
+            if linked_name is None:
+                await self._report(job, LEXICON['book_paginating'])
+                pages, compressed, breaks = await loop.run_in_executor(self._executor, prepare_upload, path)
+        finally:
+            os.remove(path)
+
+        if linked_name is None:
+            await db.user_interface.save_book(job.user_id, book_name, pages, compressed, content_hash, breaks)
+            self._saved_books['stored'] += 1
+        elif linked_name != book_name:
+            return f'Эта книга уже есть в вашей библиотеке под именем "{linked_name.removeprefix("📖 ")}"'
+        else:
+            self._saved_books['linked'] += 1
+        return f'Книга успешно сохранена под именем "{job.book_name}"'
+
+    async def _report(self, job: IngestionJob, text: str) -> None:
+        try:
+            await self._bot.edit_message_text(text=text, chat_id=job.chat_id, message_id=job.message_id)
+        except TelegramAPIError:
+            logger.warning('Failed to report the progress to the user %d', job.user_id, exc_info=True)
+
+
+book_ingestion = IngestionQueue(INGESTION_WORKERS, INGESTION_QUEUE_SIZE)
@@ -0,0 +1,183 @@
+"""
+Metrics in the Prometheus text format, without a client library.
+
+Handlers and database methods record their latency and errors into the
+module-level metrics below. Statistics which already live elsewhere,
+such as the page cache counters, are read by collectors only when
+`/metrics` is requested.
+"""
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable
+
+from aiohttp import web
+
+# seconds, from a cached page turn to a slow Telegram call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# a collector returns (name, type, help, samples), samples are (labels, value) pairs
+Sample = tuple[dict[str, str], float]
+Collector = Callable[[], Iterable[tuple[str, str, str, list[Sample]]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        for label_values, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.label_names, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(
+            self,
+            name: str,
+            help_text: str,
+            label_names: tuple[str, ...] = (),
+            buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # per label values: observations per bucket (the last one is +Inf), sum
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        # only one bucket is incremented, the cumulative counts are computed on render
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, *label_values: str) -> int:
+        series = self._series.get(label_values)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_values, (bucket_counts, total) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, label_values, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+        self._collectors: list[Collector] = []
+
+    def register(self, metric: Counter | Histogram) -> Counter | Histogram:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    names, values = tuple(labels), tuple(labels.values())
+                    lines.append(f'{name}{_format_labels(names, values)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    'bot_handler_duration_seconds', 'Time spent in a handler, including Telegram calls.', ('handler',)
+))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    'bot_handler_errors_total', 'Exceptions raised by handlers.', ('handler', 'exception')
+))
+QUERY_LATENCY = REGISTRY.register(Histogram(
+    'bot_db_method_duration_seconds', 'Time spent in a database interface method.', ('method',)
+))
+QUERY_ERRORS = REGISTRY.register(Counter(
+    'bot_db_method_errors_total', 'Exceptions raised by database interface methods.', ('method', 'exception')
+))
+THROTTLED_UPDATES = REGISTRY.register(Counter(
+    'bot_throttled_updates_total',
+    'Updates not handled at once: page turns added up or delayed, and updates over the rate limit.', ('action',)
+))
+TELEGRAM_RETRIES = REGISTRY.register(Counter(
+    'bot_telegram_retries_total', 'Bot API calls repeated after a flood control error.', ('method',)
+))
+
+
+def timed_methods(cls: type) -> type:
+    """Class decorator recording the latency and errors of every public
+    coroutine method of the class, labelled `Class.method`."""
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or not inspect.iscoroutinefunction(method):
+            continue
+        setattr(cls, name, _timed(method, f'{cls.__name__}.{name}'))
+    return cls
+
+
+def _timed(method: Callable, label: str) -> Callable:
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception as error:
+            QUERY_ERRORS.inc(label, type(error).__name__)
+            raise
+        finally:
+            QUERY_LATENCY.observe(time.perf_counter() - started, label)
+
+    return wrapper
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve `/metrics` on a separate port, so it isn't exposed
+    together with the webhook."""
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
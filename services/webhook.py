@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import signal
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config_data.config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    MAX_CONCURRENT_UPDATES,
+    SHUTDOWN_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class ConcurrentRequestHandler(SimpleRequestHandler):
+    """Webhook handler which acknowledges an update right away and
+    handles it in the background, at most `max_concurrent` at a time.
+
+    When all slots are taken, the next request is acknowledged only
+    after a slot is freed, so Telegram slows down instead of the bot
+    piling up tasks. On shutdown new updates are refused, Telegram
+    delivers them again later, and the started ones are given
+    `shutdown_timeout` seconds to finish.
+    """
+
+    def __init__(
+            self,
+            dispatcher: Dispatcher,
+            bot: Bot,
+            max_concurrent: int,
+            shutdown_timeout: float,
+            secret_token: str = ''
+    ):
+        super().__init__(dispatcher, bot, handle_in_background=True)
+        self.secret_token = secret_token
+        self.shutdown_timeout = shutdown_timeout
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._tasks: set[asyncio.Task] = set()
+        self._closing = False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and request.headers.get(SECRET_TOKEN_HEADER) != self.secret_token:
+            raise web.HTTPUnauthorized()
+        update = await request.json(loads=self.bot.session.json_loads)
+
+        await self._slots.acquire()
+        if self._closing:
+            self._slots.release()
+            raise web.HTTPServiceUnavailable()
+        task = asyncio.create_task(self._handle_update(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._release)
+        return web.json_response({}, dumps=self.bot.session.json_dumps)
+
+    __call__ = handle
+
+    async def _handle_update(self, update: dict[str, Any]) -> None:
+        try:
+            await self._background_feed_update(self.bot, update)
+        except Exception:
+            logger.exception('Failed to handle the update %s', update.get('update_id'))
+
+    def _release(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._slots.release()
+
+    async def close(self) -> None:
+        self._closing = True
+        if self._tasks:
+            logger.info('Waiting for %d updates to be handled', len(self._tasks))
+            _, pending = await asyncio.wait(self._tasks, timeout=self.shutdown_timeout)
+            if pending:
+                logger.warning('%d updates were not handled in time and are cancelled', len(pending))
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        await super().close()
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot) -> None:
+    """Receive updates with a webhook until SIGTERM or SIGINT.
+
+    Every replica of the bot sets the same webhook, so several of them
+    can run behind a load balancer.
+    """
+    app = web.Application()
+    handler = ConcurrentRequestHandler(
+        dispatcher,
+        bot,
+        max_concurrent=MAX_CONCURRENT_UPDATES,
+        shutdown_timeout=SHUTDOWN_TIMEOUT,
+        secret_token=WEBHOOK_SECRET
+    )
+    handler.register(app, path=WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT, shutdown_timeout=SHUTDOWN_TIMEOUT)
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, stopping.set)
+
+    try:
+        await site.start()
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dispatcher.resolve_used_update_types()
+        )
+        logger.info('Listening for updates on %s:%d%s', WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
+        await stopping.wait()
+        logger.info('Stopping, no new updates are accepted')
+    finally:
+        # the listening socket is closed first, then the handler drains the started updates
+        await runner.cleanup()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(signal_number)
@@ -0,0 +1,6 @@
+import os
+
+# `config_data.config` requires these, the tests don't connect to Telegram or the database
+for name, value in (('BOT_TOKEN', '123456:test'), ('DB_HOST', '127.0.0.1'), ('DB_PORT', '5432'),
+                    ('DB_NAME', 'test'), ('DB_USER', 'test'), ('DB_PASSWORD', 'test')):
+    os.environ.setdefault(name, value)
@@ -0,0 +1,101 @@
+"""
+Tests of downloading uploaded books against a local stand-in of the
+Telegram Bot API server, which answers `getFile` and serves the file.
+"""
+import asyncio
+import io
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from services import file_handling
+from services.file_handling import BookTooLargeError, download_file
+
+TOKEN = '123456:test'
+FILE_PATH = 'documents/file_1.txt'
+
+
+class StandIn:
+    """The Bot API server for one file, `file_size` is the size it declares."""
+
+    def __init__(self, content: bytes, file_size: int | None = None, delay: float = 0):
+        self.content = content
+        self.file_size = file_size
+        # seconds the server waits in the middle of the file
+        self.delay = delay
+        self.downloads = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(f'/bot{TOKEN}/getFile', self.get_file)
+        app.router.add_get(f'/file/bot{TOKEN}/{FILE_PATH}', self.serve_file)
+        return app
+
+    async def get_file(self, request: web.Request) -> web.Response:
+        result = {'file_id': 'file', 'file_unique_id': 'unique', 'file_path': FILE_PATH}
+        if self.file_size is not None:
+            result['file_size'] = self.file_size
+        return web.json_response({'ok': True, 'result': result})
+
+    async def serve_file(self, request: web.Request) -> web.StreamResponse:
+        self.downloads += 1
+        response = web.StreamResponse()
+        await response.prepare(request)
+        half = len(self.content) // 2
+        await response.write(self.content[:half])
+        await asyncio.sleep(self.delay)
+        await response.write(self.content[half:])
+        await response.write_eof()
+        return response
+
+
+async def download(stand_in: StandIn) -> bytes:
+    server = TestServer(stand_in.app())
+    await server.start_server()
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(str(server.make_url('')))))
+    try:
+        destination = io.BytesIO()
+        await download_file(bot, 'file', destination)
+        return destination.getvalue()
+    finally:
+        await bot.session.close()
+        await server.close()
+
+
+@pytest.fixture(autouse=True)
+def small_limits(monkeypatch):
+    monkeypatch.setattr(file_handling, 'MAX_BOOK_SIZE', 1_000_000)
+    monkeypatch.setattr(file_handling, 'DOWNLOAD_TIMEOUT', 0.5)
+
+
+def test_download():
+    # several chunks, so the file is streamed in parts
+    content = 'Глава первая. '.encode() * 30_000
+    stand_in = StandIn(content, file_size=len(content))
+    assert asyncio.run(download(stand_in)) == content
+    assert stand_in.downloads == 1
+
+
+def test_file_declared_too_large_is_not_downloaded():
+    stand_in = StandIn(b'text', file_size=1_000_001)
+    with pytest.raises(BookTooLargeError):
+        asyncio.run(download(stand_in))
+    assert stand_in.downloads == 0
+
+
+def test_file_too_large_is_aborted():
+    # the size isn't declared, or it is wrong, the download is stopped at the limit
+    for file_size in (None, 100):
+        stand_in = StandIn(b'x' * 1_500_000, file_size=file_size)
+        with pytest.raises(BookTooLargeError):
+            asyncio.run(download(stand_in))
+
+
+def test_download_times_out():
+    stand_in = StandIn(b'text' * 1000, file_size=4000, delay=2)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(download(stand_in))
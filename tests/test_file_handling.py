@@ -0,0 +1,205 @@
+"""
+Regression tests of the pagination on the sample books from `books/`.
+
+The page boundaries are pinned in `data/page_boundaries.json`. If the
+pagination is changed on purpose, regenerate the file:
+
+    python -m tests.test_file_handling
+"""
+import glob
+import html
+import itertools
+import json
+import os
+import random
+from array import array
+
+import pytest
+
+from services.file_handling import (
+    MAX_PAGE_SIZE,
+    MIN_PAGE_SIZE,
+    PAGE_SIZE,
+    WORD,
+    BadBookError,
+    BreakIndex,
+    Paginator,
+    TextNormalizer,
+    _escape_html,
+    index_pages,
+    paginate_file,
+    paginate_index,
+    prepare_book
+)
+
+BOOKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'books')
+BOOKS = {os.path.basename(path): path for path in sorted(glob.glob(os.path.join(BOOKS_DIR, '*.txt')))}
+BOUNDARIES_PATH = os.path.join(os.path.dirname(__file__), 'data', 'page_boundaries.json')
+# the book tests are parametrized by the books, without them they would be skipped silently
+assert BOOKS, f'No sample books in {BOOKS_DIR}'
+
+
+def read_book(name: str) -> str:
+    with open(BOOKS[name], encoding='utf-8-sig') as file:
+        return file.read()
+
+
+def normalize(text: str, chunk_sizes=None) -> str:
+    normalizer = TextNormalizer()
+    parts = [normalizer.feed(chunk) for chunk in split(text, chunk_sizes)]
+    return ''.join(parts) + normalizer.close()
+
+
+def split(text: str, chunk_sizes=None) -> list[str]:
+    """Cut `text` into chunks of sizes taken from `chunk_sizes` in turn, the whole text by default."""
+    if chunk_sizes is None:
+        return [text]
+    chunks = []
+    start = 0
+    sizes = iter(chunk_sizes)
+    while start < len(text):
+        size = next(sizes)
+        chunks.append(text[start:start + size])
+        start += size
+    return chunks
+
+
+def paginate(text: str, chunk_sizes=None) -> tuple[list[str], BreakIndex]:
+    paginator = Paginator()
+    pages = []
+    for chunk in split(text, chunk_sizes):
+        pages.extend(paginator.feed(chunk))
+    pages.extend(paginator.close())
+    return pages, paginator.index
+
+
+def random_sizes(seed: int, largest: int):
+    generator = random.Random(seed)
+    while True:
+        yield generator.randint(1, largest)
+
+
+def full_index(index: BreakIndex, text: str) -> BreakIndex:
+    """Add the word breaks `BreakIndexer` leaves out, between every two words of the text."""
+    kinds = dict(zip(index.positions, index.kinds))
+    position = 0
+    for word in text.split(' '):
+        position += len(word) + 1
+        if position < len(text):
+            kinds.setdefault(position, WORD)
+    positions = sorted(kinds)
+    return BreakIndex(array('I', positions), bytearray(kinds[position] for position in positions), index.length)
+
+
+def page_lengths(pages: list[str]) -> list[int]:
+    return [len(page) for page in pages]
+
+
+@pytest.fixture(scope='module')
+def boundaries() -> dict[str, list[int]]:
+    with open(BOUNDARIES_PATH, encoding='utf-8') as file:
+        return json.load(file)
+
+
+@pytest.fixture(scope='module', params=sorted(BOOKS))
+def book(request) -> tuple[str, str]:
+    name = request.param
+    return name, read_book(name)
+
+
+def test_page_boundaries_are_pinned(book, boundaries):
+    name, text = book
+    lengths = page_lengths(prepare_book(text))
+    expected = boundaries[name]
+    mismatch = next((i for i, (length, pinned) in enumerate(zip(lengths, expected)) if length != pinned), None)
+    assert mismatch is None, f'page {mismatch + 1} is {lengths[mismatch]} characters, not {expected[mismatch]}'
+    assert len(lengths) == len(expected)
+
+
+def test_pages_are_the_text(book):
+    _, text = book
+    pages = prepare_book(text)
+    assert ''.join(pages) == _escape_html(normalize(text))
+    assert all(0 < len(page) <= PAGE_SIZE for page in pages)
+    assert all(page.strip() for page in pages)
+
+
+@pytest.mark.parametrize('seed, largest', [(1, 10), (2, 500), (3, 5000), (4, 100_000)])
+def test_paginator_ignores_chunking(book, seed, largest):
+    _, text = book
+    text = normalize(text)
+    if largest <= 10:
+        # a character or a few at a time is slow, the beginning of the book is enough
+        text = text[:30_000]
+    pages, index = paginate(text)
+    chunked_pages, chunked_index = paginate(text, random_sizes(seed, largest))
+    assert chunked_pages == pages
+    assert chunked_index == index
+
+
+def test_normalizer_ignores_chunking(book):
+    _, text = book
+    # the way books are usually found on the web, with indents and Windows line endings
+    text = '  ' + text.replace('\n', ' \r\n\t')
+    expected = normalize(text)
+    assert normalize(text, random_sizes(5, 2000)) == expected
+    assert normalize(text[:20_000], itertools.repeat(1)) == normalize(text[:20_000])
+
+
+def test_index_pages_restores_the_index(book):
+    _, text = book
+    pages, index = paginate(normalize(text))
+    restored = index_pages(pages)
+    assert restored == index
+    assert paginate_index(restored, PAGE_SIZE) == index.page_starts
+
+
+@pytest.mark.parametrize('page_size', [MIN_PAGE_SIZE, 777, PAGE_SIZE, 2000, MAX_PAGE_SIZE])
+def test_word_breaks_left_out_do_not_change_pages(book, page_size):
+    _, text = book
+    pages, index = paginate(normalize(text))
+    assert paginate_index(index, page_size) == paginate_index(full_index(index, ''.join(pages)), page_size)
+
+
+@pytest.mark.parametrize('data', [b'', b'   \r\n\r\n  \t', b'\x00\x01\x02' * 100])
+def test_file_without_text_is_rejected(tmp_path, data):
+    path = tmp_path / 'book.txt'
+    path.write_bytes(data)
+    with pytest.raises(BadBookError):
+        paginate_file(str(path))
+
+
+def test_text_without_punctuation_or_whitespace_is_paginated():
+    words = ' '.join(f'слово{i}' for i in range(10_000))
+    pages = prepare_book(words)
+    assert ''.join(pages) == words
+    assert all(PAGE_SIZE * 0.75 <= len(page) <= PAGE_SIZE for page in pages[:-1])
+    # the words near the end of a chunk are indexed with the next one, a page isn't cut before
+    assert paginate(words, random_sizes(6, 500)) == paginate(words)
+
+    letters = 'слово' * 10_000
+    pages = prepare_book(letters)
+    assert ''.join(pages) == letters
+    assert page_lengths(pages[:-1]) == [PAGE_SIZE] * (len(pages) - 1)
+
+
+@pytest.mark.parametrize('text', [
+    'Если a < b && b > c, то a < c. ' * 200,
+    '<' * 5000,
+    '&<>x' * 2000,
+], ids=['prose', 'brackets', 'mixed'])
+def test_html_entities_are_not_cut(text):
+    pages, index = paginate(normalize(text))
+    assert ''.join(pages) == html.escape(normalize(text), quote=False)
+    assert paginate(normalize(text), random_sizes(6, 500)) == (pages, index)
+    escaped = ''.join(pages)
+    for page_size in (MIN_PAGE_SIZE, 777, PAGE_SIZE):
+        starts = [*paginate_index(index, page_size), len(escaped)]
+        for start, end in zip(starts, starts[1:]):
+            page = escaped[start:end]
+            assert _escape_html(html.unescape(page)) == page
+
+
+if __name__ == '__main__':
+    with open(BOUNDARIES_PATH, 'w', encoding='utf-8') as file:
+        json.dump({name: page_lengths(prepare_book(read_book(name))) for name in BOOKS}, file, separators=(',', ':'))
@@ -0,0 +1,63 @@
+"""
+Tests of the shutdown of the ingestion queue against the local stand-in
+of the Bot API server from `test_download`.
+"""
+import asyncio
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from lexicon.lexicon import LEXICON
+from services.ingestion import IngestionJob, IngestionQueue
+from tests.test_download import TOKEN, StandIn
+
+
+class ReportingStandIn(StandIn):
+    """The stand-in which also records the texts the progress messages are edited to."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reports: dict[int, str] = {}
+
+    def app(self) -> web.Application:
+        app = super().app()
+        app.router.add_post(f'/bot{TOKEN}/editMessageText', self.edit_message_text)
+        return app
+
+    async def edit_message_text(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        self.reports[int(data['message_id'])] = data['text']
+        return web.json_response({'ok': True, 'result': True})
+
+
+@pytest.fixture(autouse=True)
+def lexicon(monkeypatch):
+    monkeypatch.setitem(LEXICON, 'book_failed', 'failed')
+
+
+async def stop_while_processing(stand_in: ReportingStandIn) -> None:
+    server = TestServer(stand_in.app())
+    await server.start_server()
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(str(server.make_url('')))))
+    queue = IngestionQueue(workers=1, max_size=10)
+    try:
+        await queue.start(bot)
+        for message_id in (1, 2):
+            assert queue.submit(IngestionJob(1, 'file', 'book', chat_id=1, message_id=message_id))
+        # the first book is being downloaded, the second one waits in the queue
+        while stand_in.downloads == 0:
+            await asyncio.sleep(0.01)
+        await queue.stop()
+    finally:
+        await bot.session.close()
+        await server.close()
+
+
+def test_unfinished_books_are_reported_on_stop():
+    stand_in = ReportingStandIn(b'text' * 1000, file_size=4000, delay=10)
+    asyncio.run(stop_while_processing(stand_in))
+    assert stand_in.reports == {1: 'failed', 2: 'failed'}